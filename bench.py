@@ -0,0 +1,60 @@
+import subprocess
+import sys
+from time import perf_counter
+
+from scheduler.bench import *
+from sender.bench import *
+from runner import Runner
+
+
+class RunBench:
+
+    data_dir = "data/examples"
+
+    @classmethod
+    def bench_scheduler(cls):
+        BenchJobScheduler().run()
+
+    @staticmethod
+    def _run_job_sender(job_path, user_path, template_path, done_path):
+        logs_dir, jobs_done_path = Runner.logs_dir, Runner.jobs_done_path
+        Runner.logs_dir, Runner.jobs_done_path = done_path.parent, done_path
+        try:
+            Runner.run_job_sender(job_path, user_path, template_path, gap_time=0)
+        finally:
+            Runner.logs_dir, Runner.jobs_done_path = logs_dir, jobs_done_path
+
+    @classmethod
+    def bench_sender(cls):
+        BenchBatchSender(cls.data_dir).run(runners={
+            'Runner.run_job_sender': cls._run_job_sender
+        })
+
+    @staticmethod
+    def _time_command(args, repeat):
+        """ :return: 多次运行的耗时中位数（毫秒） """
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            subprocess.run([sys.executable, *args], capture_output=True, check=True)
+            times.append(perf_counter() - start)
+        return sorted(times)[len(times) // 2] * 1000
+
+    @classmethod
+    def bench_cli(cls, repeat=10, budget=100):
+        """
+        cli 的启动耗时（包括 Python 解释器的启动），stats 和 verify 需要在 budget 毫秒内完成
+        :param budget: 耗时上限（毫秒）
+        """
+        baseline = cls._time_command(['-c', 'pass'], repeat)
+        print(f"python -c pass: {baseline:.1f} ms")
+        for command in (['stats'], ['verify', f"{cls.data_dir}/data_example.csv"]):
+            elapsed = cls._time_command(['-m', 'cli', *command], repeat)
+            mark = 'OK' if elapsed < budget else 'OVER BUDGET'
+            print(f"python -m cli {' '.join(command)}: {elapsed:.1f} ms [{mark}]")
+
+
+if __name__ == '__main__':
+    RunBench.bench_scheduler()
+    RunBench.bench_sender()
+    RunBench.bench_cli()
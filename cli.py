@@ -0,0 +1,198 @@
+"""
+命令行入口：python -m cli <命令> [参数]
+
+    schedule    读取 data/raw 中的 email，分配到 data/jobs 的批次中
+    send        发送一个 job 文件、一个批次，或者常驻运行（--worker）
+    verify      检查 email 文件的格式和重复，以及用户配置和模板
+    stats       统计 jobs_done 的发送结果和 data/jobs 中批次的状态
+
+每个命令只在运行时导入需要的模块，stats 和 verify 不会导入 smtplib、socks 等发送相关的模块。
+"""
+import argparse
+import csv
+import sys
+from collections import Counter
+from pathlib import Path
+
+from runner import Runner
+
+
+def _schedule(args):
+    Runner.run_job_scheduler(batch_size=args.batch_size,
+                             stream=args.stream,
+                             memory_budget=args.memory_budget,
+                             mx_grouping=args.mx,
+                             store=args.store,
+                             domains_cn_file=args.domains_cn_file,
+                             processes=args.processes)
+
+
+def _send(args):
+    kwargs = {}
+    if args.gap_time is not None:
+        kwargs['gap_time'] = args.gap_time
+    user_path = args.user[0]
+
+    if len(args.user) > 1:
+        # 账号池只发送 job 文件（不指定时为 data/jobs 下所有的批次），每个账号一个会话
+        if args.batch is not None or args.to or args.worker:
+            args.parser.error("several --user paths can only be used with --job")
+        if args.concurrency > 1:
+            args.parser.error("--concurrency can not be used with several --user paths")
+        Runner.run_pool_sender(args.user, args.template, job_paths=args.job, **kwargs)
+    elif args.worker:
+        Runner.run_worker(user_path, args.template, processes=args.processes,
+                          concurrency=args.concurrency, sender=kwargs)
+    elif args.batch is not None:
+        Runner.run_batch_sender(args.batch, user_path, args.template,
+                                concurrency=args.concurrency, **kwargs)
+    elif args.to:
+        Runner.run_sender(user_path, args.template, args.to)
+    elif args.job:
+        for job_path in args.job:
+            Runner.run_job_sender(job_path, user_path, args.template,
+                                  concurrency=args.concurrency, **kwargs)
+    else:
+        print("Nothing to send: use --job, --batch, --to or --worker.")
+        return 1
+    return 0
+
+
+def _verify(args):
+    from scheduler.clean import AddressCleaner
+    from scheduler.ingest import iter_column
+
+    code = 0
+    paths = args.paths or sorted(Runner.raw_dir.glob('*.csv'))
+    cleaner = AddressCleaner()
+    total = valid = 0
+    for path in paths:
+        emails = list(iter_column(path, args.column))
+        total += len(emails)
+        valid += sum(1 for _ in cleaner.clean(emails))
+    print(f"Files: {len(paths)}, emails: {total}, valid: {valid}, "
+          f"invalid: {cleaner.count['invalid']}, duplicate: {cleaner.count['duplicate']}")
+
+    if args.user:
+        from sender.user import User
+        try:
+            User(args.user)
+            print(f"User [{args.user}] OK.")
+        except Exception as e:
+            print(f"User [{args.user}] invalid: {e!r}")
+            code = 1
+    if args.template:
+        from sender.template import load_template
+        try:
+            load_template(args.template)
+            print(f"Template [{args.template}] OK.")
+        except Exception as e:
+            print(f"Template [{args.template}] invalid: {e!r}")
+            code = 1
+    return code
+
+
+def _count_done(done_path):
+    """ :return: Counter {状态: 数量}，同一个 email 以最后一次的结果为准 """
+    statuses = {}
+    try:
+        with open(done_path, mode='r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            fieldnames = next(reader, [])
+            if 'EMAIL' not in fieldnames or 'STATUS' not in fieldnames:
+                return Counter()
+            email_idx, status_idx = fieldnames.index('EMAIL'), fieldnames.index('STATUS')
+            for row in reader:
+                if len(row) > max(email_idx, status_idx):
+                    statuses[row[email_idx]] = row[status_idx]
+    except FileNotFoundError:
+        pass
+    return Counter(statuses.values())
+
+
+def _count_jobs(jobs_dir):
+    """ :return: Counter {批次状态: 数量}，状态由 JobWorker 的 lock/done/failed 文件决定 """
+    count = Counter()
+    for job_path in jobs_dir.glob('jobs_batch_*.csv'):
+        for suffix in ('.done', '.lock', '.failed'):
+            if job_path.with_name(job_path.name + suffix).exists():
+                count[suffix[1:]] += 1
+                break
+        else:
+            count['pending'] += 1
+    return count
+
+
+def _stats(args):
+    done = _count_done(Path(args.done_path))
+    print(f"Jobs done [{args.done_path}]: {sum(done.values())}")
+    for status, n in done.most_common():
+        print(f"  {status}: {n}")
+
+    jobs_dir = Path(args.jobs_dir)
+    jobs = _count_jobs(jobs_dir)
+    print(f"Job files [{jobs_dir}]: {sum(jobs.values())}")
+    for status in ('pending', 'lock', 'failed', 'done'):
+        if jobs[status]:
+            print(f"  {status}: {jobs[status]}")
+
+    store_path = jobs_dir / Runner.jobs_store_path.name
+    if store_path.exists():
+        from scheduler.store import JobStore
+        with JobStore(store_path) as store:
+            print(f"Job store [{store_path}]: {len(store)} batches")
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Email scheduler and sender.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    schedule = commands.add_parser('schedule', help="assign raw emails to job batches")
+    schedule.add_argument('--batch-size', type=int, default=100)
+    schedule.add_argument('--stream', action='store_true',
+                          help="stream all csv files in data/raw with StreamJobScheduler")
+    schedule.add_argument('--memory-budget', type=int, default=None, help="bytes, with --stream")
+    schedule.add_argument('--mx', action='store_true', help="group domains by MX records")
+    schedule.add_argument('--store', action='store_true', help="save batches in data/jobs/jobs.db")
+    schedule.add_argument('--domains-cn-file', default=None,
+                          help="CN domain rules to exclude, one rule per line, instead of the defaults")
+    schedule.add_argument('--processes', type=int, default=None,
+                          help="processes reading data and done files, 1: no process pool")
+    schedule.set_defaults(func=_schedule)
+
+    send = commands.add_parser('send', help="send job files, a stored batch, or run the worker")
+    send.add_argument('--user', nargs='+', required=True,
+                      help="user config path, several paths send with an account pool")
+    send.add_argument('--template', required=True)
+    mode = send.add_mutually_exclusive_group()
+    mode.add_argument('--job', nargs='+', default=None, help="job file paths")
+    mode.add_argument('--batch', default=None, help="batch id in data/jobs/jobs.db")
+    mode.add_argument('--to', nargs='+', default=None, help="receivers")
+    mode.add_argument('--worker', action='store_true', help="claim and send batches in data/jobs")
+    send.add_argument('--concurrency', type=int, default=1)
+    send.add_argument('--processes', type=int, default=2, help="worker processes, with --worker")
+    send.add_argument('--gap-time', type=float, default=None)
+    send.set_defaults(func=_send, parser=send)
+
+    verify = commands.add_parser('verify', help="check email files, user config and template")
+    verify.add_argument('paths', nargs='*', help="csv files, default: data/raw/*.csv")
+    verify.add_argument('--column', default='EMAIL')
+    verify.add_argument('--user', default=None)
+    verify.add_argument('--template', default=None)
+    verify.set_defaults(func=_verify)
+
+    stats = commands.add_parser('stats', help="summarize jobs_done and job batches")
+    stats.add_argument('--done-path', default=str(Runner.jobs_done_path))
+    stats.add_argument('--jobs-dir', default=str(Runner.jobs_dir))
+    stats.set_defaults(func=_stats)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,11 @@
-from runner import Runner
+import sys
 
+from cli import main
 
-if __name__ == '__main__':
-    # Runner.run_job_scheduler()
-
-    user = 'data/user_qiu/qiu.json'
-    template = 'data/user_qiu/letter.txt'
 
-    # Runner.run_sender(user, template,[''])
-
-    job_path = 'data/user_qiu/job_test.csv'
-    Runner.run_job_sender(job_path, user, template)
+if __name__ == '__main__':
+    # 运行模式由命令行参数选择，例如：
+    # python main.py schedule --batch-size 100
+    # python main.py send --user data/user_qiu/qiu.json --template data/user_qiu/letter.txt \
+    #     --job data/user_qiu/job_test.csv
+    sys.exit(main())
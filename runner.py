@@ -1,48 +1,166 @@
 from pathlib import Path
 
-from scheduler import *
-from sender import *
-
 
 class Runner:
 
+    """
+    各个运行模式的入口。scheduler 和 sender 在各个方法中才导入，
+    只用到其中一部分的命令（例如 cli 的 stats）不需要导入 smtplib、socks 等模块。
+    """
+
     jobs_dir = Path('data/jobs')
     logs_dir = Path('data/logs')
     raw_file = Path('data/raw/data.csv')
+    raw_dir = Path('data/raw')
     jobs_done_path = logs_dir / 'jobs_done.csv'
+    jobs_store_path = jobs_dir / 'jobs.db'
 
     @classmethod
-    def run_job_scheduler(cls, batch_size=100):
+    def run_job_scheduler(cls, batch_size=100, stream=False, memory_budget=None, mx_grouping=False,
+                          store=False, classifier=None, domains_cn_file=None, processes=None):
+        """
+        :param stream: True: 使用 StreamJobScheduler 流式处理 data/raw 下所有的 csv 文件
+        :param memory_budget: 流式处理时的内存上限（字节）
+        :param mx_grouping: True: 按 MX 记录（收件服务商）分配批次，需要安装 dnspython，
+            查询结果缓存在 data/logs/mx_cache.json
+        :param store: True: 所有批次保存在 data/jobs/jobs.db 中，用 run_batch_sender 按批次编号发送
+        :param classifier: EmailClassifier 的参数，例如 {'ignore_cn': False, 'done_index': True}
+        :param domains_cn_file: 需要排除的 cn 域名规则文件，代替默认的 domains_cn，格式参考 DomainMatcher.from_file
+        :param processes: 并行读取数据文件和 done 文件的进程数量，为空时自动选择，1: 不使用进程池
+        """
+        from scheduler import JobScheduler, StreamJobScheduler, MXGrouper
 
         if not cls.jobs_dir.exists():
             cls.jobs_dir.mkdir()
 
-        js = JobScheduler(
-            data_path=cls.raw_file,
-            jobs_dir=cls.jobs_dir,
-            done_path=cls.jobs_done_path,
-            batch_size=batch_size
-        )
+        kwargs = {}
+        if mx_grouping:
+            if not cls.logs_dir.exists():
+                cls.logs_dir.mkdir()
+            kwargs['mx_grouper'] = MXGrouper(cache_path=cls.logs_dir / 'mx_cache.json')
+        if store:
+            kwargs['store'] = cls.jobs_store_path
+        classifier = dict(classifier or {})
+        if domains_cn_file:
+            classifier['domains_cn_file'] = domains_cn_file
+        if processes:
+            classifier['processes'] = processes
+        if classifier:
+            kwargs['classifier'] = classifier
+
+        if stream:
+            if memory_budget:
+                kwargs['memory_budget'] = memory_budget
+            js = StreamJobScheduler(
+                data_path=sorted(cls.raw_dir.glob('*.csv')),
+                jobs_dir=cls.jobs_dir,
+                done_path=cls.jobs_done_path,
+                batch_size=batch_size,
+                **kwargs
+            )
+        else:
+            js = JobScheduler(
+                data_path=cls.raw_file,
+                jobs_dir=cls.jobs_dir,
+                done_path=cls.jobs_done_path,
+                batch_size=batch_size,
+                **kwargs
+            )
         js.clear_job_files()
         js.assign_jobs()
 
     @classmethod
-    def run_job_sender(cls, job_path, user_path, template_path):
+    def run_job_sender(cls, job_path, user_path, template_path, concurrency=1, **kwargs):
+        """
+        :param concurrency: 同一个账号的并发会话数量，大于 1 时使用 AsyncBatchSender
+        :param kwargs: BatchSender 的参数，例如 gap_time
+        """
+        from sender import BatchSender, AsyncBatchSender
 
         if not cls.logs_dir.exists():
             cls.logs_dir.mkdir()
 
-        sender = BatchSender(
+        sender_cls = BatchSender
+        if concurrency > 1:
+            sender_cls = AsyncBatchSender
+            kwargs['concurrency'] = concurrency
+
+        sender = sender_cls(
             user_path=user_path,
             template_path=template_path,
             receivers_path=job_path,
-            done_path=cls.jobs_done_path
+            done_path=cls.jobs_done_path,
+            **{'metrics_path': cls.logs_dir / 'sender_metrics', **kwargs}
         )
 
         sender.run()
 
+    @classmethod
+    def run_batch_sender(cls, batch_id, user_path, template_path, concurrency=1, **kwargs):
+        """
+        发送 data/jobs/jobs.db 中的一个批次
+        :param batch_id: 批次编号，例如 '3' 或者 '0_1'
+        """
+        from scheduler import JobStore
+
+        with JobStore(cls.jobs_store_path) as store:
+            cls.run_job_sender(None, user_path, template_path, concurrency=concurrency,
+                               store=store, batch_id=batch_id, **kwargs)
+
+    @classmethod
+    def run_worker(cls, user_path, template_path, processes=2, **kwargs):
+        """
+        常驻运行：监视 data/jobs，领取 jobs_batch_*.csv 并在 processes 个子进程中发送，
+        可以同时启动多个，同一个批次只会被发送一次。按 Ctrl+C 停止，正在发送的批次放回队列。
+        :param kwargs: JobWorker 的参数，例如 poll_time, lease, sender={'gap_time': 10}
+        """
+        from sender import JobWorker
+
+        if not cls.logs_dir.exists():
+            cls.logs_dir.mkdir()
+        if not cls.jobs_dir.exists():
+            cls.jobs_dir.mkdir()
+
+        worker = JobWorker(
+            jobs_dir=cls.jobs_dir,
+            user_path=user_path,
+            template_path=template_path,
+            done_path=cls.jobs_done_path,
+            processes=processes,
+            **{'metrics_path': cls.logs_dir / 'sender_metrics', **kwargs}
+        )
+
+        worker.run()
+
+    @classmethod
+    def run_pool_sender(cls, user_paths, template_path, job_paths=None, **kwargs):
+        """
+        多个账号并行发送
+        :param user_paths: 用户配置文件的路径列表
+        :param job_paths: job 文件的路径列表，为空时发送 data/jobs 下所有的 jobs_batch_*.csv
+        :param kwargs: AccountPool 的参数，例如 gap_time
+        """
+        from sender import AccountPool
+
+        if not cls.logs_dir.exists():
+            cls.logs_dir.mkdir()
+
+        if job_paths is None:
+            job_paths = sorted(cls.jobs_dir.glob('jobs_batch_*.csv'))
+
+        pool = AccountPool(
+            user_paths=user_paths,
+            template_path=template_path,
+            jobs_paths=job_paths,
+            done_path=cls.jobs_done_path,
+            **kwargs
+        )
+
+        pool.run()
+
     @classmethod
     def run_sender(cls, user_path, template_path, receivers):
+        from sender import BatchSender
 
         if not cls.logs_dir.exists():
             cls.logs_dir.mkdir()
@@ -1,5 +1,21 @@
-from .job import JobScheduler
+from importlib import import_module
 
 
-__all__ = ['JobScheduler']
+# 子模块在第一次访问时才导入（PEP 562），例如 `from scheduler import JobStore` 只导入 scheduler.store
+_exports = {
+    'JobScheduler': '.job',
+    'StreamJobScheduler': '.stream',
+    'MXGrouper': '.mx',
+    'JobStore': '.store',
+}
 
+
+__all__ = ['JobScheduler', 'StreamJobScheduler', 'MXGrouper', 'JobStore']
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
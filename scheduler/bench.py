@@ -0,0 +1,90 @@
+import csv
+import random
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from .job import JobScheduler
+
+
+__all__ = ['BenchJobScheduler']
+
+
+def _legacy_get_batches(scheduler, classified_emails):
+    """ 原来的实现：每一轮都遍历所有的域名，用于对比 """
+    res = []
+    empty_keys = set()
+    while len(empty_keys) < len(classified_emails):
+        batch = []
+        for key, values in classified_emails.items():
+            if key in empty_keys:
+                continue
+            count = 0
+            tolerance = scheduler._get_tolerance(key)
+            while len(values) > 0 and count < tolerance:
+                if item := values.pop():
+                    batch.append(item)
+                    count += 1
+            if len(values) == 0:
+                empty_keys.add(key)
+        if batch:
+            res.append(batch)
+    return res
+
+
+class BenchJobScheduler(object):
+
+    """
+    在域名分布倾斜的数据上对比 JobScheduler._get_batches 的新旧实现：
+    少数大域名（gmail.com, outlook.com）加上大量只有几个 email 的长尾域名。
+    """
+
+    def __init__(self, big=None, tail_domains=5000, tail_size=3):
+        """
+        :param big: dict {域名: email 数量}
+        :param tail_domains: 长尾域名的数量
+        :param tail_size: 每个长尾域名的最大 email 数量
+        """
+        self._big = big if big else {'gmail.com': 20000, 'outlook.com': 10000}
+        self._tail_domains = tail_domains
+        self._tail_size = tail_size
+
+    def _write_data(self, data_path):
+        rnd = random.Random(0)
+        with open(data_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['EMAIL'])
+            for domain, n in self._big.items():
+                writer.writerows([f"user{i}@{domain}"] for i in range(n))
+            for d in range(self._tail_domains):
+                n = rnd.randint(1, self._tail_size)
+                writer.writerows([f"user{i}@tail{d}.com"] for i in range(n))
+
+    @staticmethod
+    def _time(func, classified):
+        classified = {k: list(v) for k, v in classified.items()}
+        start = perf_counter()
+        batches = func(classified)
+        return perf_counter() - start, batches
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_path = Path(tmp_dir) / 'data.csv'
+            self._write_data(data_path)
+            js = JobScheduler(data_path=data_path,
+                              done_path=Path(tmp_dir) / 'jobs_done.csv',
+                              jobs_dir=tmp_dir)
+            classified = js._ec.classify()
+
+        t_new, new = self._time(js._get_batches, classified)
+        t_old, old = self._time(lambda c: _legacy_get_batches(js, c), classified)
+
+        assert [set(b) for b in new] == [set(b) for b in old], AssertionError(
+            "Batches of the two implementations are different!"
+        )
+        total = sum(len(v) for v in classified.values())
+        print(f">> [{self.__class__.__name__}] emails = {total}, "
+              f"domains = {len(classified)}, batches = {len(new)}\n"
+              f">> - legacy: {t_old:.3f}s\n"
+              f">> - heap: {t_new:.3f}s\n"
+              f">> - speedup: {t_old / max(t_new, 1e-9):.1f}x")
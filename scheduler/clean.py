@@ -0,0 +1,140 @@
+import re
+from array import array
+from itertools import islice
+
+from .index import hash_email
+
+
+# 与 sender.message 中发送前的校验规则相同
+_EMAIL_PATTERN = re.compile(r'[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}')
+
+
+def is_valid_email(email):
+    """ :param email: 已规范化（小写）的 email """
+    return _EMAIL_PATTERN.fullmatch(email) is not None
+
+
+class HashSet(object):
+
+    """
+    64 位哈希值的集合：开放寻址（线性探测），数据保存在 array('Q') 中，每个元素约 16 字节，
+    比 Python 的 set（每个元素约 60 字节以上）节省内存。0 用作空位，哈希值为 0 时记为 1。
+    """
+
+    _min_capacity = 1024
+
+    def __init__(self):
+        self._table = array('Q', bytes(8 * self._min_capacity))
+        self._mask = self._min_capacity - 1
+        self._size = 0
+
+    def _insert(self, table, mask, h):
+        i = h & mask
+        while True:
+            v = table[i]
+            if v == 0:
+                table[i] = h
+                return True
+            if v == h:
+                return False
+            i = (i + 1) & mask
+
+    def _grow(self):
+        capacity = (self._mask + 1) * 2
+        table = array('Q', bytes(8 * capacity))
+        mask = capacity - 1
+        for h in self._table:
+            if h:
+                self._insert(table, mask, h)
+        self._table, self._mask = table, mask
+
+    def add(self, h):
+        """ :return: True 表示新加入，False 表示已经存在 """
+        h = h or 1
+        if self._insert(self._table, self._mask, h):
+            self._size += 1
+            # 装载因子不超过 1/2
+            if self._size * 2 > self._mask + 1:
+                self._grow()
+            return True
+        return False
+
+    def __contains__(self, h):
+        h = h or 1
+        table, mask = self._table, self._mask
+        i = h & mask
+        while True:
+            v = table[i]
+            if v == 0:
+                return False
+            if v == h:
+                return True
+            i = (i + 1) & mask
+
+    def __len__(self):
+        return self._size
+
+
+class AddressCleaner(object):
+
+    """
+    分配任务前的 email 预处理：规范化 -> 校验 -> 去重，保证发送时不会遇到格式错误或重复的地址。
+    1、规范化：去掉首尾的空白、引号和尖括号，转换成小写，例如 ` <Bob@Gmail.com>` -> `bob@gmail.com`；
+    2、校验：用预编译的正则表达式检查格式，不合法的地址丢弃；
+    3、去重：按规范化后的 64 位哈希值去重（HashSet），可以跨多个原始文件。
+    数据按 chunk_size 分块处理，count 中记录丢弃的数量。
+    """
+
+    _config = {
+        'chunk_size': 10000,  # 每次处理的 email 数量
+    }
+
+    def __init__(self, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._seen = HashSet()
+        self.count = {
+            'invalid': 0,  # 格式不合法
+            'duplicate': 0,  # 重复
+        }
+
+    def _chunks(self, emails):
+        emails = iter(emails)
+        while chunk := list(islice(emails, self._config['chunk_size'])):
+            yield chunk
+
+    def validate(self, emails):
+        """
+        规范化并校验。
+        :param emails: email 的可迭代对象
+        :return: generator, 合法的、规范化后的 email
+        """
+        fullmatch = _EMAIL_PATTERN.fullmatch
+        for chunk in self._chunks(emails):
+            normalized = [em.strip().strip('"\'<>').strip().lower() for em in chunk]
+            valid = [em for em in normalized if fullmatch(em)]
+            self.count['invalid'] += len(normalized) - len(valid)
+            yield from valid
+
+    def unique(self, emails):
+        """
+        去重，emails 需要已经规范化。
+        :return: generator, 第一次出现的 email
+        """
+        add = self._seen.add
+        for chunk in self._chunks(emails):
+            kept = [em for em in chunk if add(hash_email(em))]
+            self.count['duplicate'] += len(chunk) - len(kept)
+            yield from kept
+
+    def clean(self, emails):
+        return self.unique(self.validate(emails))
+
+    def clear(self):
+        """ 清空去重的集合，丢弃的数量保持不变 """
+        self._seen = HashSet()
@@ -0,0 +1,103 @@
+class _Node(object):
+
+    __slots__ = ['children', 'exact', 'suffix']
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None  # 域名完全相同时匹配的值
+        self.suffix = None  # 子域名匹配的值
+
+
+class DomainMatcher(object):
+
+    """
+    域名规则匹配：把规则按反转后的标签（label）保存在字典树中，
+    每次查找只需要按域名的标签走一遍，与规则的数量无关。
+    支持三种规则：
+    1、精确匹配，例如 `qq.com` 只匹配 qq.com；
+    2、后缀匹配，例如 `.edu.cn` 匹配 edu.cn 的所有子域名，例如 pku.edu.cn、cs.pku.edu.cn；
+    3、通配符，例如 `*.example.com` 中的 `*` 匹配任意一个标签，例如 mail.example.com。
+    多条规则同时匹配时，匹配的标签越多越优先，标签数量相同时精确的标签优先于通配符。
+    """
+
+    def __init__(self, rules=None):
+        """
+        :param rules: dict {规则: 值}，或者规则的集合（值为 True）
+        """
+        self._root = _Node()
+        self._size = 0
+        if rules is None:
+            return
+        if not isinstance(rules, dict):
+            rules = {rule: True for rule in rules}
+        for rule, value in rules.items():
+            self.add(rule, value)
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        从规则文件读取规则，每行一条规则，可以在规则后面跟一个整数值，以 `#` 开头的行是注释。
+        例如:
+        gmail.com 3
+        .edu.cn
+        """
+        matcher = cls()
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                items = line.split()
+                value = int(items[1]) if len(items) > 1 else True
+                matcher.add(items[0], value)
+        return matcher
+
+    def add(self, rule, value=True):
+        rule = rule.strip().lower()
+        is_suffix = rule.startswith('.')
+        node = self._root
+        for label in reversed(rule.strip('.').split('.')):
+            if label not in node.children:
+                node.children[label] = _Node()
+            node = node.children[label]
+        if is_suffix:
+            node.suffix = value
+        else:
+            node.exact = value
+        self._size += 1
+
+    def _search(self, node, labels, i, literal):
+        """
+        从字典树的 node 开始匹配 labels[i:]（labels 已反转）。
+        :return: (优先级, 值)，没有匹配时返回 None
+        """
+        best = None
+        if i == len(labels):
+            if node.exact is not None:
+                best = ((i, literal, 1), node.exact)
+            return best
+        if node.suffix is not None:
+            best = ((i, literal, 0), node.suffix)
+        for key in (labels[i], '*'):
+            child = node.children.get(key)
+            if child is None:
+                continue
+            res = self._search(child, labels, i + 1, literal + (key != '*'))
+            if res is not None and (best is None or res[0] > best[0]):
+                best = res
+        return best
+
+    def match(self, domain, default=None):
+        """
+        :param domain: 域名，例如 example.com
+        :return: 匹配的规则对应的值，没有匹配时返回 default
+        """
+        labels = domain.strip().lower().split('.')[::-1]
+        res = self._search(self._root, labels, 0, 0)
+        return default if res is None else res[1]
+
+    def __contains__(self, domain):
+        return self.match(domain) is not None
+
+    def __len__(self):
+        return self._size
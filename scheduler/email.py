@@ -1,30 +1,7 @@
-import csv
-from pathlib import Path
-
-
-def _read_column(filepath, col):
-    """
-    从 csv 文件中读取一列（有标题列）
-    :param filepath: 文件路径
-    :param col: 列名
-    :return: list
-    """
-    res = []
-    if not Path(filepath).exists():
-        return res
-    try:
-        with open(filepath, mode='r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            # 检查 EMAIL 列是否存在
-            if col not in reader.fieldnames:
-                return res
-            for row in reader:
-                item = row[col].strip()
-                if item:  # 仅添加非空的item
-                    res.append(item)
-    except Exception as e:
-        print(f"Error reading {filepath}: {e}")
-    return res
+from .index import DoneIndex
+from .domain import DomainMatcher
+from .clean import AddressCleaner
+from .ingest import ingest
 
 
 class EmailClassifier(object):
@@ -35,10 +12,17 @@ class EmailClassifier(object):
     """
     _config = {
         'ignore_cn': True,
-        'domains_cn': {'163.com', '126.com', 'qq.com', 'sina.com', 'sohu.com',  # 服务商
-                       '.com.cn', 'tycc.cn', 'huawei.com',  # 企业
-                       '.edu.cn', 'org.cn', '.ac.cn',  # 大学/组织
+        'done_index': False,  # True: 把 done 数据的哈希索引保存到磁盘，并增量更新
+        # 域名规则，参考 DomainMatcher：`qq.com` 精确匹配，`.edu.cn` 匹配子域名，`*` 匹配任意一个标签
+        # 服务商和企业同时匹配域名本身和子域名，例如 vip.qq.com、mail.huawei.com，但不匹配 qq.company.io
+        'domains_cn': {'163.com', '.163.com', '126.com', '.126.com', 'qq.com', '.qq.com',  # 服务商
+                       'sina.com', '.sina.com', 'sohu.com', '.sohu.com',
+                       '.com.cn', 'tycc.cn', '.tycc.cn', 'huawei.com', '.huawei.com',  # 企业
+                       '.edu.cn', '.org.cn', '.ac.cn',  # 大学/组织
                        },
+        'domains_cn_file': None,  # 域名规则文件，非空时代替 domains_cn
+        'clean': True,  # True: 用 AddressCleaner 规范化、校验并去重（跨所有数据文件）
+        'processes': None,  # 并行读取数据文件和 done 文件的进程数量，为空时自动选择，1: 不使用进程池
     }
 
     def __init__(self, data_path, done_path, **kwargs):
@@ -46,15 +30,18 @@ class EmailClassifier(object):
         :param data_path: str, email 数据文件的路径，或者多个数据文件的路径列表
         :param done_path: str, email done 数据文件的路径或者多个数据文件的路径列表
         """
+        self._config = dict(self._config)
         for k, v in kwargs.items():
-            self._config[k] = v
             if k in self._config.keys():
                 self._config[k] = v
             else:
-                raise (ValueError(f"Error key `{k}`"))
+                raise (ValueError(f"Wrong input parameter `{k}`"))
 
+        self._domains_cn = self._load_domains_cn()
+        self._cleaner = AddressCleaner()
         self._email_list = self._load_email_list(data_path)
-        self._emails_done = self._load_email_list(done_path)
+        self._emails_done = DoneIndex(done_path, persist=self._config['done_index'],
+                                      processes=self._config['processes'])
         self._emails_removed = {
             'done': [],
             'cn': []
@@ -62,6 +49,11 @@ class EmailClassifier(object):
         self._remove_emails_cn()
         self._remove_emails_done()
 
+    def _load_domains_cn(self):
+        if self._config['domains_cn_file']:
+            return DomainMatcher.from_file(self._config['domains_cn_file'])
+        return DomainMatcher(self._config['domains_cn'])
+
     def _load_email_list(self, data_path):
         """
         读取csv文件中的email数据。
@@ -73,10 +65,14 @@ class EmailClassifier(object):
         else:
             self._data_paths = [data_path]
 
-        email_list = []
-        for filepath in self._data_paths:
-            email_list += _read_column(filepath, col='EMAIL')
-        return email_list
+        # 每个文件在子进程中读取并校验，去重需要看到所有文件，在当前进程中完成
+        emails, self._domain_count, invalid = ingest(self._data_paths, col='EMAIL',
+                                                     validate=self._config['clean'],
+                                                     processes=self._config['processes'])
+        if self._config['clean']:
+            self._cleaner.count['invalid'] += invalid
+            emails = list(self._cleaner.unique(emails))
+        return emails
 
     def _remove_emails_cn(self):
         if not self._config['ignore_cn']:
@@ -93,7 +89,7 @@ class EmailClassifier(object):
         self._emails_removed['cn'] = removed
 
     def _remove_emails_done(self):
-        if not self._emails_done:
+        if len(self._emails_done) == 0:
             return
         kept = []
         removed = []
@@ -107,11 +103,7 @@ class EmailClassifier(object):
         self._emails_removed['done'] = removed
 
     def _is_cn_domain(self, email):
-        domains_cn = self._config['domains_cn']
-        for domain in domains_cn:
-            if domain in email:
-                return True
-        return False
+        return email.rsplit('@', 1)[-1] in self._domains_cn
 
 
     def classify(self):
@@ -129,4 +121,12 @@ class EmailClassifier(object):
         return res
 
     def get_emails_removed(self):
-        return self._emails_removed
\ No newline at end of file
+        return self._emails_removed
+
+    def get_domain_count(self):
+        """ :return: Counter {域名: 数据文件中合法 email 的数量}，在去重和过滤之前统计 """
+        return self._domain_count
+
+    def get_count_cleaned(self):
+        """ :return: dict {'invalid': 格式不合法的数量, 'duplicate': 重复的数量} """
+        return dict(self._cleaner.count)
\ No newline at end of file
@@ -0,0 +1,123 @@
+from array import array
+from functools import partial
+from hashlib import blake2b
+from pathlib import Path
+import csv
+import struct
+
+
+def normalize_email(email):
+    """ 统一 email 的格式：去掉首尾空白，并转换成小写 """
+    return email.strip().casefold()
+
+
+def hash_email(email):
+    """ email 归一化后的 64 位哈希值 """
+    digest = blake2b(normalize_email(email).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class DoneIndex(object):
+
+    """
+    已完成 email 的哈希索引，判断一个 email 是否已完成只需要一次哈希查找。
+    persist 为 True 时，索引保存在 done 文件旁边的 `<done 文件名>.idx` 中：
+    文件头记录已经索引到的 done 文件的字节位置，其后是 64 位哈希值。
+    done 文件增长时只读取新增的部分；done 文件变小（被替换或截断）时重建索引。
+    有多个 done 文件时，每个文件由一个子进程读取（参考 ingest.parallel_map）。
+    """
+
+    _suffix = '.idx'
+    _header = struct.Struct('<Q')  # 已经索引的 done 文件字节数
+    _chunk_size = 16 * 1024 * 1024
+
+    def __init__(self, done_path, persist=False, processes=None):
+        """
+        :param done_path: done 文件的路径，或者多个文件的路径列表
+        :param persist: 是否把索引保存到磁盘，并增量更新
+        :param processes: 读取多个文件时的进程数量，为空时自动选择，1: 不使用进程池
+        """
+        # ingest 依赖 clean，clean 依赖本模块，因此在这里导入
+        from .ingest import get_processes, parallel_map
+
+        paths = done_path if isinstance(done_path, list) else [done_path]
+        paths = [Path(p) for p in paths if p and Path(p).exists()]
+        load = partial(self._load_file, persist=persist)
+        self._hashes = set()
+        for hashes in parallel_map(load, paths, get_processes(paths, processes)):
+            self._hashes.update(hashes)
+
+    @classmethod
+    def _load_file(cls, path, persist):
+        """ :return: 一个 done 文件中所有 email 的哈希值 """
+        if persist:
+            return cls._load_persisted(path)
+        hashes, _, tail = cls._read_hashes(path, 0)
+        hashes.extend(tail)
+        return hashes
+
+    @classmethod
+    def _read_hashes(cls, path, offset, col='EMAIL'):
+        """
+        从 done 文件的 offset 处开始读取。
+        offset 只前进到最后一个完整的行，文件末尾没有换行符的行单独返回。
+        :return: (完整行的哈希值, 新的 offset, 末尾不完整行的哈希值)
+        """
+        hashes, tail = array('Q'), array('Q')
+        with open(path, 'rb') as f:
+            header = f.readline()
+            fieldnames = next(csv.reader([header.decode('utf-8-sig')]), [])
+            if col not in fieldnames:
+                return hashes, offset, tail
+            idx = fieldnames.index(col)
+            offset = max(offset, len(header))
+            f.seek(offset)
+            rest = b''
+            while chunk := f.read(cls._chunk_size):
+                chunk = rest + chunk
+                end = chunk.rfind(b'\n') + 1
+                rest = chunk[end:]
+                cls._hash_rows(chunk[:end], idx, hashes)
+                offset += end
+            cls._hash_rows(rest, idx, tail)
+        return hashes, offset, tail
+
+    @staticmethod
+    def _hash_rows(data, idx, hashes):
+        for row in csv.reader(data.decode('utf-8').splitlines()):
+            if len(row) > idx and (email := row[idx].strip()):
+                hashes.append(hash_email(email))
+
+    @classmethod
+    def _load_persisted(cls, path):
+        index_path = path.with_name(path.name + cls._suffix)
+        offset = 0
+        hashes = array('Q')
+        if index_path.exists():
+            with open(index_path, 'rb') as f:
+                offset, = cls._header.unpack(f.read(cls._header.size))
+                if offset <= path.stat().st_size:
+                    hashes.frombytes(f.read())
+                else:
+                    offset = 0
+        mode = 'r+b' if offset else 'wb'
+        new_hashes, new_offset, tail = cls._read_hashes(path, offset)
+        hashes.extend(new_hashes)
+        hashes.extend(tail)
+        if new_offset == offset and index_path.exists():
+            return hashes
+        with open(index_path, mode) as f:
+            if not offset:
+                f.write(cls._header.pack(0))
+            f.seek(0, 2)
+            new_hashes.tofile(f)
+            # 先写入哈希值，再更新文件头，中途退出时最多重复索引一部分行
+            f.seek(0)
+            f.write(cls._header.pack(new_offset))
+        return hashes
+
+    def __contains__(self, email):
+        return hash_email(email) in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
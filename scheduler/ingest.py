@@ -0,0 +1,107 @@
+import csv
+import os
+from collections import Counter
+from functools import partial
+from pathlib import Path
+
+from .clean import AddressCleaner
+
+
+# 文件总大小低于该值时不启动进程池，进程启动的开销大于并行的收益
+_min_parallel_size = 4 * 1024 * 1024
+
+
+def iter_column(filepath, col):
+    """
+    从 csv 文件中逐行读取一列（有标题列），不把整个文件读入内存。
+    用 csv.reader 按列的位置取值，不为每一行构造 dict。
+    :param filepath: 文件路径
+    :param col: 列名
+    :return: generator
+    """
+    if not Path(filepath).exists():
+        return
+    try:
+        with open(filepath, mode='r', newline='', encoding='utf-8-sig') as csvfile:
+            reader = csv.reader(csvfile)
+            fieldnames = next(reader, [])
+            # 检查 EMAIL 列是否存在
+            if col not in fieldnames:
+                return
+            idx = fieldnames.index(col)
+            for row in reader:
+                if len(row) > idx and (item := row[idx].strip()):  # 仅添加非空的item
+                    yield item
+    except Exception as e:
+        print(f"Error reading {filepath}: {e}")
+
+
+def _read_column(filepath, col):
+    """
+    从 csv 文件中读取一列（有标题列）
+    :param filepath: 文件路径
+    :param col: 列名
+    :return: list
+    """
+    return list(iter_column(filepath, col))
+
+
+def get_processes(paths, processes=None):
+    """
+    :param processes: 进程数量，为空时根据 CPU 核数和文件大小自动选择
+    :return: 实际使用的进程数量，1 表示在当前进程中处理
+    """
+    paths = [Path(p) for p in paths if p and Path(p).exists()]
+    if len(paths) <= 1:
+        return 1
+    if processes is None:
+        if sum(p.stat().st_size for p in paths) < _min_parallel_size:
+            return 1
+        processes = os.cpu_count() or 1
+    return max(1, min(processes, len(paths)))
+
+
+def parallel_map(func, items, processes=1):
+    """ processes 大于 1 时在进程池中执行，结果的顺序与 items 相同 """
+    if processes <= 1:
+        return [func(item) for item in items]
+    # 进程池的模块导入较慢，只在需要时导入
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(func, items))
+
+
+def _ingest_file(filepath, col, validate):
+    """
+    在子进程中读取一个文件。
+    :return: (email 列表, {域名: 数量}, 不合法的数量)
+    """
+    emails = iter_column(filepath, col)
+    invalid = 0
+    if validate:
+        cleaner = AddressCleaner()
+        emails = list(cleaner.validate(emails))
+        invalid = cleaner.count['invalid']
+    else:
+        emails = list(emails)
+    domains = Counter(em.rsplit('@', 1)[-1].lower() for em in emails)
+    return emails, domains, invalid
+
+
+def ingest(paths, col='EMAIL', validate=False, processes=None):
+    """
+    并行读取多个 csv 文件的一列，每个文件由一个子进程读取（以及规范化和校验），然后按文件的顺序合并。
+    :param paths: 文件路径列表
+    :param validate: True: 用 AddressCleaner.validate 规范化并校验（不去重，去重需要看到所有文件）
+    :param processes: 进程数量，为空时根据 CPU 核数和文件大小自动选择，1: 不使用进程池
+    :return: (email 列表, Counter {域名: 数量}, 不合法的数量)
+    """
+    paths = list(paths)
+    func = partial(_ingest_file, col=col, validate=validate)
+    emails, domains, invalid = [], Counter(), 0
+    for file_emails, file_domains, file_invalid in parallel_map(
+            func, paths, get_processes(paths, processes)):
+        emails += file_emails
+        domains.update(file_domains)
+        invalid += file_invalid
+    return emails, domains, invalid
@@ -1,9 +1,12 @@
 import csv
 from pathlib import Path
 import random
+import heapq
 import os
 
 from .email import EmailClassifier
+from .domain import DomainMatcher
+from .store import JobStore
 
 
 class JobScheduler(object):
@@ -13,14 +16,19 @@ class JobScheduler(object):
     把它们分成多个批次，满足如下条件：
     1、每个批次的任务数量不超过batch_size
     2、每个批次相同的域名数量不超过tolerance中指定的值。
+    设置 mx_grouper 后，第 2 条中的域名换成收件服务商（按 MX 记录分组，参考 MXGrouper），
+    服务商的 tolerance 为规则中服务商的值，没有规则时取其下各域名 tolerance 的最大值。
     """
 
     _config = {
         'batch_size': 0,  # 0: unlimited
         'tolerance': {  # 每个批次允许域名相同的job数量
             'default': 1,  # 默认值
-            'gmail.com': 3,  # 覆盖默认值
+            'gmail.com': 3,  # 覆盖默认值，key 是域名规则，参考 DomainMatcher
         },
+        'mx_grouper': None,  # MXGrouper 对象，不为空时按收件服务商分配批次
+        'store': None,  # JobStore 文件路径，不为空时所有批次保存在这一个文件中，而不是 jobs_batch_*.csv
+        'classifier': {},  # EmailClassifier 的参数，例如 {'ignore_cn': False, 'done_index': True}
     }
 
     def __init__(self, data_path, done_path, jobs_dir, **kwargs):
@@ -29,22 +37,48 @@ class JobScheduler(object):
         :param done_path: str, email done 的文件路径，或者多个数据文件的路径列表
         :param jobs_dir: str, 结果保存的文件夹
         """
+        self._config = dict(self._config)
         for k, v in kwargs.items():
             if k in self._config.keys():
                 self._config[k] = v
             else:
                 raise (ValueError(f"Wrong input parameter `{k}`"))
 
-        self._ec = EmailClassifier(data_path, done_path)
+        self._ec = EmailClassifier(data_path, done_path, **self._config['classifier'])
+        self._tolerance = DomainMatcher({k: v for k, v in self._config['tolerance'].items()
+                                         if k != 'default'})
         self._jobs_dir = jobs_dir
         self._jobs = None
+        self._group_tolerance = {}  # {服务商: tolerance}，按 MX 分组时使用
+        self._store = JobStore(self._config['store']) if self._config['store'] else None
 
     def _get_tolerance(self, domain):
-        tolerance = self._config['tolerance']
-        val = tolerance['default']
-        if domain.lower() in tolerance.keys():
-            val = tolerance[domain]
-        return val
+        if domain in self._group_tolerance:
+            return self._group_tolerance[domain]
+        return self._tolerance.match(domain, default=self._config['tolerance']['default'])
+
+    def _group_by_provider(self, classified_emails):
+        """
+        把域名相同的分组合并成服务商相同的分组，没有设置 mx_grouper 时保持不变。
+        :return: dict {服务商: email 列表}
+        """
+        mx_grouper = self._config['mx_grouper']
+        if not mx_grouper:
+            return classified_emails
+        providers = mx_grouper.group(classified_emails.keys())
+        default = self._config['tolerance']['default']
+        res = {}
+        for domain, emails in classified_emails.items():
+            provider = providers.get(domain, domain)
+            res.setdefault(provider, []).extend(emails)
+            tolerance = self._tolerance.match(domain, default=default)
+            self._group_tolerance[provider] = max(self._group_tolerance.get(provider, 0), tolerance)
+        for provider in res:
+            tolerance = self._tolerance.match(provider)
+            if tolerance is not None:
+                self._group_tolerance[provider] = tolerance
+        print(f"MX grouping: {len(classified_emails)} domains -> {len(res)} providers.")
+        return res
 
     def _get_batches(self, classified_emails):
         """
@@ -54,28 +88,36 @@ class JobScheduler(object):
         把 Email 按不同的域名分组，结果保存成 list。
         要求每个组中，域名相同的email数量不超过设定值 tolerance[key]，
         其中 key 是域名，例如 gmail.com。如果没有设定值，则不超过 tolerance[default]
+
+        第 k 个组包含每个域名的第 k 份 email（每份 tolerance[key] 个）。
+        用最小堆记录每个域名需要的组数，域名的 email 分配完后立即移出活跃域名，
+        每一轮只访问还有剩余 email 的域名，复杂度为 O(N + D log D)，
+        其中 N 是 email 的数量，D 是域名的数量。
         """
+        active = {}  # 还有剩余 email 的域名 {key: (values, tolerance)}
+        heap = []  # [(组数, key)]
+        for key, values in classified_emails.items():
+            if not values:
+                continue
+            tolerance = max(1, self._get_tolerance(key))
+            active[key] = (values, tolerance)
+            heap.append(((len(values) + tolerance - 1) // tolerance, key))
+        heapq.heapify(heap)
+
         res = []
-        # 追踪self._jobs 中 key 对应的 value 是否为空
-        # 如果 value 为空，则记录对应的 key 到 empty_keys
-        # 因为下面的循环中要执行 pop 操作，直到 value 为空
-        empty_keys = set()
-        # 循环结束的条件：self._jobs 中所有的 value 都为空
-        while len(empty_keys) < len(classified_emails):
+        k = 0
+        while active:
+            while heap and heap[0][0] <= k:
+                _, key = heapq.heappop(heap)
+                del active[key]
             batch = []
-            for key, values in classified_emails.items():
-                if key in empty_keys:
-                    continue
-                count = 0
-                tolerance = self._get_tolerance(key)
-                while len(values) > 0 and count < tolerance:
-                    if item := values.pop():
-                            batch.append(item)
-                            count += 1
-                if len(values) == 0:
-                    empty_keys.add(key)
+            for values, tolerance in active.values():
+                # 从列表末尾开始分配
+                end = len(values) - k * tolerance
+                batch.extend(reversed(values[max(0, end - tolerance):end]))
             if batch:
                 res.append(batch)
+            k += 1
         return res
 
     def _get_jobs(self, batches):
@@ -112,6 +154,9 @@ class JobScheduler(object):
         return [lst[i:i + k] for i in range(0, len(lst), k)]
 
     def _save_batch(self, batch_id, jobs):
+        if self._store is not None:
+            self._store.add_batch(batch_id, jobs)
+            return
         filename = f"jobs_batch_{batch_id}.csv"
         filepath = Path(self._jobs_dir) / filename
         try:
@@ -126,23 +171,32 @@ class JobScheduler(object):
         except Exception as e:
             print(f"Save Failed! batch_id={batch_id}", e)
 
+    def _commit_store(self):
+        if self._store is not None:
+            self._store.commit()
+            print(f"Batches saved to [{self._store.path}].")
+
     def _save(self):
         for batch_id, jobs in self._jobs.items():
             self._save_batch(batch_id, jobs)
+        self._commit_store()
         self._print_count()
 
     def _count_jobs(self):
         removed = self._ec.get_emails_removed()
+        cleaned = self._ec.get_count_cleaned()
         count = {
             'ajn': 0,  # assigned job number
             'abn': len(self._jobs),  # assigned batch number
             'rcd': len(removed['cn']),  # removed cn domains
             'rjd': len(removed['done']),  # removed jobs done
+            'rie': cleaned['invalid'],  # removed invalid emails
+            'rde': cleaned['duplicate'],  # removed duplicate emails
             'rjn': 0,  # removed jobs number
         }
         for batch in self._jobs.values():
             count['ajn'] += len(batch)
-        count['rjn'] = count['rcd'] + count['rjd']
+        count['rjn'] = count['rcd'] + count['rjd'] + count['rie'] + count['rde']
 
         return count
 
@@ -152,10 +206,12 @@ class JobScheduler(object):
               f">> jobs = {count['ajn']}, batches = {count['abn']}\n"
               f">> ignored = {count['rjn']}\n"
               f">> - cn domains ignored = {count['rcd']}\n"
-              f">> - jobs done ignored = {count['rjd']}\n")
+              f">> - jobs done ignored = {count['rjd']}\n"
+              f">> - invalid emails ignored = {count['rie']}\n"
+              f">> - duplicate emails ignored = {count['rde']}\n")
 
     def assign_jobs(self):
-        classified_email = self._ec.classify()
+        classified_email = self._group_by_provider(self._ec.classify())
         # 得到 batches = [[email, email, ...], [email, email, ...], ...]，满足 tolerance
         batches = self._get_batches(classified_email)
         # 得到 jobs = {batch_id: jobs}
@@ -166,11 +222,16 @@ class JobScheduler(object):
         return self._jobs
 
     def clear_job_files(self):
-        # 删除出 data_dir 文件下，文件名的格式为 jobs_batch_*.csv 的文件
+        # 删除出 data_dir 文件下，文件名的格式为 jobs_batch_*.csv 的文件，以及它们的发送日志（journal）和领取状态（lock/done/failed）
+        if self._store is not None:
+            self._store.clear()
+            print(f"Job store [{self._store.path}] cleared.")
         try:
             files = os.listdir(self._jobs_dir)
             for filename in files:
-                if filename.startswith('jobs_batch_') and filename.endswith('.csv'):
+                if filename.startswith('jobs_batch_') and \
+                        filename.endswith(('.csv', '.csv.journal', '.csv.lock',
+                                           '.csv.done', '.csv.failed')):
                     os.remove(Path(self._jobs_dir) / filename)
                     print(f"File [{filename}] removed.")
         except Exception as e:
@@ -0,0 +1,220 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from time import time
+
+try:
+    import dns.resolver
+except ImportError:  # dnspython 是可选依赖
+    dns = None
+
+from .domain import DomainMatcher
+
+
+class DNSResolver(object):
+
+    """
+    用 dnspython 查询域名的 MX 记录。
+    resolve 返回 (按优先级排序的 MX 主机列表, TTL 秒)，域名不存在或没有 MX 记录时主机列表为空。
+    """
+
+    _config = {
+        'timeout': 5,  # 单次查询的超时时长（秒）
+        'negative_ttl': 3600,  # 没有 MX 记录时的缓存时长（秒）
+        'nameservers': None,  # DNS 服务器列表，为空时使用系统配置
+    }
+
+    def __init__(self, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        if dns is None:
+            raise ImportError("DNSResolver requires dnspython: pip install dnspython")
+        self._resolver = dns.resolver.Resolver()
+        if self._config['nameservers']:
+            self._resolver.nameservers = self._config['nameservers']
+
+    def resolve(self, domain):
+        try:
+            answer = self._resolver.resolve(domain, 'MX', lifetime=self._config['timeout'])
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers):
+            return [], self._config['negative_ttl']
+        records = sorted(answer, key=lambda r: r.preference)
+        hosts = [str(r.exchange).rstrip('.').lower() for r in records]
+        return [h for h in hosts if h], answer.rrset.ttl
+
+
+class StubResolver(object):
+
+    """
+    本地的 MX 解析器，用于测试和离线运行。
+    :param records: dict {域名: [MX 主机, ...]}，没有列出的域名视为没有 MX 记录
+    """
+
+    def __init__(self, records, ttl=3600):
+        self._records = {k.lower(): list(v) for k, v in records.items()}
+        self._ttl = ttl
+        self.queries = 0  # 查询次数，用于检查缓存是否生效
+        self._lock = Lock()
+
+    def resolve(self, domain):
+        with self._lock:
+            self.queries += 1
+        return self._records.get(domain, []), self._ttl
+
+
+class MXCache(object):
+
+    """
+    MX 记录的磁盘缓存（JSON）：{域名: [[MX 主机, ...], 过期时间戳]}。
+    path 为空时只缓存在内存中。
+    """
+
+    def __init__(self, path=None):
+        self._path = Path(path) if path else None
+        self._records = {}
+        self._dirty = False
+        self._lock = Lock()
+        self._load()
+
+    def _load(self):
+        if not self._path or not self._path.exists():
+            return
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                self._records = json.load(f)
+        except Exception as e:
+            print(f"Error reading MX cache {self._path}: {e}")
+            self._records = {}
+
+    def get(self, domain):
+        """ :return: MX 主机列表，没有缓存或已过期时返回 None """
+        with self._lock:
+            record = self._records.get(domain)
+        if record is None or record[1] <= time():
+            return None
+        return record[0]
+
+    def put(self, domain, hosts, ttl):
+        with self._lock:
+            self._records[domain] = [hosts, time() + ttl]
+            self._dirty = True
+
+    def save(self):
+        """ 删除过期的记录，写入临时文件后替换，避免中断时损坏缓存文件 """
+        if not self._path or not self._dirty:
+            return
+        now = time()
+        with self._lock:
+            records = {k: v for k, v in self._records.items() if v[1] > now}
+            self._dirty = False
+        tmp_path = self._path.with_name(self._path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f)
+        os.replace(tmp_path, self._path)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class MXGrouper(object):
+
+    """
+    按 MX 记录把收件域名归到实际的收件服务商，例如托管在 Google Workspace 上的企业域名都归到 google.com。
+    1、服务商由优先级最高的 MX 主机决定：先按 providers 规则匹配，没有匹配时取 MX 主机的注册域名；
+    2、没有 MX 记录或查询失败的域名，服务商就是域名本身（查询失败的结果不缓存）；
+    3、查询结果按 TTL（限制在 min_ttl 和 max_ttl 之间）缓存在 cache_path 中，没有缓存的域名并发查询。
+    """
+
+    _config = {
+        'cache_path': None,  # MX 缓存文件的路径，为空时不保存到磁盘
+        'min_ttl': 3600,  # 缓存时长的下限（秒）
+        'max_ttl': 7 * 24 * 3600,  # 缓存时长的上限（秒）
+        'workers': 16,  # 并发查询的线程数量
+        'providers': {  # MX 主机规则 -> 服务商，规则参考 DomainMatcher
+            '.google.com': 'google.com',
+            '.googlemail.com': 'google.com',
+            '.outlook.com': 'outlook.com',
+            '.hotmail.com': 'outlook.com',
+            '.yahoodns.net': 'yahoo.com',
+            '.icloud.com': 'icloud.com',
+            '.qq.com': 'qq.com',
+            '.163.com': '163.com',
+            '.zoho.com': 'zoho.com',
+            '.pphosted.com': 'pphosted.com',
+            '.mimecast.com': 'mimecast.com',
+        },
+    }
+
+    # 注册域名在第三级的二级域名，例如 example.com.cn
+    _second_levels = {'com', 'net', 'org', 'edu', 'gov', 'co', 'ac'}
+
+    def __init__(self, resolver=None, **kwargs):
+        """
+        :param resolver: 实现了 resolve(domain) -> (MX 主机列表, TTL) 的对象，为空时使用 DNSResolver
+        """
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._resolver = resolver if resolver is not None else DNSResolver()
+        self._cache = MXCache(self._config['cache_path'])
+        self._providers = DomainMatcher(self._config['providers'])
+
+    def _get_registered_domain(self, host):
+        labels = host.split('.')
+        n = 3 if len(labels) >= 3 and labels[-2] in self._second_levels else 2
+        return '.'.join(labels[-n:])
+
+    def _get_provider(self, domain, hosts):
+        if not hosts:
+            return domain
+        provider = self._providers.match(hosts[0])
+        return provider if provider else self._get_registered_domain(hosts[0])
+
+    def _query(self, domain):
+        try:
+            hosts, ttl = self._resolver.resolve(domain)
+        except Exception as e:
+            print(f"MX lookup failed for {domain}: {e}")
+            return None
+        ttl = min(max(ttl, self._config['min_ttl']), self._config['max_ttl'])
+        self._cache.put(domain, hosts, ttl)
+        return hosts
+
+    def _lookup(self, domains):
+        """ :return: dict {域名: MX 主机列表}，查询失败的域名为 None """
+        res = {}
+        misses = []
+        for domain in domains:
+            hosts = self._cache.get(domain)
+            if hosts is None:
+                misses.append(domain)
+            else:
+                res[domain] = hosts
+        if misses:
+            workers = max(1, min(self._config['workers'], len(misses)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                res.update(zip(misses, executor.map(self._query, misses)))
+            self._cache.save()
+        return res
+
+    def group(self, domains):
+        """
+        :param domains: 域名的集合
+        :return: dict {域名: 服务商}
+        """
+        domains = {d.strip().lower() for d in domains}
+        return {d: self._get_provider(d, hosts) for d, hosts in self._lookup(domains).items()}
+
+    def get_provider(self, domain):
+        return self.group([domain])[domain.strip().lower()]
@@ -0,0 +1,89 @@
+import csv
+import sqlite3
+from pathlib import Path
+
+
+class JobStore(object):
+
+    """
+    用一个 SQLite 文件保存所有批次，代替大量的 jobs_batch_*.csv 小文件。
+    jobs 表以 (batch_id, seq) 为主键（WITHOUT ROWID，按主键聚簇存储），
+    读取一个批次只需要一次索引定位加顺序扫描，耗时与批次大小成正比，与批次的总数无关。
+    写入在 commit 之前不提交，一次分配的所有批次在同一个事务中写入。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS jobs (
+                batch_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                email TEXT NOT NULL,
+                PRIMARY KEY (batch_id, seq)
+            ) WITHOUT ROWID;
+        """)
+
+    def add_batch(self, batch_id, jobs):
+        """ 写入一个批次（同一个 id 的旧批次被替换），调用 commit 后生效 """
+        batch_id = str(batch_id)
+        self._conn.execute('DELETE FROM jobs WHERE batch_id = ?', (batch_id,))
+        self._conn.execute('INSERT OR REPLACE INTO batches (id, size) VALUES (?, ?)',
+                           (batch_id, len(jobs)))
+        self._conn.executemany('INSERT INTO jobs (batch_id, seq, email) VALUES (?, ?, ?)',
+                               ((batch_id, i, em) for i, em in enumerate(jobs)))
+
+    def commit(self):
+        self._conn.commit()
+
+    def get_batch(self, batch_id):
+        """ :return: list, 批次中的 email，批次不存在时返回空列表 """
+        rows = self._conn.execute('SELECT email FROM jobs WHERE batch_id = ? ORDER BY seq',
+                                  (str(batch_id),))
+        return [row[0] for row in rows]
+
+    def get_batch_ids(self):
+        return [row[0] for row in self._conn.execute('SELECT id FROM batches ORDER BY id')]
+
+    def clear(self):
+        self._conn.execute('DELETE FROM jobs')
+        self._conn.execute('DELETE FROM batches')
+        self._conn.commit()
+
+    def export_csv(self, jobs_dir, batch_ids=None):
+        """
+        导出为 jobs_batch_{batch_id}.csv，格式与 JobScheduler 保存的 csv 相同。
+        :param batch_ids: 需要导出的批次，为空时导出全部
+        :return: 导出的文件路径列表
+        """
+        paths = []
+        for batch_id in batch_ids if batch_ids is not None else self.get_batch_ids():
+            path = Path(jobs_dir) / f"jobs_batch_{batch_id}.csv"
+            with open(path, mode='w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['EMAIL'])
+                writer.writerows([em] for em in self.get_batch(batch_id))
+            paths.append(path)
+        return paths
+
+    def close(self):
+        self._conn.close()
+
+    def __contains__(self, batch_id):
+        row = self._conn.execute('SELECT 1 FROM batches WHERE id = ?', (str(batch_id),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM batches').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,142 @@
+import tempfile
+import zlib
+from math import ceil
+from pathlib import Path
+
+from .job import JobScheduler
+from .email import EmailClassifier
+from .ingest import iter_column
+from .index import DoneIndex
+from .domain import DomainMatcher
+from .clean import AddressCleaner
+from .store import JobStore
+
+
+class StreamJobScheduler(JobScheduler):
+
+    """
+    流式任务分配，用于内存放不下的原始数据，峰值内存由 memory_budget 决定，而不是数据的大小。
+    1、第一遍：逐行读取原始 csv，规范化并校验 email，过滤 cn 域名和已完成的 email，
+       按规范化后 email 的哈希值写入若干个临时分区文件；
+    2、第二遍：逐个分区读入内存，去重，按域名分组、分配批次并立即保存，然后释放。
+    相同的 email 规范化后哈希值相同，一定在同一个分区中，因此按分区去重等价于全局去重；
+    数据量很大的域名（例如 gmail.com）也会被均匀地分到各个分区中。
+    分区的数量根据原始数据的大小和 memory_budget 计算。
+    每个分区单独分配批次，同一个域名可能出现在多个分区的批次中，每个批次依然满足 batch_size 和 tolerance 的要求，
+    但批次数量可能多于一次性处理，批次编号的格式为 `{分区}_{批次}`。
+    设置 mx_grouper 时，在每个分区内按收件服务商分组。
+    过滤和清洗的参数（ignore_cn, domains_cn, clean, done_index 等）与 JobScheduler 相同，由 classifier 传入。
+    注意：已完成 email 的哈希索引（DoneIndex）常驻内存，不计入 memory_budget。
+    """
+
+    _config = {
+        **JobScheduler._config,
+        'memory_budget': 256 * 1024 * 1024,  # 处理单个分区时的内存上限（字节）
+        'spill_dir': None,  # 临时分区文件的文件夹，为空时使用系统的临时文件夹
+    }
+
+    # 每个字节的 csv 数据读入内存后，按域名分组大约占用的内存（字节）
+    _memory_factor = 8
+
+    def __init__(self, data_path, done_path, jobs_dir, **kwargs):
+        """
+        :param data_path: str, email 数据文件的路径，或者多个数据文件的路径列表
+        :param done_path: str, email done 的文件路径，或者多个数据文件的路径列表
+        :param jobs_dir: str, 结果保存的文件夹
+        """
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise (ValueError(f"Wrong input parameter `{k}`"))
+
+        self._classifier = dict(EmailClassifier._config)  # EmailClassifier 的默认参数，不修改类的配置
+        for k, v in self._config['classifier'].items():
+            if k in self._classifier.keys():
+                self._classifier[k] = v
+            else:
+                raise (ValueError(f"Wrong input parameter `{k}`"))
+
+        self._data_paths = data_path if isinstance(data_path, list) else [data_path]
+        self._done_path = done_path
+        self._jobs_dir = jobs_dir
+        self._jobs = None
+        self._tolerance = DomainMatcher({k: v for k, v in self._config['tolerance'].items()
+                                         if k != 'default'})
+        self._group_tolerance = {}
+        self._cleaner = AddressCleaner()
+        self._store = JobStore(self._config['store']) if self._config['store'] else None
+        self._count = {'ajn': 0, 'abn': 0, 'rcd': 0, 'rjd': 0}
+
+    def _get_partitions(self):
+        size = sum(Path(p).stat().st_size for p in self._data_paths if Path(p).exists())
+        return max(1, ceil(size * self._memory_factor / self._config['memory_budget']))
+
+    @staticmethod
+    def _get_domain(email):
+        return email.lower().split('@')[1].strip()
+
+    def _spill(self, spill_dir, partitions):
+        """ 第一遍：过滤并把 email 按哈希值写入分区文件 """
+        ignore_cn = self._classifier['ignore_cn']
+        domains_cn_file = self._classifier['domains_cn_file']
+        domains_cn = DomainMatcher.from_file(domains_cn_file) if domains_cn_file else \
+            DomainMatcher(self._classifier['domains_cn'])
+        done = DoneIndex(self._done_path, persist=self._classifier['done_index'],
+                         processes=self._classifier['processes'])
+
+        files = [open(Path(spill_dir) / f"part_{i}.txt", 'w', encoding='utf-8')
+                 for i in range(partitions)]
+        try:
+            for path in self._data_paths:
+                emails = iter_column(path, col='EMAIL')
+                if self._classifier['clean']:
+                    emails = self._cleaner.validate(emails)
+                for email in emails:
+                    domain = self._get_domain(email)
+                    if ignore_cn and domain in domains_cn:
+                        self._count['rcd'] += 1
+                    elif email in done:
+                        self._count['rjd'] += 1
+                    else:
+                        i = zlib.crc32(email.encode('utf-8')) % partitions
+                        files[i].write(email + '\n')
+        finally:
+            for f in files:
+                f.close()
+
+    def _assign_partition(self, part_id, part_path):
+        """ 第二遍：处理一个分区，并保存它的批次 """
+        classified = {}
+        with open(part_path, 'r', encoding='utf-8') as f:
+            emails = (line.rstrip('\n') for line in f)
+            if self._classifier['clean']:
+                emails = self._cleaner.unique(emails)
+            for email in emails:
+                classified.setdefault(self._get_domain(email), []).append(email)
+        self._cleaner.clear()
+        if not classified:
+            return
+        batches = self._get_batches(self._group_by_provider(classified))
+        del classified
+        for batch_id, jobs in self._get_jobs(batches).items():
+            self._save_batch(f"{part_id}_{batch_id}", jobs)
+            self._count['ajn'] += len(jobs)
+            self._count['abn'] += 1
+
+    def _count_jobs(self):
+        count = dict(self._count)
+        count['rie'] = self._cleaner.count['invalid']
+        count['rde'] = self._cleaner.count['duplicate']
+        count['rjn'] = count['rcd'] + count['rjd'] + count['rie'] + count['rde']
+        return count
+
+    def assign_jobs(self):
+        partitions = self._get_partitions()
+        with tempfile.TemporaryDirectory(dir=self._config['spill_dir']) as spill_dir:
+            self._spill(spill_dir, partitions)
+            for i in range(partitions):
+                self._assign_partition(i, Path(spill_dir) / f"part_{i}.txt")
+        self._commit_store()
+        self._print_count()
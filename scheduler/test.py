@@ -1,10 +1,22 @@
+import csv
+import tempfile
 from pathlib import Path
 
 from .job import JobScheduler
+from .stream import StreamJobScheduler
 from .email import EmailClassifier
+from .index import DoneIndex
+from .domain import DomainMatcher
+from .mx import MXGrouper, StubResolver
+from .clean import AddressCleaner, HashSet
+from .ingest import ingest, iter_column
+from .store import JobStore
 
 
-__all__ = ['TestJobScheduler', 'TestEmailClassifier']
+__all__ = ['TestJobScheduler', 'TestEmailClassifier', 'TestDoneIndex',
+           'TestDomainMatcher', 'TestStreamJobScheduler', 'TestMXGrouper',
+           'TestAddressCleaner', 'TestIngest',
+           'TestJobStore']
 
 
 class TestEmailClassifier(object):
@@ -13,8 +25,46 @@ class TestEmailClassifier(object):
         data_dir = Path(data_dir)
         data_path = data_dir / 'data_example.csv'
         done_path = data_dir / 'jobs_done_example.csv'
+        self._data_path, self._done_path = data_path, done_path
         self._ec = EmailClassifier(data_path, done_path)
 
+    def _test_config(self):
+        # 参数只对当前对象生效，不修改类的默认配置
+        ec = EmailClassifier(self._data_path, self._done_path, ignore_cn=False, clean=False)
+        assert ec.get_emails_removed()['cn'] == [], AssertionError("ignore_cn = False not applied")
+        assert EmailClassifier._config['ignore_cn'] and EmailClassifier._config['clean'], AssertionError(
+            f"Class config modified: {EmailClassifier._config}"
+        )
+        # JobScheduler 把 classifier 中的参数传给 EmailClassifier
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            js = JobScheduler(self._data_path, self._done_path, tmp_dir, classifier={'ignore_cn': False})
+        assert js._ec.get_emails_removed()['cn'] == [], AssertionError("classifier options not forwarded")
+        # domains_cn_file 代替默认的 domains_cn，只对传入它的 JobScheduler 生效
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rules_path = Path(tmp_dir) / 'domains_cn.txt'
+            with open(rules_path, 'w', encoding='utf-8') as f:
+                f.write('# test\nexample1.com\n')
+            js = JobScheduler(self._data_path, self._done_path, tmp_dir,
+                              classifier={'domains_cn_file': rules_path})
+        removed = js._ec.get_emails_removed()['cn']
+        expected = ['user0@example1.com', 'user1@example1.com', 'user2@example1.com']
+        assert removed == expected, AssertionError(
+            f"CN domains file: got = {removed}, expected = {expected}"
+        )
+        assert EmailClassifier._config['domains_cn_file'] is None, AssertionError(
+            f"Class config modified: {EmailClassifier._config}"
+        )
+        # processes = 1: 不使用进程池，结果与默认相同
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            js = JobScheduler(self._data_path, self._done_path, tmp_dir, classifier={'processes': 1})
+        assert js._ec.classify() == self._ec.classify(), AssertionError("processes = 1: different result")
+        try:
+            EmailClassifier(self._data_path, self._done_path, unknown=True)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Unknown parameter accepted")
+
     def _test_removed_cn(self):
         removed_cn = self._ec.get_emails_removed()['cn']
         expected = ['user_cn0@163.com', 'user_cn1@126.com', 'user_cn2@qq.com',
@@ -52,6 +102,7 @@ class TestEmailClassifier(object):
         self._test_removed_cn()
         self._test_removed_done()
         self._test_result()
+        self._test_config()
         print(f">> [{self.__class__.__name__}] OK.")
 
 
@@ -128,4 +179,352 @@ class TestJobScheduler(object):
         print(f">> [{self.__class__.__name__}] OK.")
 
 
+class TestDoneIndex(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self._done_path = data_dir / 'jobs_done_test.csv'
+        self._index_path = data_dir / 'jobs_done_test.csv.idx'
+
+    def _write(self, mode, rows):
+        with open(self._done_path, mode, encoding='utf-8') as f:
+            f.writelines(f"{row}\n" for row in rows)
+
+    def test(self):
+        self._write('w', ['EMAIL,TIME,STATUS', 'user0@example.com,,OK'])
+        index = DoneIndex(self._done_path, persist=True)
+        assert ' User0@Example.com' in index, AssertionError(
+            "Normalized email not found in index!"
+        )
+        # done 文件增长后增量更新
+        self._write('a', ['user1@example.com,,OK', 'user2@example.com,,FAIL'])
+        index = DoneIndex(self._done_path, persist=True)
+        assert len(index) == 3 and 'user2@example.com' in index, AssertionError(
+            f"Incremental index: got size = {len(index)}, expected size = 3"
+        )
+        # done 文件被替换后重建索引
+        self._write('w', ['EMAIL,TIME,STATUS', 'user3@example.com,,OK'])
+        index = DoneIndex(self._done_path, persist=True)
+        assert len(index) == 1 and 'user3@example.com' in index, AssertionError(
+            f"Rebuilt index: got size = {len(index)}, expected size = 1"
+        )
+        self._done_path.unlink()
+        self._index_path.unlink()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestDomainMatcher(object):
+
+    def __init__(self):
+        self._matcher = DomainMatcher({
+            'qq.com': 'exact',
+            '.edu.cn': 'suffix',
+            '*.example.com': 'wildcard',
+            'mail.example.com': 'literal',
+        })
+
+    def test(self):
+        cases = {
+            'qq.com': 'exact',
+            'QQ.com': 'exact',
+            'qq.company.io': None,
+            'mail.qq.com': None,
+            'edu.cn': None,
+            'pku.edu.cn': 'suffix',
+            'cs.pku.edu.cn': 'suffix',
+            'www.example.com': 'wildcard',
+            'mail.example.com': 'literal',
+            'a.b.example.com': None,
+        }
+        for domain, expected in cases.items():
+            got = self._matcher.match(domain)
+            assert got == expected, AssertionError(
+                f"Domain {domain}: got = {got}, expected = {expected}"
+            )
+        # 默认的 domains_cn 规则
+        domains_cn = DomainMatcher(EmailClassifier._config['domains_cn'])
+        cases = {
+            'qq.com': True,
+            'vip.qq.com': True,
+            'vip.163.com': True,
+            'mail.huawei.com': True,
+            'pku.edu.cn': True,
+            'qq.company.io': False,
+            'myqq.com': False,
+            'gmail.com': False,
+        }
+        for domain, expected in cases.items():
+            got = domain in domains_cn
+            assert got == expected, AssertionError(
+                f"Domain CN {domain}: got = {got}, expected = {expected}"
+            )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestStreamJobScheduler(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        data_path = data_dir / 'data_example.csv'
+        done_path = data_dir / 'jobs_done_example.csv'
+        self._data_dir = data_dir
+        self._tolerance = {'default': 1, 'example1.com': 2}
+        # memory_budget 很小，强制使用多个分区
+        self._sc = StreamJobScheduler(
+            data_path=[data_path],
+            done_path=done_path,
+            jobs_dir=data_dir,
+            batch_size=2,
+            tolerance=self._tolerance,
+            memory_budget=100
+        )
+
+    def _load_jobs(self):
+        jobs = {}
+        for path in self._data_dir.glob('jobs_batch_*.csv'):
+            with open(path, 'r', encoding='utf-8') as f:
+                jobs[path.name] = [row['EMAIL'] for row in csv.DictReader(f)]
+        return jobs
+
+    def test(self):
+        self._sc.assign_jobs()
+        jobs = self._load_jobs()
+        self._sc.clear_job_files()
+
+        emails = sorted(em for batch in jobs.values() for em in batch)
+        expected = ['user0@example1.com', 'user2@example1.com',
+                    'user3@example2.com', 'user5@example2.com']
+        assert emails == expected, AssertionError(
+            f"Jobs: got = {emails}, expected = {expected}"
+        )
+        for name, batch in jobs.items():
+            domains = [em.split('@')[1] for em in batch]
+            for domain in set(domains):
+                tolerance = self._tolerance.get(domain, self._tolerance['default'])
+                assert domains.count(domain) <= tolerance, AssertionError(
+                    f"Exceed tolerance! batch = {name}, domain = {domain}"
+                )
+        self._test_large_domain()
+        self._test_classifier()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+    def _test_classifier(self):
+        # 过滤参数由 classifier 传入，只对当前对象生效
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sc = StreamJobScheduler(data_path=[self._data_dir / 'data_example.csv'],
+                                    done_path=self._data_dir / 'jobs_done_example.csv',
+                                    jobs_dir=tmp_dir, batch_size=100,
+                                    classifier={'ignore_cn': False})
+            sc.assign_jobs()
+        count = sc._count_jobs()
+        assert count['rcd'] == 0 and count['ajn'] == 15, AssertionError(
+            f"ignore_cn = False: count = {count}"
+        )
+        assert EmailClassifier._config['ignore_cn'], AssertionError("Class config modified")
+
+    @staticmethod
+    def _test_large_domain():
+        # 单个域名的数据超过 memory_budget 时，也要被拆分到多个分区中，并且依然全局去重
+        sizes = []
+
+        class _Scheduler(StreamJobScheduler):
+            def _assign_partition(self, part_id, part_path):
+                sizes.append(Path(part_path).stat().st_size)
+                super()._assign_partition(part_id, part_path)
+
+        emails = [f"user{i}@gmail.com" for i in range(300)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data_path, done_path = tmp_dir / 'data.csv', tmp_dir / 'done.csv'
+            with open(data_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+                f.writelines(f"{em}\n" for em in emails + [em.upper() for em in emails[:20]])
+            with open(done_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+            sc = _Scheduler(data_path=[data_path], done_path=done_path, jobs_dir=tmp_dir,
+                            batch_size=50, tolerance={'default': 1, 'gmail.com': 50},
+                            memory_budget=8000)
+            sc.assign_jobs()
+            got = []
+            for path in tmp_dir.glob('jobs_batch_*.csv'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    got += [row['EMAIL'] for row in csv.DictReader(f)]
+        assert sorted(got) == sorted(emails), AssertionError(
+            f"Large domain: got {len(got)} emails, expected {len(emails)}"
+        )
+        assert len(sizes) > 1 and max(sizes) < sum(sizes) / 2, AssertionError(
+            f"Large domain not split: partition sizes = {sizes}"
+        )
+
+
+class TestMXGrouper(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self._data_dir = data_dir
+        self._data_path = data_dir / 'data_example.csv'
+        self._done_path = data_dir / 'jobs_done_example.csv'
+        # example1.com 和 example2.com 都托管在 Google
+        self._records = {
+            'example1.com': ['aspmx.l.google.com', 'alt1.aspmx.l.google.com'],
+            'example2.com': ['alt2.aspmx.l.google.com'],
+            'company.cn': ['mx1.hosting.com.cn'],
+        }
+
+    def _test_group(self, cache_path):
+        resolver = StubResolver(self._records)
+        grouper = MXGrouper(resolver, cache_path=cache_path)
+        got = grouper.group(['example1.com', 'Example2.com', 'company.cn', 'no-mx.com'])
+        expected = {'example1.com': 'google.com', 'example2.com': 'google.com',
+                    'company.cn': 'hosting.com.cn', 'no-mx.com': 'no-mx.com'}
+        assert got == expected, AssertionError(f"Providers: got = {got}, expected = {expected}")
+        assert resolver.queries == 4, AssertionError(f"Queries: got = {resolver.queries}, expected = 4")
+        # 第二次从磁盘缓存中读取，不再查询
+        resolver = StubResolver(self._records)
+        MXGrouper(resolver, cache_path=cache_path).group(expected.keys())
+        assert resolver.queries == 0, AssertionError(f"Cached queries: got = {resolver.queries}, expected = 0")
+
+    def _test_scheduler(self, cache_path):
+        tolerance = {'default': 1, 'example1.com': 2}
+        sc = JobScheduler(
+            data_path=self._data_path,
+            done_path=self._done_path,
+            jobs_dir=self._data_dir,
+            batch_size=0,
+            tolerance=tolerance,
+            mx_grouper=MXGrouper(StubResolver(self._records), cache_path=cache_path)
+        )
+        sc.assign_jobs()
+        jobs = sc.get_jobs()
+        sc.clear_job_files()
+        # example1.com 和 example2.com 合并为 google.com，tolerance 为两者的最大值 2
+        sizes = sorted(len(batch) for batch in jobs.values())
+        assert sizes == [2, 2], AssertionError(f"Batch sizes: got = {sizes}, expected = [2, 2]")
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_path = Path(tmp_dir) / 'mx_cache.json'
+            self._test_group(cache_path)
+            self._test_scheduler(cache_path)
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestAddressCleaner(object):
+
+    def _test_hash_set(self):
+        hs = HashSet()
+        added = [hs.add(i * 7919) for i in range(5000)]
+        assert all(added) and len(hs) == 5000, AssertionError(f"HashSet size: got = {len(hs)}")
+        assert not hs.add(0) and 7919 in hs and 2 not in hs, AssertionError("HashSet lookup error")
+
+    def _test_cleaner(self):
+        cleaner = AddressCleaner(chunk_size=3)
+        emails = ['Bob@Gmail.com', ' bob@gmail.com ', '<alice@example.com>', 'not-an-email',
+                  'carol@example', 'alice@EXAMPLE.com', 'dave@example.co.uk']
+        got = list(cleaner.clean(emails))
+        expected = ['bob@gmail.com', 'alice@example.com', 'dave@example.co.uk']
+        assert got == expected, AssertionError(f"Cleaned: got = {got}, expected = {expected}")
+        assert cleaner.count == {'invalid': 2, 'duplicate': 2}, AssertionError(
+            f"Count: got = {cleaner.count}"
+        )
+
+    def _test_classifier(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_path = Path(tmp_dir) / 'data.csv'
+            with open(data_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL\nBob@Gmail.com\nbob@gmail.com\nbad@\nuser1@Example1.com\n')
+            done_path = Path(tmp_dir) / 'jobs_done.csv'
+            with open(done_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL,TIME,STATUS\nuser1@example1.com,2024-01-01 00:00:00,OK\n')
+            ec = EmailClassifier(data_path, done_path)
+            res = ec.classify()
+            cleaned = ec.get_count_cleaned()
+        assert res == {'gmail.com': ['bob@gmail.com']}, AssertionError(f"Classify: got = {res}")
+        assert cleaned == {'invalid': 1, 'duplicate': 1}, AssertionError(f"Cleaned: got = {cleaned}")
+        removed = ec.get_emails_removed()['done']
+        assert removed == ['user1@example1.com'], AssertionError(f"Done removed: got = {removed}")
+
+    def test(self):
+        self._test_hash_set()
+        self._test_cleaner()
+        self._test_classifier()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestIngest(object):
+
+    def _write_files(self, tmp_dir):
+        contents = [
+            '\ufeffEMAIL,NAME\nuser0@example1.com,a\nUser1@Example1.com,b\n',
+            'NAME,EMAIL\nc,user2@example2.com\nd\n,\ne,bad-email\n',
+            'EMAIL\nuser0@example1.com\nuser3@example2.com\n',
+        ]
+        paths = []
+        for i, content in enumerate(contents):
+            path = Path(tmp_dir) / f"data_{i}.csv"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            paths.append(path)
+        return paths
 
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = self._write_files(tmp_dir)
+            serial = ingest(paths, validate=True, processes=1)
+            parallel = ingest(paths, validate=True, processes=2)
+            done = DoneIndex(paths, processes=2)
+            column = list(iter_column(paths[1], 'EMAIL'))
+        assert serial == parallel, AssertionError(f"Ingest: serial = {serial}, parallel = {parallel}")
+        emails, domains, invalid = parallel
+        expected = ['user0@example1.com', 'user1@example1.com', 'user2@example2.com',
+                    'user0@example1.com', 'user3@example2.com']
+        assert emails == expected, AssertionError(f"Emails: got = {emails}, expected = {expected}")
+        assert domains == {'example1.com': 3, 'example2.com': 2} and invalid == 1, AssertionError(
+            f"Counts: got = {dict(domains)}, invalid = {invalid}"
+        )
+        # 逐行读取一列，不校验，跳过空值
+        assert column == ['user2@example2.com', 'bad-email'], AssertionError(f"Column: got = {column}")
+        assert 'user3@example2.com' in done and len(done) == 5, AssertionError(
+            f"DoneIndex: got size = {len(done)}, expected = 5"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestJobStore(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self._data_path = data_dir / 'data_example.csv'
+        self._done_path = data_dir / 'jobs_done_example.csv'
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_path = Path(tmp_dir) / 'jobs.db'
+            sc = JobScheduler(
+                data_path=self._data_path,
+                done_path=self._done_path,
+                jobs_dir=tmp_dir,
+                batch_size=2,
+                tolerance={'default': 1, 'example1.com': 2},
+                store=store_path
+            )
+            sc.assign_jobs()
+            jobs = sc.get_jobs()
+            assert not list(Path(tmp_dir).glob('jobs_batch_*.csv')), AssertionError("CSV files written")
+            with JobStore(store_path) as store:
+                assert sorted(store.get_batch_ids()) == sorted(jobs.keys()), AssertionError(
+                    f"Batch ids: got = {store.get_batch_ids()}, expected = {list(jobs.keys())}"
+                )
+                for batch_id, batch in jobs.items():
+                    got = store.get_batch(batch_id)
+                    assert got == batch, AssertionError(f"Batch {batch_id}: got = {got}, expected = {batch}")
+                paths = store.export_csv(tmp_dir)
+                with open(paths[0], 'r', encoding='utf-8') as f:
+                    exported = [row['EMAIL'] for row in csv.DictReader(f)]
+                assert exported == store.get_batch(store.get_batch_ids()[0]), AssertionError(
+                    f"Exported: got = {exported}"
+                )
+            sc.clear_job_files()
+            with JobStore(store_path) as store:
+                assert len(store) == 0, AssertionError(f"Store not cleared: {len(store)} batches")
+        print(f">> [{self.__class__.__name__}] OK.")
@@ -1,4 +1,21 @@
-from .sender import BatchSender
+from importlib import import_module
 
 
-__all__ = ['BatchSender']
\ No newline at end of file
+# 子模块在第一次访问时才导入（PEP 562），`import sender` 不会导入 smtplib 和 socks
+_exports = {
+    'BatchSender': '.sender',
+    'AsyncBatchSender': '.sender',
+    'AccountPool': '.pool',
+    'JobWorker': '.worker',
+}
+
+
+__all__ = ['BatchSender', 'AsyncBatchSender', 'AccountPool', 'JobWorker']
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,89 @@
+from base64 import encodebytes
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+from pathlib import Path
+from threading import Lock
+import mmap
+
+
+class AttachmentCache(object):
+
+    """
+    附件缓存：每个附件文件只读取和编码一次，编码后的 MIME 部分在所有邮件之间共享。
+    1、大小超过 mmap_size 的文件用 mmap 读取，避免把整个文件复制到内存中；
+    2、缓存的总大小（编码后）超过 max_bytes 时，按 LRU 淘汰最久未使用的附件；
+    3、文件被修改（mtime 或大小变化）后重新编码；
+    4、同一个文件用不同的名称作为附件时分别缓存，MIME 部分中包含附件名称。
+    """
+
+    _config = {
+        'max_bytes': 256 * 1024 * 1024,  # 缓存的总大小上限（字节）
+        'mmap_size': 1024 * 1024,  # 超过该大小（字节）的文件用 mmap 读取
+    }
+
+    def __init__(self, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._parts = OrderedDict()  # {(path, mtime, size, filename): (part, nbytes)}
+        self._nbytes = 0
+        self._lock = Lock()
+
+    def _read_encoded(self, path, size):
+        with open(path, 'rb') as f:
+            # 空文件不能用 mmap 读取
+            if size == 0 or size < self._config['mmap_size']:
+                return encodebytes(f.read()).decode('ascii')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return encodebytes(mm).decode('ascii')
+
+    @staticmethod
+    def _build_part(payload, filename):
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(payload)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', f'attachment; filename={filename}')
+        return part
+
+    def _evict(self):
+        while self._nbytes > self._config['max_bytes'] and self._parts:
+            _, (_, nbytes) = self._parts.popitem(last=False)
+            self._nbytes -= nbytes
+
+    def get(self, path, filename):
+        """
+        :param path: 附件文件路径
+        :param filename: 邮件中显示的附件名称
+        :return: 编码后的 MIME 部分，只读，不要修改
+        """
+        path = Path(path)
+        stat = path.stat()
+        key = (str(path.absolute()), stat.st_mtime_ns, stat.st_size, filename)
+        with self._lock:
+            if key in self._parts:
+                self._parts.move_to_end(key)
+                return self._parts[key][0]
+
+        payload = self._read_encoded(path, stat.st_size)
+        part = self._build_part(payload, filename)
+        nbytes = len(payload)
+        if nbytes > self._config['max_bytes']:  # 太大，不缓存
+            return part
+        with self._lock:
+            if key not in self._parts:
+                self._parts[key] = (part, nbytes)
+                self._nbytes += nbytes
+                self._evict()
+        return part
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+            self._nbytes = 0
+
+
+attachment_cache = AttachmentCache()
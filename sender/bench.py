@@ -0,0 +1,153 @@
+import json
+import logging
+import multiprocessing
+import tempfile
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, process_time
+
+from .sender import EmailSender, BatchSender, AsyncBatchSender
+from .sink import SMTPSink
+
+
+__all__ = ['BenchBatchSender']
+
+
+def _serve_sink(config, queue, stop):
+    with SMTPSink(**config) as sink:
+        queue.put(sink.port)
+        stop.wait()
+        queue.put(sink.get_stats())
+
+
+class _SinkProcess(object):
+
+    """ 在单独的进程中运行 SMTPSink，这样测得的 CPU 时间只包含发送端 """
+
+    def __init__(self, **config):
+        self._config = config
+        self._queue = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._process = None
+        self.port = None
+        self.stats = None
+
+    def __enter__(self):
+        self._process = multiprocessing.Process(
+            target=_serve_sink, args=(self._config, self._queue, self._stop), daemon=True)
+        self._process.start()
+        self.port = self._queue.get(timeout=10)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self.stats = self._queue.get(timeout=10)
+        self._process.join()
+
+
+class _SendTimer(object):
+
+    """ 记录 EmailSender.send / send_many 每次调用的耗时 """
+
+    def __init__(self):
+        self.latencies = []
+        self._lock = Lock()
+        self._origins = {}
+
+    def _wrap(self, func):
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.latencies.append(perf_counter() - start)
+        return timed
+
+    def __enter__(self):
+        for name in ('send', 'send_many'):
+            self._origins[name] = getattr(EmailSender, name)
+            setattr(EmailSender, name, self._wrap(self._origins[name]))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for name, func in self._origins.items():
+            setattr(EmailSender, name, func)
+
+
+class BenchBatchSender(object):
+
+    """
+    用本地的 SMTPSink 离线压测发送流程（smtplib、MIME 序列化、会话复用和重连），
+    报告吞吐量（封/秒）、每次发送的 p50/p99 延迟，以及发送端每封邮件的 CPU 时间。
+    SMTPSink 不支持 TLS，因此不包含 TLS 握手的开销。
+    """
+
+    def __init__(self, data_dir, n=500, concurrency=8, **sink_config):
+        """
+        :param n: 收件人数量
+        :param concurrency: AsyncBatchSender 的并发会话数量
+        :param sink_config: SMTPSink 的参数，例如 latency=0.002, disconnect_rate=0.01
+        """
+        self._data_dir = Path(data_dir)
+        self._n = n
+        self._concurrency = concurrency
+        self._sink_config = {'latency': 0.002, **sink_config}
+
+    def _write_files(self, tmp_dir, port):
+        user_path = tmp_dir / 'user.json'
+        with open(user_path, 'w', encoding='utf-8') as f:
+            json.dump({'email': 'bench@server.com', 'name': 'Bench', 'password': 'bench',
+                       'server': '127.0.0.1', 'port': port, 'ssl': False}, f)
+        job_path = tmp_dir / 'jobs_batch_0.csv'
+        with open(job_path, 'w', encoding='utf-8') as f:
+            f.write('EMAIL\n')
+            f.writelines(f"user{i}@example{i % 50}.com\n" for i in range(self._n))
+        return user_path, job_path
+
+    @staticmethod
+    def _percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))] if values else 0.
+
+    def _measure(self, name, func):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                _SinkProcess(**self._sink_config) as sink:
+            tmp_dir = Path(tmp_dir)
+            user_path, job_path = self._write_files(tmp_dir, sink.port)
+            template_path = self._data_dir / 'template_example.txt'
+            with _SendTimer() as timer:
+                start, cpu = perf_counter(), process_time()
+                func(job_path, user_path, template_path, tmp_dir / 'jobs_done.csv')
+                elapsed, cpu = perf_counter() - start, process_time() - cpu
+
+        latencies = timer.latencies
+        print(f">> [{self.__class__.__name__}] {name}: messages = {self._n}, "
+              f"received = {sink.stats['recipients']}, connections = {sink.stats['connections']}\n"
+              f">> - throughput: {self._n / elapsed:.1f} msg/s\n"
+              f">> - latency: p50 = {self._percentile(latencies, 0.5) * 1000:.2f}ms, "
+              f"p99 = {self._percentile(latencies, 0.99) * 1000:.2f}ms\n"
+              f">> - cpu: {cpu / self._n * 1000:.3f}ms/msg")
+
+    def run(self, runners=None):
+        """
+        :param runners: dict {名称: func(job_path, user_path, template_path, done_path)}，
+            额外需要压测的发送入口，例如 Runner.run_job_sender
+        """
+        sender_logger = logging.getLogger('sender')
+        level = sender_logger.level
+        sender_logger.setLevel(logging.WARNING)
+        cases = {
+            'BatchSender': lambda job, user, template, done: BatchSender(
+                user, template, job, done, gap_time=0).run(),
+            f'AsyncBatchSender(concurrency={self._concurrency})':
+                lambda job, user, template, done: AsyncBatchSender(
+                    user, template, job, done, gap_time=0,
+                    concurrency=self._concurrency).run(),
+        }
+        cases.update(runners or {})
+        try:
+            for name, func in cases.items():
+                self._measure(name, func)
+        finally:
+            sender_logger.setLevel(level)
@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+
+
+class SendJournal(object):
+
+    """
+    发送日志（write-ahead journal）：记录一个 job 文件的发送进度，进程崩溃后重新运行时从中断的位置继续。
+    journal 文件与 job 文件在同一个文件夹，文件名为 `<job 文件名>.journal`，每行一条记录：
+    J <job 文件大小> <job 文件 mtime>    文件头，job 文件变化后 journal 作废
+    B <收件人> <收件人> ...              开始发送（在连接 SMTP 服务器之前写入）
+    E <收件人> <状态>                    发送完成，结果已写入 jobs_done
+    E <收件人> RETRY                     发送失败，已放入重试队列，服务器没有接受该邮件
+    已完成的收件人在重新运行时跳过；等待重试的收件人重新运行时当作没有发送过，重新排队；
+    已开始但没有完成的收件人（崩溃时正在发送）不会自动重发，而是交给调用者以 RECONCILE 状态记录，需要人工核对。
+    BatchSender 在写入 E 之前 flush ResultWriter，E 中的收件人一定已经写入 jobs_done；
+    在两者之间崩溃时，该收件人重新运行时记录为 RECONCILE。
+    """
+
+    suffix = '.journal'
+    retry_status = 'RETRY'
+
+    def __init__(self, job_path, fsync=False):
+        """
+        :param job_path: job 文件路径
+        :param fsync: 每条记录写入后是否调用 fsync
+        """
+        self._job_path = Path(job_path)
+        self._path = self._job_path.with_name(self._job_path.name + self.suffix)
+        self._fsync = fsync
+        self.done = {}  # {收件人: 状态}
+        self.in_flight = set()  # 已开始但没有完成的收件人
+        self._load()
+        self._file = open(self._path, 'a', encoding='utf-8')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._append(f"J {self._identity()}")
+
+    def _identity(self):
+        stat = self._job_path.stat()
+        return f"{stat.st_size} {stat.st_mtime_ns}"
+
+    def _load(self):
+        if not self._path.exists():
+            return
+        with open(self._path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        if not lines or lines[0] != f"J {self._identity()}":
+            # job 文件已经变化，旧的 journal 作废
+            self._path.unlink()
+            return
+        for line in lines[1:]:
+            items = line.split()
+            if not items:
+                continue
+            if items[0] == 'B':
+                self.in_flight.update(items[1:])
+            elif items[0] == 'E' and len(items) == 3:
+                self.in_flight.discard(items[1])
+                if items[2] != self.retry_status:
+                    self.done[items[1]] = items[2]
+
+    def _append(self, line):
+        self._file.write(line + '\n')
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+
+    def begin(self, receivers):
+        self._append('B ' + ' '.join(receivers))
+
+    def end(self, receiver, status):
+        self._append(f"E {receiver} {status}")
+        self.done[receiver] = status
+
+    def retry(self, receiver):
+        """ 收件人等待重试，不是已完成，也不是正在发送 """
+        self._append(f"E {receiver} {self.retry_status}")
+
+    def close(self):
+        self._file.close()
+
+    @classmethod
+    def remove(cls, job_path):
+        """ 删除 job 文件对应的 journal """
+        path = Path(job_path)
+        path = path.with_name(path.name + cls.suffix)
+        if path.exists():
+            path.unlink()
@@ -0,0 +1,133 @@
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket(object):
+
+    """
+    令牌桶：以 rate（个/秒）的速度补充令牌，最多积累 burst 个，rate 为 0 表示不限速。
+    reserve() 立即预定 n 个令牌并返回需要等待的时长，令牌数可以为负，
+    因此多个发送者共享同一个令牌桶时会自动排队。
+    """
+
+    def __init__(self, rate, burst=1):
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = monotonic()
+        self._paused_until = 0.
+
+    def _refill(self, now):
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def reserve(self, now, n=1):
+        if not self._rate:
+            return max(0., self._paused_until - now)
+        self._refill(now)
+        self._tokens -= n
+        wait = 0. if self._tokens >= 0 else -self._tokens / self._rate
+        return max(wait, self._paused_until - now)
+
+    def pause(self, now, seconds):
+        self._paused_until = max(self._paused_until, now + seconds)
+
+
+class RateLimiter(object):
+
+    """
+    发送速率限制：按发件账号和收件域名分别维护令牌桶，可以被多个并发发送者共享。
+    1、per_minute / per_hour 为 0 表示不限制，burst 为允许的突发数量；
+    2、令牌在发送期间持续补充，所以发送耗费的时间会自动从等待时间中扣除；
+    3、收到 421 时暂停该账号，收到 450/451 时暂停该收件域名，
+       暂停时长从 backoff 开始指数增长，最长 max_backoff，发送成功后复位。
+    """
+
+    _config = {
+        'account': {'per_minute': 0, 'per_hour': 0, 'burst': 1},  # 每个发件账号的限制
+        'domain': {'per_minute': 0, 'per_hour': 0, 'burst': 1},  # 每个收件域名的限制
+        'backoff': 60,  # 首次退避时长（秒）
+        'max_backoff': 900,  # 最长退避时长（秒）
+    }
+
+    _account_codes = {421}
+    _domain_codes = {450, 451}
+
+    def __init__(self, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._buckets = {}  # {(scope, key): [TokenBucket, ...]}
+        self._backoffs = {}  # {(scope, key): 当前退避时长}
+        self._lock = Lock()
+
+    @classmethod
+    def from_gap_time(cls, gap_time, **kwargs):
+        """
+        :param gap_time: 同一个账号两次发送之间的最小间隔（秒），kwargs 中没有 account 限制时使用，0 表示不限制
+        :param kwargs: RateLimiter 的参数
+        """
+        if gap_time and 'account' not in kwargs:
+            kwargs['account'] = {'per_minute': 60 / gap_time, 'burst': 1}
+        return cls(**kwargs)
+
+    def _get_buckets(self, scope, key):
+        if (scope, key) not in self._buckets:
+            limit = self._config[scope]
+            burst = limit.get('burst', 1)
+            buckets = []
+            if limit.get('per_minute'):
+                buckets.append(TokenBucket(limit['per_minute'] / 60, burst))
+            if limit.get('per_hour'):
+                buckets.append(TokenBucket(limit['per_hour'] / 3600, burst))
+            self._buckets[(scope, key)] = buckets
+        return self._buckets[(scope, key)]
+
+    def reserve(self, account, domain, n=1):
+        """
+        预定一次发送，返回需要等待的时长（秒）。
+        :param n: 本次发送的收件人数量，合并发送（一次事务多个 RCPT）时每个收件人消耗一个令牌
+        """
+        now = monotonic()
+        wait = 0.
+        with self._lock:
+            for scope, key in (('account', account), ('domain', domain)):
+                for bucket in self._get_buckets(scope, key):
+                    wait = max(wait, bucket.reserve(now, n))
+        return wait
+
+    def acquire(self, account, domain, n=1):
+        """ 阻塞直到允许发送 """
+        wait = self.reserve(account, domain, n)
+        if wait > 0:
+            sleep(wait)
+
+    def report(self, account, domain, code=None):
+        """
+        报告一次发送的结果。
+        :param code: SMTP 响应码，发送成功时为 None
+        """
+        if code in self._account_codes:
+            scope, key = 'account', account
+        elif code in self._domain_codes:
+            scope, key = 'domain', domain
+        else:
+            if code is None:
+                with self._lock:
+                    self._backoffs.pop(('account', account), None)
+                    self._backoffs.pop(('domain', domain), None)
+            return
+
+        with self._lock:
+            seconds = self._backoffs.get((scope, key), 0) * 2 or self._config['backoff']
+            seconds = min(seconds, self._config['max_backoff'])
+            self._backoffs[(scope, key)] = seconds
+            buckets = self._get_buckets(scope, key)
+            if not buckets:  # 不限速的 key 也需要能够暂停
+                buckets.append(TokenBucket(0))
+            for bucket in buckets:
+                bucket.pause(monotonic(), seconds)
@@ -1,47 +1,195 @@
+import atexit
+import json
 import logging
-from pathlib import Path
+import logging.handlers
+import os
+import queue
+import random
 from datetime import datetime
+from pathlib import Path
+from threading import Lock
+
+
+class _JsonFormatter(logging.Formatter):
+
+    """ 每条日志一行 JSON：{"time": ..., "level": ..., 字段...} """
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+    def formatTime(self, record, datefmt=None):
+        return datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')
+
+
+class _ConsoleFormatter(logging.Formatter):
+
+    """ 控制台保持原来的格式：[时间][级别]: k = v, k = v """
+
+    def format(self, record):
+        record.message = ', '.join(f"{k} = {v}" for k, v in getattr(record, 'fields', {}).items())
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        return self.formatMessage(record)
+
+
+class _SampleFilter(logging.Filter):
+
+    """ 按比例抽样输出 INFO 级别的日志，WARNING 及以上全部输出 """
+
+    def __init__(self, rate):
+        super().__init__()
+        self._rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self._rate
+
+
+class _RotatingFileHandler(logging.handlers.RotatingFileHandler):
+
+    """
+    按日期和大小轮转：日志写入 `<name><yyyymmdd>.log`，日期变化时写入新的文件；
+    单个文件超过 max_bytes 时重命名为 .1, .2, ...，最多保留 backup_count 个。
+    """
+
+    def __init__(self, file_dir, name, max_bytes, backup_count, encoding):
+        self._file_dir = Path(file_dir)
+        self._name = name
+        self._date = self._today()
+        super().__init__(self._get_path(), maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=True)
+
+    @staticmethod
+    def _today():
+        return datetime.now().strftime('%Y%m%d')
+
+    def _get_path(self):
+        return self._file_dir / f"{self._name}{self._date}.log"
+
+    def shouldRollover(self, record):
+        if self._today() != self._date:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        if self._today() == self._date:
+            super().doRollover()
+            return
+        # 日期变化，切换到新的文件
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self._date = self._today()
+        self.baseFilename = os.path.abspath(self._get_path())
 
 
 class _Logger(object):
 
+    """
+    日志写入队列，由后台线程（QueueListener）格式化并写入文件和控制台，发送线程不等待磁盘和控制台。
+    1、文件中每条日志一行 JSON，按日期和大小轮转；
+    2、控制台按 console_sample 的比例抽样输出，WARNING 及以上全部输出；
+    3、第一次写日志时才创建日志文件夹和后台线程，import 时不做任何事情；
+       需要修改参数时，在第一次写日志之前调用 configure；
+    4、进程退出时写完队列中剩余的日志。
+    """
+
     _config = {
-        'format': '[%(asctime)s][%(levelname)s]: %(message)s',
+        'format': '[%(asctime)s][%(levelname)s]: %(message)s',  # 控制台的格式
         'encoding': 'utf-8',
         'file_dir': 'data/logs',
-        'logger_name': 'sender'
+        'logger_name': 'sender',
+        'max_bytes': 100 * 1024 * 1024,  # 单个日志文件的大小上限，0: 不按大小轮转
+        'backup_count': 10,  # 按大小轮转时保留的文件数量
+        'console_sample': 1.,  # 控制台输出 INFO 日志的比例，0: 不输出
     }
 
     def __init__(self):
+        self._config = dict(self._config)
+        self._logger = None
+        self._listener = None
+        self._lock = Lock()
 
-        logging.basicConfig(
-            level=logging.INFO,  # 设置日志级别
-            format=self._config['format'],  # 日志格式
-            encoding=self._config['encoding'],
-            handlers=[
-                logging.FileHandler(self._logger_file_path),  # 日志写入文件
-                logging.StreamHandler()  # 同时输出到控制台
-            ]
-        )
-
-        logs_dir = Path(self._config['file_dir'])
-        if not logs_dir.exists():
-            logs_dir.mkdir()
-
-        self._logger = logging.getLogger(self._config['logger_name'])
-
-    @property
-    def _logger_file_path(self):
-        filename = ''.join([
-            self._config['logger_name'],
-            datetime.now().strftime("%Y%m%d"),
-            '.log']
-        )
-        return Path(self._config['file_dir']) / filename
+    def configure(self, **kwargs):
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+        # 已经初始化时，用新的参数重新初始化
+        self.close()
+
+    def _setup(self):
+        with self._lock:
+            if self._logger is not None:
+                return self._logger
+            logs_dir = Path(self._config['file_dir'])
+            logs_dir.mkdir(parents=True, exist_ok=True)
+
+            file_handler = _RotatingFileHandler(logs_dir, self._config['logger_name'],
+                                                self._config['max_bytes'],
+                                                self._config['backup_count'],
+                                                self._config['encoding'])
+            file_handler.setFormatter(_JsonFormatter())
+            handlers = [file_handler]
+            if self._config['console_sample'] > 0:
+                console_handler = logging.StreamHandler()
+                console_handler.setFormatter(_ConsoleFormatter(self._config['format']))
+                console_handler.addFilter(_SampleFilter(self._config['console_sample']))
+                handlers.append(console_handler)
+
+            log_queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(log_queue, *handlers)
+            self._listener.start()
+
+            logger = logging.getLogger(self._config['logger_name'])
+            if logger.level == logging.NOTSET:
+                logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            self._logger = logger
+            return logger
+
+    def _log(self, level, fields):
+        logger = self._logger or self._setup()
+        logger.log(level, '', extra={'fields': fields})
 
     def info(self, **kwargs):
-        msg = [f"{k} = {v}" for k, v in kwargs.items()]
-        self._logger.info(', '.join(msg))
+        self._log(logging.INFO, kwargs)
+
+    def warning(self, **kwargs):
+        self._log(logging.WARNING, kwargs)
+
+    def close(self):
+        """ 写完队列中剩余的日志，停止后台线程 """
+        with self._lock:
+            if self._logger is None:
+                return
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            for handler in list(self._logger.handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    self._logger.removeHandler(handler)
+            self._logger = None
+            self._listener = None
+
+    def _reset_after_fork(self):
+        """
+        fork 出的子进程没有父进程的后台线程，丢弃继承的队列和 handler（不关闭，避免重复写入父进程缓冲的内容），
+        子进程第一次写日志时重新初始化。
+        """
+        if self._logger is not None:
+            for handler in list(self._logger.handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    self._logger.removeHandler(handler)
+        self._logger = None
+        self._listener = None
+        self._lock = Lock()
 
 
-logger = _Logger()
\ No newline at end of file
+logger = _Logger()
+atexit.register(logger.close)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=logger._reset_after_fork)
@@ -0,0 +1,157 @@
+import json
+from bisect import bisect_left
+from pathlib import Path
+from threading import Lock
+
+
+class Histogram(object):
+
+    """ 累积直方图：记录落入每个区间的次数、总次数和总耗时 """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个区间是 +Inf
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """ 用区间上界估计分位数，落入 +Inf 区间时返回最后一个上界 """
+        if not self.count:
+            return 0.
+        rank = q * self.count
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if total >= rank:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics(object):
+
+    """
+    发送流程的耗时统计，按阶段、账号和收件人域名聚合，线程安全。
+    阶段：connect（DNS 解析和 TCP 连接），tls（TLS 握手），login，build（Message.build），
+    serialize（MIME 序列化），data（MAIL/RCPT/DATA 事务）。
+    connect、tls、login 只在建立连接时出现，记在触发重连的那封邮件的域名下；
+    发送数量按每次发送计数，重试的收件人会被计入多次。
+    结果可以导出为 Prometheus 文本格式和 JSON 摘要。
+    """
+
+    _config = {
+        'buckets': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),  # 秒
+        'prefix': 'email_sender',  # Prometheus 指标名的前缀
+    }
+
+    def __init__(self, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._histograms = {}  # {(阶段, 账号, 域名): Histogram}
+        self._counters = {}  # {(账号, 域名, 状态): 次数}
+        self._lock = Lock()
+
+    def observe(self, account, domain, timings):
+        """
+        记录一次发送各阶段的耗时。
+        :param timings: dict {阶段: 耗时（秒）}
+        """
+        with self._lock:
+            for phase, seconds in timings.items():
+                key = (phase, account, domain)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(self._config['buckets'])
+                self._histograms[key].observe(seconds)
+
+    def count(self, account, domain, status, n=1):
+        """ 记录发送结果的数量 """
+        with self._lock:
+            key = (account, domain, status)
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    @staticmethod
+    def _labels(**labels):
+        items = []
+        for k, v in labels.items():
+            v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            items.append(f'{k}="{v}"')
+        return '{' + ','.join(items) + '}'
+
+    def to_prometheus(self):
+        prefix = self._config['prefix']
+        lines = [f"# HELP {prefix}_phase_seconds Send path latency by phase.",
+                 f"# TYPE {prefix}_phase_seconds histogram"]
+        with self._lock:
+            for (phase, account, domain), h in sorted(self._histograms.items()):
+                labels = {'phase': phase, 'account': account, 'domain': domain}
+                total = 0
+                for bound, n in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    total += n
+                    lines.append(f"{prefix}_phase_seconds_bucket"
+                                 f"{self._labels(**labels, le=bound)} {total}")
+                lines.append(f"{prefix}_phase_seconds_sum{self._labels(**labels)} {h.sum:.6f}")
+                lines.append(f"{prefix}_phase_seconds_count{self._labels(**labels)} {h.count}")
+            lines += [f"# HELP {prefix}_messages_total Messages sent by status.",
+                      f"# TYPE {prefix}_messages_total counter"]
+            for (account, domain, status), n in sorted(self._counters.items()):
+                labels = self._labels(account=account, domain=domain, status=status)
+                lines.append(f"{prefix}_messages_total{labels} {n}")
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        """
+        JSON 摘要：每个阶段的总体统计，以及按账号、按域名分别聚合的统计和发送数量。
+        """
+        summary = {'phases': {}, 'accounts': {}, 'domains': {}, 'messages': {}}
+        with self._lock:
+            merged = {}
+            for (phase, account, domain), h in self._histograms.items():
+                for group, key in (('phases', None), ('accounts', account), ('domains', domain)):
+                    target = merged.setdefault((group, key, phase), Histogram(h.buckets))
+                    target.merge(h)
+            for (group, key, phase), h in merged.items():
+                if key is None:
+                    summary[group][phase] = h.summary()
+                else:
+                    summary[group].setdefault(key, {})[phase] = h.summary()
+            for (account, domain, status), n in self._counters.items():
+                summary['messages'][status] = summary['messages'].get(status, 0) + n
+        return summary
+
+    def write(self, path_prefix):
+        """
+        导出到 `<path_prefix>.prom` 和 `<path_prefix>.json`
+        """
+        path_prefix = Path(path_prefix)
+        prom_path = path_prefix.with_name(path_prefix.name + '.prom')
+        json_path = path_prefix.with_name(path_prefix.name + '.json')
+        with open(prom_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return prom_path, json_path
@@ -0,0 +1,272 @@
+import smtplib
+from collections import deque
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from .user import User
+from .sender import BatchSender
+from .limiter import RateLimiter
+from .result import ResultWriter
+from .metrics import Metrics
+from .log import logger
+
+
+class Account(object):
+
+    """
+    发件账号：记录最近一天和最近一小时的发送数量，以及账号的健康状态。
+    1、配额来自用户配置中的 daily_quota 和 hourly_quota（0 表示不限制），按滑动窗口计算；
+    2、连续失败 max_failures 次后暂停 cooldown 秒，发送成功后复位；
+    3、登录失败（用户名或密码错误）后，本次运行不再使用该账号。
+    """
+
+    _config = {
+        'max_failures': 5,  # 连续失败的次数上限
+        'cooldown': 600,  # 连续失败后暂停的时长（秒）
+    }
+
+    _day, _hour = 24 * 3600, 3600
+
+    def __init__(self, user_path, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self.user_path = Path(user_path)
+        self.user = User(user_path)
+        self._sent = deque()  # 最近一天的发送时间
+        self._failures = 0
+        self._paused_until = 0.
+        self.disabled = False
+        self.proxy_pool = None  # 该账号所有批次共享的 ProxyPool，在第一个批次开始前读取
+        self.proxy_loaded = False
+        self._lock = Lock()
+
+    @property
+    def email(self):
+        return self.user.email
+
+    def wait_time(self):
+        """
+        距离下一次可以发送还需要等待的时长（秒），0 表示现在可以发送。
+        """
+        now = monotonic()
+        with self._lock:
+            while self._sent and now - self._sent[0] >= self._day:
+                self._sent.popleft()
+            wait = max(0., self._paused_until - now)
+            quotas = ((self.user.daily_quota, self._day), (self.user.hourly_quota, self._hour))
+            for quota, seconds in quotas:
+                if not quota:
+                    continue
+                in_window = [t for t in self._sent if now - t < seconds]
+                if len(in_window) >= quota:
+                    # 等到窗口中最早的一次发送过期
+                    wait = max(wait, in_window[len(in_window) - quota] + seconds - now)
+        return wait
+
+    def report(self, status, error=None):
+        with self._lock:
+            self._sent.append(monotonic())
+            if status == 'OK':
+                self._failures = 0
+                return
+            if isinstance(error, smtplib.SMTPAuthenticationError):
+                self.disabled = True
+                return
+            self._failures += 1
+            if self._failures >= self._config['max_failures']:
+                self._paused_until = monotonic() + self._config['cooldown']
+                self._failures = 0
+
+
+class _AccountSender(BatchSender):
+
+    """
+    AccountPool 中的一个账号发送一个批次（或者批次中剩余的收件人）。
+    每个发送结果计入账号的配额和健康状态；账号需要等待或者不可用时，在下一个发送单元之前停止，
+    没有最终结果的收件人（没有开始发送的和等待重试的）由 remaining() 返回。
+    """
+
+    def __init__(self, account, receivers, *args, **kwargs):
+        """
+        :param account: Account
+        :param receivers: 只发送批次中的这些收件人，为空时发送整个批次
+        """
+        super().__init__(account.user_path, *args, **kwargs)
+        self._account = account
+        self._only = receivers
+        self._recorded = set()
+
+    def _load_receivers(self):
+        super()._load_receivers()
+        if self._only is not None:
+            only = set(self._only)
+            self._receivers = [re for re in self._receivers if re in only]
+
+    def _open_proxy_pool(self):
+        # 同一个账号的所有批次共享一个代理池，只在第一个批次读取和检查代理
+        if not self._account.proxy_loaded:
+            super()._open_proxy_pool()
+            self._account.proxy_pool, self._account.proxy_loaded = self._proxy_pool, True
+        self._proxy_pool = self._account.proxy_pool
+
+    def _is_stopped(self):
+        return super()._is_stopped() or self._account.disabled or self._account.wait_time() > 0
+
+    def _finish(self, sender, results, attempt):
+        error = sender.get_last_error()
+        for status in results.values():
+            self._account.report(status, error)
+        return super()._finish(sender, results, attempt)
+
+    def _record(self, receiver, status, attempts=1):
+        super()._record(receiver, status, attempts)
+        self._recorded.add(receiver)
+
+    def remaining(self):
+        done = self._journal.done if self._journal else {}
+        return [re for re in self._receivers if re not in self._recorded and re not in done]
+
+
+class AccountPool(object):
+
+    """
+    多账号发送池：每个账号一个线程，从共享队列中领取批次（job 文件），用 BatchSender 发送，
+    所有账号共享同一个 RateLimiter、ResultWriter 和 Metrics，结果写入同一个 jobs_done 文件；
+    envelope、journal、重试等由 sender 中的 BatchSender 参数控制。
+    账号的配额用完或暂停时，把批次中剩余的收件人放回队列，由其他有余量的账号继续发送；
+    需要等待超过 max_wait 秒（例如当天配额已用完）的账号退出。
+    所有账号都退出后，队列中剩余的收件人不会被发送，也不会被记录，下次分配任务时会重新分配。
+    """
+
+    _config = {
+        'gap_time': 10,  # 同一个账号两个任务之间的最小间隔时长，单位：秒
+        'rate_limit': {},  # RateLimiter 的参数
+        'session': {},  # SMTPSession 的参数
+        'result': {},  # ResultWriter 的参数
+        'account': {},  # Account 的参数，例如 {'max_failures': 3}
+        'sender': {},  # BatchSender 的参数，例如 {'journal': True, 'retry': {'max_attempts': 5}}
+        'max_wait': 3600,  # 账号等待配额的最长时长（秒）
+        'metrics_path': None,  # 不为空时，运行结束后把所有账号的耗时统计导出到 `<metrics_path>.prom` 和 `.json`
+        'simulate': False,  # 用于测试, True 模拟发送邮件
+        'proxy_filename': 'proxy.json'  # proxy.json 与 user_path 在同一个文件夹下
+    }
+
+    def __init__(self, user_paths, template_path, jobs_paths, done_path, **kwargs):
+        """
+        :param user_paths: 用户配置文件的路径列表
+        :param template_path: 模板文件路径
+        :param jobs_paths: job 文件的路径列表，例如 data/jobs/jobs_batch_*.csv
+        :param done_path: jobs_done 文件的路径
+        """
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._accounts = [Account(p, **self._config['account']) for p in user_paths]
+        self._template_path = Path(template_path)
+        self._jobs_paths = [Path(p) for p in jobs_paths]
+        self._done_path = Path(done_path)
+        self._queue = Queue()  # 待发送的批次 (job 文件, 剩余的收件人)，收件人为 None 时发送整个批次
+        self._limiter = RateLimiter.from_gap_time(self._config['gap_time'], **self._config['rate_limit'])
+        self._metrics = Metrics()
+        self._writer = None
+        self._pending = 0  # 已被领取、还没有处理完的批次数量
+        self._lock = Lock()
+
+    def _create_sender(self, account, job_path, receivers):
+        kwargs = {
+            'session': self._config['session'],
+            'simulate': self._config['simulate'],
+            'proxy_filename': self._config['proxy_filename'],
+            **self._config['sender'],
+            'limiter': self._limiter,
+            'writer': self._writer,
+            'metrics': self._metrics,
+        }
+        return _AccountSender(account, receivers, self._template_path, job_path, self._done_path,
+                              **kwargs)
+
+    def _wait(self, account):
+        """ 等待账号可以发送，等待时间过长或账号不可用时返回 False """
+        wait = account.wait_time()
+        if account.disabled or wait > self._config['max_wait']:
+            return False
+        if wait > 0:
+            sleep(wait)
+        return True
+
+    def _take(self):
+        """ 领取一个批次，队列为空且没有正在处理的批次时返回 None """
+        while True:
+            with self._lock:
+                try:
+                    job = self._queue.get_nowait()
+                except Empty:
+                    if self._pending == 0:
+                        return None
+                else:
+                    self._pending += 1
+                    return job
+            # 其他账号可能会放回剩余的收件人
+            sleep(1)
+
+    def _send_job(self, account, job_path, receivers):
+        """
+        发送一个批次，账号需要等待时把剩余的收件人放回队列。
+        :return: 账号是否可以继续使用
+        """
+        sender = self._create_sender(account, job_path, receivers)
+        sender.run()
+        if remaining := sender.remaining():
+            # 把剩余的收件人放回队列，交给其他账号
+            self._queue.put((job_path, remaining))
+            return self._wait(account)
+        return True
+
+    def _work(self, account):
+        while (job := self._take()) is not None:
+            try:
+                available = self._send_job(account, *job)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+            if not available:
+                logger.info(account=account.email, action="account unavailable")
+                return
+
+    def _export_metrics(self):
+        if not self._config['metrics_path']:
+            return
+        try:
+            prom_path, json_path = self._metrics.write(self._config['metrics_path'])
+            logger.info(action="metrics exported", prometheus=prom_path, summary=json_path)
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+    def run(self):
+        for job_path in self._jobs_paths:
+            self._queue.put((job_path, None))
+        logger.info(action="loading jobs", job_files=len(self._jobs_paths),
+                    account_number=len(self._accounts))
+        self._writer = ResultWriter(self._done_path, **self._config['result'])
+        threads = [Thread(target=self._work, args=(account,)) for account in self._accounts]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            self._writer.close()
+            self._export_metrics()
+        if left := self._queue.qsize():
+            logger.info(action="jobs left", batch_number=left)
@@ -0,0 +1,210 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from time import monotonic, perf_counter
+
+import socks
+
+
+class Proxy(object):
+
+    """
+    一个 SOCKS（或 HTTP CONNECT）代理，以及它的统计数据：
+    latency 和 error_rate 是建立连接的耗时（秒）和失败率的指数加权移动平均（EWMA），
+    active 是正在使用该代理的连接数量。
+    """
+
+    _types = {
+        'socks5': socks.SOCKS5,
+        'socks4': socks.SOCKS4,
+        'http': socks.HTTP,
+    }
+
+    def __init__(self, host, port, type='socks5', username=None, password=None):
+        if type not in self._types:
+            raise ValueError(f"Unknown proxy type `{type}`!")
+        self.host = host
+        self.port = int(port)
+        self.type = type
+        self._username = username
+        self._password = password
+        self.latency = None  # 还没有连接过时为 None
+        self.error_rate = 0.
+        self.active = 0
+        self.disabled_until = 0.  # monotonic 时间，之前不分配新的连接
+
+    def connect(self, address, timeout=None, source_address=None):
+        """ 通过代理连接 address = (host, port)，返回已连接的 socket """
+        return socks.create_connection(address, timeout=timeout,
+                                       source_address=source_address,
+                                       proxy_type=self._types[self.type],
+                                       proxy_addr=self.host,
+                                       proxy_port=self.port,
+                                       proxy_username=self._username,
+                                       proxy_password=self._password)
+
+    def __repr__(self):
+        return f"{self.type}://{self.host}:{self.port}"
+
+
+class ProxyPool(object):
+
+    """
+    代理池：每个 SMTP 连接单独选择一个代理（socks.create_connection），不修改全局的 socket 模块，
+    同一个进程中的并发连接可以分散到多个出口。
+    1、选择代理：优先没有连接过的代理，其次按 latency * (1 + active) / (1 - error_rate) 最小的代理，
+       延迟低、失败少、当前连接少的代理分到更多的连接；
+    2、建立连接失败时换一个代理重试，最多尝试 max_tries 个代理；
+    3、错误率超过 max_error_rate 的代理暂停 cooldown 秒，之后重新参与选择；所有代理都暂停时，
+       仍然使用最早恢复的代理，不阻塞发送；
+    4、check 并发地通过每个代理连接目标服务器，用于启动时的健康检查。
+    """
+
+    _config = {
+        'alpha': 0.3,  # EWMA 中新数据的权重
+        'max_error_rate': 0.5,  # 错误率上限，超过后暂停
+        'cooldown': 300,  # 暂停的时长（秒）
+        'max_tries': 2,  # 建立一个连接最多尝试的代理数量
+        'check_timeout': 10,  # 健康检查中单个连接的超时时长（秒）
+        'workers': 8,  # 健康检查的并发线程数量
+    }
+
+    def __init__(self, proxies, **kwargs):
+        """
+        :param proxies: Proxy 列表
+        """
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self.proxies = list(proxies)
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        从 proxy.json 中读取代理，支持以下格式：
+        {"host": ..., "port": ...}                   单个代理（原来的格式）
+        [{"host": ..., "port": ..., "type": ...}, ...] 代理列表
+        {"proxies": [...]}                           代理列表
+        代理的可选字段：type（socks5, socks4, http），username，password；host 为空的代理被忽略。
+        :return: ProxyPool，文件不存在或没有代理时返回 None
+        """
+        if not path or not Path(path).exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('proxies', [data])
+            proxies = [Proxy(**item) for item in data if item.get('host')]
+        except Exception as e:
+            print(f"Proxy file reading error: {e}")
+            return None
+        return cls(proxies, **kwargs) if proxies else None
+
+    @staticmethod
+    def _score(proxy):
+        # 没有连接过的代理排在前面，它们之间按连接数量选择
+        if proxy.latency is None:
+            return 0, proxy.active
+        return 1, proxy.latency * (1 + proxy.active) / max(1 - proxy.error_rate, 0.01)
+
+    def _select(self, excluded):
+        """ 选择一个代理并增加它的连接数量，调用者需要持有锁 """
+        candidates = [p for p in self.proxies if p not in excluded]
+        if not candidates:
+            return None
+        now = monotonic()
+        available = [p for p in candidates if p.disabled_until <= now]
+        if available:
+            proxy = min(available, key=self._score)
+        else:
+            proxy = min(candidates, key=lambda p: p.disabled_until)
+        proxy.active += 1
+        return proxy
+
+    def _update(self, proxy, latency=None, error=False):
+        """ 更新代理的统计数据，调用者需要持有锁 """
+        alpha = self._config['alpha']
+        proxy.error_rate = (1 - alpha) * proxy.error_rate + alpha * float(error)
+        if latency is not None:
+            proxy.latency = latency if proxy.latency is None else \
+                (1 - alpha) * proxy.latency + alpha * latency
+        if proxy.error_rate > self._config['max_error_rate']:
+            proxy.disabled_until = monotonic() + self._config['cooldown']
+            # 恢复后的错误率从上限开始，再次失败时立即重新暂停
+            proxy.error_rate = self._config['max_error_rate']
+
+    def connect(self, address, timeout=None, source_address=None):
+        """
+        选择代理并连接 address = (host, port)，失败时换一个代理重试。
+        连接关闭后需要调用 release(proxy)。
+        :return: (Proxy, socket)
+        """
+        tried = []
+        while True:
+            with self._lock:
+                proxy = self._select(tried)
+            if proxy is None:
+                raise OSError("No proxy available")
+            tried.append(proxy)
+            start = perf_counter()
+            try:
+                sock = proxy.connect(address, timeout, source_address)
+            except OSError:  # socks.ProxyError 也是 OSError
+                with self._lock:
+                    proxy.active -= 1
+                    self._update(proxy, error=True)
+                    last = len(tried) >= min(self._config['max_tries'], len(self.proxies))
+                if last:
+                    raise
+                continue
+            with self._lock:
+                self._update(proxy, latency=perf_counter() - start)
+            return proxy, sock
+
+    def release(self, proxy):
+        """ 使用该代理的连接已关闭 """
+        with self._lock:
+            proxy.active = max(0, proxy.active - 1)
+
+    def _check(self, proxy, address):
+        start = perf_counter()
+        try:
+            proxy.connect(address, self._config['check_timeout']).close()
+        except OSError:
+            latency, error = None, True
+        else:
+            latency, error = perf_counter() - start, False
+        with self._lock:
+            self._update(proxy, latency=latency, error=error)
+            if error:  # 健康检查失败的代理直接暂停
+                proxy.disabled_until = monotonic() + self._config['cooldown']
+        return not error
+
+    def check(self, address):
+        """
+        健康检查：并发地通过每个代理连接 address，更新延迟和错误率。
+        :return: dict {Proxy: 是否可用}
+        """
+        if not self.proxies:
+            return {}
+        workers = max(1, min(self._config['workers'], len(self.proxies)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda p: self._check(p, address), self.proxies)
+            return dict(zip(self.proxies, results))
+
+    def get_stats(self):
+        """ :return: list [{'proxy': ..., 'latency': ..., 'error_rate': ..., 'active': ...}] """
+        with self._lock:
+            return [{'proxy': repr(p), 'latency': p.latency, 'error_rate': p.error_rate,
+                     'active': p.active, 'disabled': p.disabled_until > monotonic()}
+                    for p in self.proxies]
+
+    def __len__(self):
+        return len(self.proxies)
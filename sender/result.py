@@ -0,0 +1,111 @@
+import csv
+import io
+import os
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class ResultWriter(object):
+
+    """
+    jobs_done 结果写入：文件保持打开，结果先写入缓冲区，
+    缓冲的行数达到 flush_size 或距离上次写入超过 flush_time 秒时一次性写入文件。
+    1、每次写入都在文件锁（flock）内完成，多个线程或进程可以同时写同一个文件；
+    2、fsync 为 True 时，每次写入后同步到磁盘；
+    3、文件格式为 `EMAIL,TIME,STATUS,ATTEMPTS`，ATTEMPTS 是发送次数（包括重试），EmailClassifier 可以直接读取；
+       追加到旧格式（没有 ATTEMPTS 列）的文件时，保持原来的列。
+    """
+
+    header = ['EMAIL', 'TIME', 'STATUS', 'ATTEMPTS']
+
+    _config = {
+        'flush_size': 100,  # 缓冲的行数上限
+        'flush_time': 5,  # 缓冲的最长时间（秒）
+        'fsync': False,  # 写入后是否调用 fsync
+    }
+
+    def __init__(self, path, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._path = Path(path)
+        self._columns = self._read_columns()
+        self._file = open(self._path, 'a', newline='', encoding='utf-8')
+        self._rows = []
+        self._lock = Lock()
+        self._closed = Event()
+        self._flusher = Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def _read_columns(self):
+        """ 已有文件的列数，文件不存在或为空时为 header 的列数 """
+        try:
+            with open(self._path, 'r', newline='', encoding='utf-8') as f:
+                fieldnames = next(csv.reader(f), None)
+        except FileNotFoundError:
+            fieldnames = None
+        return len(fieldnames) if fieldnames else len(self.header)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self._config['flush_time']):
+            self.flush()
+
+    def _write_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            # 文件为空时先写入列名
+            if os.fstat(self._file.fileno()).st_size == 0:
+                writer.writerow(self.header)
+            writer.writerows(rows)
+            self._file.write(buffer.getvalue())
+            self._file.flush()
+            if self._config['fsync']:
+                os.fsync(self._file.fileno())
+        finally:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def write(self, receiver, status, attempts=1):
+        """
+        :param attempts: 发送次数（包括重试）
+        """
+        row = [receiver, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), status, attempts]
+        row = row[:self._columns]
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self._config['flush_size']:
+                self._flush()
+
+    def _flush(self):
+        if self._rows and not self._file.closed:
+            rows, self._rows = self._rows, []
+            self._write_rows(rows)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
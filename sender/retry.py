@@ -0,0 +1,107 @@
+import heapq
+import random
+import smtplib
+from itertools import count
+from time import monotonic
+
+from .session import SMTPDeliveryUnknown, get_reply_code
+
+
+TRANSIENT = 'transient'  # 4xx，稍后重试
+PERMANENT = 'permanent'  # 5xx 或者邮件本身的问题，不重试
+AUTH = 'auth'  # 登录失败，不重试
+CONNECTION = 'connection'  # 连接失败或断开，稍后重试
+UNKNOWN = 'unknown'  # DATA 之后连接断开，邮件可能已经被接受，不重试，需要核对
+
+RETRYABLE = {TRANSIENT, CONNECTION}
+
+
+def classify_error(error, receiver=None):
+    """
+    按 SMTP 响应码对发送失败的原因分类。
+    :param error: EmailSender.get_last_error() 返回的异常
+    :param receiver: 收件人，用于从 SMTPRecipientsRefused 中取得该收件人的响应码
+    :return: TRANSIENT, PERMANENT, AUTH, CONNECTION, UNKNOWN 之一，没有异常时返回 None
+    """
+    if error is None:
+        return None
+    if isinstance(error, SMTPDeliveryUnknown):
+        return UNKNOWN
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return AUTH
+    if isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected)):
+        return CONNECTION
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and receiver in error.recipients:
+        code = error.recipients[receiver][0]
+    else:
+        code = get_reply_code(error)
+    if code is None:
+        return CONNECTION if isinstance(error, OSError) else PERMANENT
+    if code in (530, 534, 535):
+        return AUTH
+    return TRANSIENT if 400 <= code < 500 else PERMANENT
+
+
+class RetryQueue(object):
+
+    """
+    延迟重试队列：按重试时间排序，不阻塞其他任务的发送。
+    第 n 次失败后的等待时长为 base_delay * 2^(n-1)，最长 max_delay，
+    再乘以 [1, 1 + jitter) 之间的随机数，避免大量任务同时重试。
+    """
+
+    _config = {
+        'max_attempts': 3,  # 最多发送次数（包括第一次），1: 不重试
+        'base_delay': 60,  # 第一次重试的等待时长（秒）
+        'max_delay': 3600,  # 最长等待时长（秒）
+        'jitter': 0.5,  # 随机抖动的比例
+    }
+
+    def __init__(self, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._heap = []  # [(重试时间, 序号, 任务, 已发送次数)]
+        self._seq = count()
+
+    def can_retry(self, kind, attempt):
+        """
+        :param kind: classify_error 的结果
+        :param attempt: 已发送的次数
+        """
+        return kind in RETRYABLE and attempt < self._config['max_attempts']
+
+    def get_delay(self, attempt):
+        delay = min(self._config['max_delay'], self._config['base_delay'] * 2 ** (attempt - 1))
+        return delay * (1 + self._config['jitter'] * random.random())
+
+    def push(self, item, attempt):
+        """
+        :param attempt: 已发送的次数
+        :return: 等待时长（秒）
+        """
+        delay = self.get_delay(attempt)
+        heapq.heappush(self._heap, (monotonic() + delay, next(self._seq), item, attempt))
+        return delay
+
+    def pop_ready(self):
+        """
+        :return: (任务, 已发送次数)，没有到期的任务时返回 None
+        """
+        if self._heap and self._heap[0][0] <= monotonic():
+            _, _, item, attempt = heapq.heappop(self._heap)
+            return item, attempt
+        return None
+
+    def next_delay(self):
+        """ 距离最早的任务到期还需要等待的时长（秒） """
+        if not self._heap:
+            return 0.
+        return max(0., self._heap[0][0] - monotonic())
+
+    def __len__(self):
+        return len(self._heap)
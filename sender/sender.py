@@ -1,91 +1,141 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import smtplib
-from time import sleep
+from time import perf_counter, sleep
 import csv
-from datetime import datetime
 from pathlib import Path
-import json
-
-import socks
 
 from .user import User
 from .message import Message
 from .log import logger
+from .session import SMTPSession, get_reply_code
+from .limiter import RateLimiter
+from .result import ResultWriter
+from .template import load_template
+from .journal import SendJournal
+from .retry import RetryQueue, classify_error, UNKNOWN
+from .metrics import Metrics
+from .proxy import ProxyPool
 
 
 class EmailSender(object):
 
-    def __init__(self, user_path, template_path, proxy_path=None):
+    def __init__(self, user_path, template_path, proxy_path=None, metrics=None, proxy_pool=None,
+                 **kwargs):
+        """
+        :param proxy_path: proxy.json 的路径，proxy_pool 为空时从该文件读取代理
+        :param metrics: Metrics 对象，不为空时记录每次发送各阶段的耗时
+        :param proxy_pool: 多个发送者共享的 ProxyPool，每次建立连接时从中选择代理
+        :param kwargs: SMTPSession 的参数，例如 max_messages, idle_time
+        """
         self._user = User(user_path)
         self._template_path = template_path
-        self._smtp = smtplib.SMTP_SSL if self._user.ssl else smtplib.SMTP
-        proxy = self._load_proxy(proxy_path)
-        self._set_proxy(proxy)
+        if proxy_pool is None:
+            proxy_pool = ProxyPool.load(proxy_path)
+        self._session = SMTPSession(self._user, proxy_pool=proxy_pool, **kwargs)
+        self._metrics = metrics
+        self._last_error = None
 
-    @staticmethod
-    def _load_proxy(proxy_path):
-        proxy_path = Path(proxy_path)
-        if not proxy_path.exists():
-            return None
-        try:
-            with open(proxy_path, 'r', encoding='utf-8') as file:
-                proxy = json.load(file)  # 解析 JSON 数据
-                return proxy
-        except Exception as e:
-            print(f"Proxy file reading error: {e}")
-            return None
-
-    @staticmethod
-    def _set_proxy(proxy):
-        if not proxy:
-            return
-        host = proxy['host']
-        if not host:
-            return
-        else:
-            socks.set_default_proxy(socks.SOCKS5, host, proxy['port'])
-            socks.wrapmodule(smtplib)
+    @property
+    def account(self):
+        return self._user.email
 
     def verify(self):
         try:
-            with self._smtp(self._user.server, self._user.port) as server:
-                server.login(self._user.email, self._user.password)
-                print("User account is OK.")
+            self._session.open()
+            print("User account is OK.")
         except smtplib.SMTPAuthenticationError:
             print("Incorrect email or password")
         except smtplib.SMTPConnectError:
             print("Can not connect to SMTP server")
         except Exception as e:
             print(f"Error：{e}")
+        finally:
+            self._session.close()
 
-    def _build_message(self, to):
+    def _build_message(self, to, fields=None):
         return Message(
             sender=self._user.email,
             receiver=to,
             template_path=self._template_path,
-            sender_name=self._user.name
+            sender_name=self._user.name,
+            fields=fields
         ).build()
 
-    def send(self, to):
-        msg = self._build_message(to)
+    def _observe(self, receivers, build_time, statuses):
+        if self._metrics is None:
+            return
+        domain = receivers[0].rsplit('@', 1)[-1].lower()
+        self._metrics.observe(self.account, domain, {'build': build_time, **self._session.timings})
+        for status in set(statuses):
+            self._metrics.count(self.account, domain, status, statuses.count(status))
+
+    def send(self, to, fields=None):
+        """
+        :param to: 收件人
+        :param fields: dict, 模板中占位符的值，例如 job 文件中收件人所在的行
+        """
+        self._last_error = None
+        start = perf_counter()
+        msg = self._build_message(to, fields)
+        build_time = perf_counter() - start
         try:
-            with self._smtp(self._user.server, self._user.port) as server:
-                server.login(self._user.email, self._user.password)
-                server.send_message(msg)
+            self._session.send_message(msg)
             status = 'OK'
         except Exception as e:
+            self._last_error = e
             status = 'FAIL'
             print(f"Fail: {e}")
 
+        self._observe([to], build_time, [status])
         return status
 
+    def send_many(self, receivers):
+        """
+        在一次 SMTP 事务中（MAIL FROM / 多个 RCPT TO / 一次 DATA）把相同的邮件发送给多个收件人，
+        只适用于没有占位符的模板。
+        :return: dict {收件人: 状态}，被服务器拒绝的收件人状态为 FAIL
+        """
+        self._last_error = None
+        start = perf_counter()
+        msg = self._build_message(list(receivers))
+        build_time = perf_counter() - start
+        try:
+            refused = self._session.send_message(msg, to_addrs=list(receivers))
+        except Exception as e:
+            self._last_error = e
+            print(f"Fail: {e}")
+            self._observe(receivers, build_time, ['FAIL'] * len(receivers))
+            return {re: 'FAIL' for re in receivers}
+
+        if refused:
+            # 部分收件人被拒绝，保留每个收件人的响应码，用于判断是否重试
+            self._last_error = smtplib.SMTPRecipientsRefused(refused)
+        for re, (code, resp) in refused.items():
+            print(f"Fail: {re} refused, {code} {resp}")
+        results = {re: 'FAIL' if re in refused else 'OK' for re in receivers}
+        self._observe(receivers, build_time, list(results.values()))
+        return results
+
+    def get_last_error(self):
+        return self._last_error
+
+    def get_last_code(self):
+        """ 上一次发送失败时的 SMTP 响应码 """
+        return get_reply_code(self._last_error)
+
+    def close(self):
+        self._session.close()
+
 
 class EmailSenderSimulator(EmailSender):
 
     # For testing.
 
-    def send(self, to):
+    def send(self, to, fields=None):
         try:
-            self._build_message(to)
+            self._build_message(to, fields)
             sleep(0.1) # simulate: login
             sleep(0.5) # simulate: send
             status = 'OK'
@@ -94,14 +144,40 @@ class EmailSenderSimulator(EmailSender):
             status = 'FAIL'
         return status
 
+    def send_many(self, receivers):
+        try:
+            self._build_message(list(receivers))
+            sleep(0.1) # simulate: login
+            sleep(0.5) # simulate: send
+            status = 'OK'
+        except Exception as e:
+            print("Fail to build message", e)
+            status = 'FAIL'
+        return {re: status for re in receivers}
+
 
 class BatchSender(object):
 
     _config = {
-        'gap_time': 10, # 两个任务之间的间隔时长，单位：秒
+        'gap_time': 10, # 同一个账号两个任务之间的最小间隔时长，单位：秒，发送耗时会被扣除
+        'rate_limit': {},  # RateLimiter 的参数，例如 {'domain': {'per_minute': 10, 'burst': 2}}
+        'limiter': None,  # 多个发送者共享的 RateLimiter，为空时根据 gap_time 和 rate_limit 创建
         'receivers': [],  # 用于测试，如果非空，则 self._receivers = receivers
         'simulate': False,  # 用于测试, True 模拟发送邮件
-        'proxy_filename': 'proxy.json'  # proxy.json 与 user_path 在同一个文件夹下
+        'proxy_filename': 'proxy.json',  # proxy.json 与 user_path 在同一个文件夹下
+        'proxy': {},  # ProxyPool 的参数，例如 {'max_error_rate': 0.3, 'cooldown': 600}
+        'proxy_check': True,  # True: 开始发送前通过每个代理连接 SMTP 服务器，检查代理是否可用
+        'session': {},  # SMTPSession 的参数，例如 {'max_messages': 50, 'idle_time': 30}
+        'result': {},  # ResultWriter 的参数，例如 {'flush_size': 10, 'fsync': True}
+        'writer': None,  # 多个发送者共享的 ResultWriter，为空时为 done_path 创建
+        'envelope_size': 0,  # 大于 1 时，把同一个域名的收件人合并到一次 SMTP 事务中，每次最多 envelope_size 个
+        'journal': False,  # True: 用 SendJournal 记录 job 文件的发送进度，中断后重新运行时从中断处继续
+        'retry': {},  # RetryQueue 的参数，例如 {'max_attempts': 5, 'base_delay': 30}，{'max_attempts': 1}: 不重试
+        'metrics': None,  # 多个发送者共享的 Metrics，为空时创建
+        'metrics_path': None,  # 不为空时，运行结束后把耗时统计导出到 `<metrics_path>.prom` 和 `<metrics_path>.json`
+        'store': None,  # 实现了 get_batch(batch_id) 的 JobStore 对象，与 batch_id 一起使用时代替 job 文件
+        'batch_id': None,  # 从 store 中读取的批次编号
+        'stop': None,  # threading.Event，被设置后不再开始新的发送单元，已开始的单元发送完后结束
     }
 
     def __init__(self, user_path, template_path,
@@ -112,56 +188,280 @@ class BatchSender(object):
         self._template_path = Path(template_path)
         self._receivers_path = Path(receivers_path) if receivers_path else None
         self._done_path = Path(done_path)
-        self._proxy_path = self._user_path.parent / self._config['proxy_filename']
 
+        self._config = dict(self._config)
         for k, v in kwargs.items():
             if k in self._config.keys():
                 self._config[k] = v
             else:
                 raise ValueError(f"Wrong input parameter `{k}`!")
 
+        self._proxy_path = self._user_path.parent / self._config['proxy_filename']
+
         self._receivers = []
+        self._fields = {}  # {收件人: job 文件中收件人所在的行}，用于填充模板中的占位符
+        self._count = 0  # 已处理的任务数量
+        self._limiter = self._config['limiter'] or self._create_limiter()
+        self._writer = None
+        self._journal = None
+        self._retry = RetryQueue(**self._config['retry'])
+        self._metrics = self._config['metrics'] or Metrics()
+        self._proxy_pool = None
+
+    def _create_limiter(self):
+        return RateLimiter.from_gap_time(self._config['gap_time'], **self._config['rate_limit'])
+
+    @staticmethod
+    def _get_domain(receiver):
+        return receiver.rsplit('@', 1)[-1].lower()
 
     def _load_receivers(self):
         if self._config['receivers']:
             self._receivers = self._config['receivers']
             return
+        if self._config['store'] is not None and self._config['batch_id'] is not None:
+            self._receivers = self._config['store'].get_batch(self._config['batch_id'])
+            return
         try:
             with open(self._receivers_path, mode='r', encoding='utf-8') as csvfile:
                 reader = csv.DictReader(csvfile)
                 for row in reader:
                     self._receivers.append(row['EMAIL'])
+                    if len(row) > 1:
+                        self._fields[row['EMAIL']] = row
         except Exception as e:
             print(f"Error reading job file {self._receivers_path}: {e}")
 
-    def _save_done(self, receiver, status):
-        header = ['EMAIL', 'TIME', 'STATUS']
-        if not Path(self._done_path).exists():
-            with open(self._done_path, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerows([header])
+    def _get_units(self):
+        """
+        把收件人分成发送单元，每个单元在一次 SMTP 事务中发送。
+        开启 envelope_size 且模板中没有占位符时，同一个域名的收件人合并成一个单元。
+        """
+        receivers = self._receivers
+        if self._journal:  # 跳过已完成的收件人
+            receivers = [re for re in receivers if re not in self._journal.done]
+        n = self._config['envelope_size']
+        if n <= 1 or load_template(self._template_path).personalized:
+            return [[re] for re in receivers]
+        groups = {}
+        for re in receivers:
+            groups.setdefault(self._get_domain(re), []).append(re)
+        return [res[i:i + n] for res in groups.values() for i in range(0, len(res), n)]
 
-        row = [receiver, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), status]
-        with open(self._done_path, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows([row])
+    def _send(self, sender, unit):
+        """
+        :return: dict {收件人: 状态}
+        """
+        if len(unit) == 1:
+            return {unit[0]: sender.send(unit[0], self._fields.get(unit[0]))}
+        return sender.send_many(unit)
 
-    def run(self):
+    def _open_writer(self):
+        self._writer = self._config['writer'] or \
+            ResultWriter(self._done_path, **self._config['result'])
+
+    def _close_writer(self):
+        # 共享的 ResultWriter 由创建者负责关闭
+        if self._writer is self._config['writer']:
+            self._writer.flush()
+        else:
+            self._writer.close()
+
+    def _save_done(self, receiver, status, attempts=1):
+        self._writer.write(receiver, status, attempts)
+
+    def _open_journal(self):
+        if not self._config['journal'] or not self._receivers_path:
+            return
+        self._journal = SendJournal(self._receivers_path)
+        self._count = len(self._journal.done)
+        if self._count or self._journal.in_flight:
+            logger.info(action="resuming job", job_done=self._count,
+                        reconcile=len(self._journal.in_flight))
+        # 崩溃时正在发送的收件人不确定是否已发送，不重发，记录为 RECONCILE
+        for re in sorted(self._journal.in_flight):
+            self._record(re, 'RECONCILE')
+
+    def _open_proxy_pool(self):
+        """ 所有会话共享一个代理池，并发的连接分散到不同的代理 """
+        self._proxy_pool = ProxyPool.load(self._proxy_path, **self._config['proxy'])
+        if self._proxy_pool is None or not self._config['proxy_check']:
+            return
+        user = User(self._user_path)
+        results = self._proxy_pool.check((user.server, user.port))
+        logger.info(action="proxy check", proxy_number=len(results),
+                    available=sum(results.values()))
+
+    def _open(self):
         self._load_receivers()
         logger.info(action="loading jobs", job_number=len(self._receivers))
-        sender = EmailSender(self._user_path,
-                             self._template_path,
-                             self._proxy_path)
+        self._open_writer()
+        self._open_journal()
+        self._open_proxy_pool()
+
+    def _export_metrics(self):
+        if not self._config['metrics_path']:
+            return
+        try:
+            prom_path, json_path = self._metrics.write(self._config['metrics_path'])
+            logger.info(action="metrics exported", prometheus=prom_path, summary=json_path)
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+    def _close(self):
+        self._close_writer()
+        if self._journal:
+            self._journal.close()
+        self._export_metrics()
+
+    def _begin(self, unit):
+        if self._journal:
+            self._journal.begin(unit)
+
+    def _create_sender(self):
+        sender_cls = EmailSender
         # 模拟发送邮件，用于测试
         if self._config['simulate']:
-            sender = EmailSenderSimulator(self._user_path,
-                             self._template_path,
-                             self._proxy_path)
-        i = 0
-        total = len(self._receivers)
-        for re in self._receivers:
-            status = sender.send(re)
-            i += 1
-            logger.info(receiver=re, status=status, process=f"{i}/{total}")
-            self._save_done(re, status)
-            sleep(self._config['gap_time'])
+            sender_cls = EmailSenderSimulator
+        return sender_cls(self._user_path,
+                          self._template_path,
+                          self._proxy_path,
+                          metrics=self._metrics,
+                          proxy_pool=self._proxy_pool,
+                          **self._config['session'])
+
+    def _record(self, receiver, status, attempts=1):
+        self._count += 1
+        logger.info(receiver=receiver, status=status, attempts=attempts,
+                    process=f"{self._count}/{len(self._receivers)}")
+        self._save_done(receiver, status, attempts)
+        if self._journal:
+            # 先把结果写入 jobs_done，再在 journal 中标记完成，崩溃后 journal 中完成的收件人一定在 jobs_done 中
+            self._writer.flush()
+            self._journal.end(receiver, status)
+
+    def _finish(self, sender, results, attempt):
+        """
+        记录发送结果，可以重试的失败（4xx 响应、连接失败）不记录，交给调用者放入重试队列；
+        DATA 之后连接断开的收件人可能已经收到邮件，不重试，记录为 RECONCILE。
+        :param attempt: 本次是第几次发送
+        :return: 需要重试的收件人列表
+        """
+        error = sender.get_last_error()
+        retry = []
+        for re, status in results.items():
+            kind = classify_error(error, re) if status != 'OK' else None
+            if kind == UNKNOWN:
+                self._record(re, 'RECONCILE', attempt)
+            elif kind is not None and self._retry.can_retry(kind, attempt):
+                retry.append(re)
+                if self._journal:
+                    self._journal.retry(re)
+            else:
+                self._record(re, status, attempt)
+        if retry:
+            logger.info(receivers=len(retry), status='RETRY', attempts=attempt,
+                        reason=classify_error(error, retry[0]))
+        return retry
+
+    def _is_stopped(self):
+        return self._config['stop'] is not None and self._config['stop'].is_set()
+
+    def _next_unit(self, units):
+        """
+        优先取出已到期的重试任务，其次是新的发送单元；只剩没有到期的重试任务时等待。
+        :return: (发送单元, 第几次发送)，全部发送完或者被停止时返回 None
+        """
+        while True:
+            if self._is_stopped():
+                return None
+            if ready := self._retry.pop_ready():
+                unit, attempt = ready
+                return unit, attempt + 1
+            if units:
+                return units.popleft(), 1
+            if not self._retry:
+                return None
+            if self._config['stop'] is not None:
+                self._config['stop'].wait(self._retry.next_delay())
+            else:
+                sleep(self._retry.next_delay())
+
+    def run(self):
+        self._open()
+        sender = self._create_sender()
+        try:
+            units = deque(self._get_units())
+            while (item := self._next_unit(units)) is not None:
+                unit, attempt = item
+                domain = self._get_domain(unit[0])
+                self._limiter.acquire(sender.account, domain, len(unit))
+                self._begin(unit)
+                results = self._send(sender, unit)
+                self._limiter.report(sender.account, domain, sender.get_last_code())
+                if retry := self._finish(sender, results, attempt):
+                    self._retry.push(retry, attempt)
+        finally:
+            sender.close()
+            self._close()
+
+
+class AsyncBatchSender(BatchSender):
+
+    """
+    基于 asyncio 的批量发送：同一个账号同时维持 concurrency 个 SMTP 会话并发发送。
+    smtplib 是阻塞的，因此每个会话的发送在线程池中执行，
+    日志和 jobs_done 的写入都在事件循环所在的线程中完成，结果与 BatchSender 相同。
+    需要重试的收件人由事件循环延时放回队列，等待期间其他会话继续发送。
+    """
+
+    _config = {
+        **BatchSender._config,
+        'concurrency': 4,  # 同一个账号（SMTP 服务器）的最大并发会话数量
+    }
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self._open()
+        queue = asyncio.Queue()  # (发送单元, 第几次发送)，None 表示全部发送完
+        for unit in self._get_units():
+            queue.put_nowait((unit, 1))
+        self._unfinished = queue.qsize()  # 还没有最终结果的发送单元数量，包括等待重试的
+        if not self._unfinished:
+            queue.put_nowait(None)
+
+        n = max(1, min(self._config['concurrency'], queue.qsize()))
+        senders = [self._create_sender() for _ in range(n)]
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            try:
+                await asyncio.gather(*[self._work(sender, queue, executor)
+                                       for sender in senders])
+            finally:
+                for sender in senders:
+                    sender.close()
+                self._close()
+
+    async def _work(self, sender, queue, executor):
+        loop = asyncio.get_running_loop()
+        try:
+            while (item := await queue.get()) is not None:
+                if self._is_stopped():
+                    break
+                unit, attempt = item
+                domain = self._get_domain(unit[0])
+                await asyncio.sleep(self._limiter.reserve(sender.account, domain, len(unit)))
+                self._begin(unit)
+                results = await loop.run_in_executor(executor, self._send, sender, unit)
+                self._limiter.report(sender.account, domain, sender.get_last_code())
+                if retry := self._finish(sender, results, attempt):
+                    loop.call_later(self._retry.get_delay(attempt),
+                                    queue.put_nowait, (retry, attempt + 1))
+                else:
+                    self._unfinished -= 1
+                    if self._unfinished == 0:
+                        queue.put_nowait(None)
+        finally:
+            # 通知下一个会话退出
+            queue.put_nowait(None)
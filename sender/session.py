@@ -0,0 +1,265 @@
+import copy
+import io
+import smtplib
+from email.generator import BytesGenerator
+from email.utils import getaddresses
+from time import monotonic, perf_counter
+
+
+def get_reply_code(error):
+    """
+    从 smtplib 的异常中取得 SMTP 响应码，没有响应码时返回 None。
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return None
+
+
+class SMTPDeliveryUnknown(smtplib.SMTPServerDisconnected):
+
+    """
+    DATA 已经发出之后连接断开或者超时，没有收到服务器的最终响应，邮件可能已经被接受，不能直接重发。
+    """
+
+
+class _ProxyMixin(object):
+
+    """
+    proxy_pool 不为空时，通过代理池中的一个代理建立连接，连接关闭时释放该代理。
+    data_sent 记录当前事务是否已经发出 DATA 命令，之后出错时服务器可能已经接受了邮件。
+    """
+
+    def __init__(self, *args, proxy_pool=None, **kwargs):
+        self._proxy_pool = proxy_pool
+        self.proxy = None
+        self.data_sent = False
+        super().__init__(*args, **kwargs)
+
+    def data(self, msg):
+        self.data_sent = True
+        return super().data(msg)
+
+    def _open_socket(self, host, port, timeout):
+        if self._proxy_pool is None:
+            return smtplib.SMTP._get_socket(self, host, port, timeout)
+        self.proxy, sock = self._proxy_pool.connect((host, port), timeout, self.source_address)
+        return sock
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self.proxy is not None:
+                self._proxy_pool.release(self.proxy)
+                self.proxy = None
+
+
+class _TimedSMTP(_ProxyMixin, smtplib.SMTP):
+
+    """ 记录建立连接（DNS 解析和 TCP 连接，使用代理时包括代理握手）的耗时 """
+
+    def _get_socket(self, host, port, timeout):
+        start = perf_counter()
+        sock = self._open_socket(host, port, timeout)
+        self.timings = {'connect': perf_counter() - start}
+        return sock
+
+
+class _TimedSMTP_SSL(_ProxyMixin, smtplib.SMTP_SSL):
+
+    """ 分别记录建立连接和 TLS 握手的耗时 """
+
+    def _get_socket(self, host, port, timeout):
+        start = perf_counter()
+        sock = self._open_socket(host, port, timeout)
+        connected = perf_counter()
+        try:
+            sock = self.context.wrap_socket(sock, server_hostname=self._host)
+        except Exception:
+            # 连接还没有交给 smtplib，需要在这里关闭并释放代理
+            sock.close()
+            self.close()
+            raise
+        self.timings = {'connect': connected - start, 'tls': perf_counter() - connected}
+        return sock
+
+
+def serialize_message(msg, to_addrs=None):
+    """
+    与 smtplib.SMTP.send_message 相同的方式序列化邮件（删除 Bcc，CRLF 换行）。
+    :return: (发件人, 收件人列表, bytes)，地址包含非 ASCII 字符（需要 SMTPUTF8）时返回 None
+    """
+    from_addr = getaddresses([msg['Sender'] or msg['From']])[0][1]
+    if to_addrs is None:
+        headers = msg.get_all('To', []) + msg.get_all('Cc', []) + msg.get_all('Bcc', [])
+        to_addrs = [addr for _, addr in getaddresses(headers)]
+    if not ''.join([from_addr, *to_addrs]).isascii():
+        return None
+    msg_copy = copy.copy(msg)
+    del msg_copy['Bcc']
+    del msg_copy['Resent-Bcc']
+    with io.BytesIO() as buffer:
+        BytesGenerator(buffer).flatten(msg_copy, linesep='\r\n')
+        return from_addr, to_addrs, buffer.getvalue()
+
+
+class SMTPSession(object):
+
+    """
+    保持一个已登录的 SMTP 连接，在多次发送之间复用，避免每封邮件都重新握手和登录。
+    1、连接空闲超过 check_time 后，复用前先发送 NOOP 检查连接是否可用；
+    2、发送失败时发送 RSET 重置会话，保证连接可以继续使用；
+    3、发出 DATA 之前连接被服务器断开（SMTPServerDisconnected 或 421，例如复用的连接已失效、
+       MAIL/RCPT 时断开）时自动重连并重发一次；DATA 之后断开或超时时服务器可能已经接受了邮件，
+       不自动重发，抛出 SMTPDeliveryUnknown，由调用者记录为需要核对；
+    4、发送数量达到 max_messages 或空闲超过 idle_time 后重建连接；
+    5、proxy_pool 不为空时，每次建立连接都从代理池中选择一个代理。
+    每次 send_message 之后，timings 中是各阶段的耗时（秒）：connect, tls, login（仅在建立连接时），
+    serialize, data。
+    """
+
+    _config = {
+        'max_messages': 100,  # 单个连接发送的邮件数量上限，达到后重建连接
+        'idle_time': 60,  # 连接空闲时长上限（秒），超过后重建连接
+        'check_time': 10,  # 空闲超过该时长（秒）时，复用前先用 NOOP 检查连接
+        'timeout': 30,  # socket 超时时长（秒）
+    }
+
+    def __init__(self, user, proxy_pool=None, **kwargs):
+        """
+        :param user: User 对象
+        :param proxy_pool: ProxyPool 对象，为空时直接连接
+        """
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._user = user
+        self._smtp = _TimedSMTP_SSL if user.ssl else _TimedSMTP
+        self._proxy_pool = proxy_pool
+        self._server = None
+        self._sent = 0  # 当前连接已发送的邮件数量
+        self._last_used = 0.
+        self.timings = {}  # 上一次 send_message 各阶段的耗时
+
+    def _connect(self):
+        server = self._smtp(self._user.server, self._user.port,
+                            timeout=self._config['timeout'],
+                            proxy_pool=self._proxy_pool)
+        self.timings.update(getattr(server, 'timings', {}))
+        start = perf_counter()
+        try:
+            server.login(self._user.email, self._user.password)
+        except Exception:
+            self._quit(server)
+            raise
+        self.timings['login'] = perf_counter() - start
+        self._server = server
+        self._sent = 0
+        self._last_used = monotonic()
+
+    @staticmethod
+    def _quit(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _is_expired(self):
+        if self._sent >= self._config['max_messages']:
+            return True
+        return monotonic() - self._last_used > self._config['idle_time']
+
+    def _is_alive(self):
+        if monotonic() - self._last_used < self._config['check_time']:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _reset(self):
+        # 发送失败后重置会话，如果 RSET 也失败，说明连接已不可用
+        try:
+            self._server.rset()
+        except (smtplib.SMTPException, OSError):
+            self._drop()
+
+    def _drop(self):
+        if self._server is not None:
+            self._server.close()
+        self._server = None
+
+    def open(self):
+        """ 返回可用的已登录连接，必要时重建连接 """
+        if self._server is not None:
+            if self._is_expired() or not self._is_alive():
+                self.close()
+        if self._server is None:
+            self._connect()
+        return self._server
+
+    def _sendmail(self, server, msg, serialized, to_addrs):
+        start = perf_counter()
+        server.data_sent = False
+        try:
+            if serialized is None:
+                return server.send_message(msg, to_addrs=to_addrs)
+            return server.sendmail(*serialized)
+        finally:
+            self.timings['data'] = perf_counter() - start
+
+    def send_message(self, msg, to_addrs=None):
+        """
+        :param to_addrs: 收件人列表，为空时使用邮件头中的收件人
+        :return: dict, 被拒绝的收件人 {收件人: (响应码, 响应)}
+        """
+        self.timings = {}
+        start = perf_counter()
+        serialized = serialize_message(msg, to_addrs)
+        self.timings['serialize'] = perf_counter() - start
+        for attempt in range(2):
+            server = self.open()
+            try:
+                refused = self._sendmail(server, msg, serialized, to_addrs)
+                break
+            except smtplib.SMTPServerDisconnected as e:
+                self._drop()
+                if server.data_sent:
+                    raise SMTPDeliveryUnknown(str(e)) from e
+                if attempt > 0:
+                    raise
+            except smtplib.SMTPResponseException as e:
+                # 421: 服务器即将关闭连接，与断开连接的处理相同；DATA 之后的响应码说明邮件没有被接受
+                if e.smtp_code != 421:
+                    self._reset()
+                    raise
+                self._drop()
+                if attempt > 0 or server.data_sent:
+                    raise
+            except (smtplib.SMTPException, OSError) as e:
+                if server.data_sent:
+                    # DATA 之后超时或者连接被重置，没有收到最终响应
+                    self._drop()
+                    raise SMTPDeliveryUnknown(str(e)) from e
+                self._reset()
+                raise
+        self._sent += 1
+        self._last_used = monotonic()
+        return refused
+
+    def close(self):
+        if self._server is not None:
+            self._quit(self._server)
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,238 @@
+import random
+import socket
+import socketserver
+import struct
+from threading import Lock, Thread
+from time import sleep
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+
+    """ 一个 SMTP 连接，实现 EHLO/HELO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT """
+
+    def _reply(self, line):
+        sink = self.server.sink
+        if sink.config['latency']:
+            sleep(sink.config['latency'])
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def _read_data(self):
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b'.\r\n':
+                return line
+
+    def handle(self):
+        sink = self.server.sink
+        sink.count('connections')
+        messages = 0
+        recipients = 0
+        self._reply('220 sink ESMTP')
+        while line := self.rfile.readline():
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self._reply('250-sink')
+                self._reply('250-AUTH PLAIN')
+                self._reply('250 8BITMIME')
+            elif verb in ('HELO', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'AUTH':
+                self._reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                if sink.config['max_messages'] and messages >= sink.config['max_messages']:
+                    self._reply('421 Too many messages, closing connection')
+                    return
+                recipients = 0
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                if sink.random() < sink.config['fail_rate']:
+                    code = sink.choice(sink.config['fail_codes'])
+                    self._reply(f'{code} Recipient rejected')
+                else:
+                    recipients += 1
+                    self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                if not self._read_data():
+                    return
+                sink.count('data')
+                if sink.random() < sink.config['disconnect_rate']:
+                    return  # 模拟服务器在 DATA 之后断开连接
+                messages += 1
+                sink.count('messages')
+                sink.count('recipients', recipients)
+                self._reply('250 OK: queued')
+            elif verb == 'RSET':
+                recipients = 0
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class _SinkServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink(object):
+
+    """
+    进程内的 SMTP 接收服务器，用于离线测试和压测，收到的邮件只计数，不保存。
+    不支持 TLS，用户配置中的 ssl 需要设置为 false。
+    可以配置响应延迟、RCPT 错误注入、DATA 之后断开连接、以及每个连接的邮件数量上限。
+    """
+
+    _config = {
+        'host': '127.0.0.1',
+        'port': 0,  # 0: 随机选择一个空闲端口
+        'latency': 0.,  # 每个响应之前的延迟（秒）
+        'fail_rate': 0.,  # RCPT 返回错误的概率
+        'fail_codes': [450, 451, 550],  # RCPT 返回的错误码
+        'disconnect_rate': 0.,  # DATA 之后不回复、直接断开连接的概率
+        'max_messages': 0,  # 每个连接最多接收的邮件数量，超过后返回 421 并断开，0: 不限制
+        'seed': None,  # 随机数种子
+    }
+
+    _handler = _SinkHandler
+
+    def __init__(self, **kwargs):
+        self.config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self.config.keys():
+                self.config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._random = random.Random(self.config['seed'])
+        self._stats = {'connections': 0, 'data': 0, 'messages': 0, 'recipients': 0}
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def choice(self, items):
+        with self._lock:
+            return self._random.choice(items)
+
+    def count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self):
+        """ 在后台线程中启动服务器 """
+        self._server = _SinkServer((self.config['host'], self.config['port']), self._handler)
+        self._server.sink = self
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _SocksHandler(socketserver.BaseRequestHandler):
+
+    """ 一个 SOCKS5 连接：只支持无认证的 CONNECT，建立连接后双向转发 """
+
+    def _read(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('client closed')
+            data += chunk
+        return data
+
+    def _read_address(self, atyp):
+        if atyp == 1:
+            host = socket.inet_ntoa(self._read(4))
+        elif atyp == 3:
+            host = self._read(self._read(1)[0]).decode('ascii')
+        else:
+            host = socket.inet_ntop(socket.AF_INET6, self._read(16))
+        port = struct.unpack('!H', self._read(2))[0]
+        return host, port
+
+    @staticmethod
+    def _pipe(src, dst):
+        try:
+            while data := src.recv(65536):
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    def handle(self):
+        proxy = self.server.sink
+        try:
+            version, n = self._read(2)
+            self._read(n)
+            self.request.sendall(b'\x05\x00')  # 无认证
+            version, cmd, _, atyp = self._read(4)
+            address = self._read_address(atyp)
+            if proxy.config['latency']:
+                sleep(proxy.config['latency'])
+            if proxy.config['reject'] or cmd != 1:
+                self.request.sendall(b'\x05\x01\x00\x01' + bytes(6))
+                return
+            upstream = socket.create_connection(address)
+        except OSError:
+            return
+        proxy.count('connections')
+        with upstream:
+            self.request.sendall(b'\x05\x00\x00\x01' + bytes(6))
+            t = Thread(target=self._pipe, args=(upstream, self.request), daemon=True)
+            t.start()
+            self._pipe(self.request, upstream)
+            t.join()
+
+
+class SocksSink(SMTPSink):
+
+    """
+    进程内的 SOCKS5 代理，用于测试代理池：把连接转发到目标地址，并统计成功转发的连接数量。
+    latency 是每个连接在 CONNECT 之前的延迟（秒），reject 为 True 时拒绝所有连接。
+    """
+
+    _config = {
+        'host': '127.0.0.1',
+        'port': 0,  # 0: 随机选择一个空闲端口
+        'latency': 0.,  # CONNECT 之前的延迟（秒）
+        'reject': False,  # True: 所有 CONNECT 请求都返回失败
+        'seed': None,
+    }
+
+    _handler = _SocksHandler
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = {'connections': 0}
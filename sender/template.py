@@ -0,0 +1,154 @@
+from pathlib import Path
+from email.mime.text import MIMEText
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+import re
+
+from .attachment import attachment_cache
+
+
+_SECTION_PATTERN = re.compile(r'\[(.*?)\]\s*(.*?)\s*(?=\[\w+\]|$)', re.DOTALL)
+_FIELD_PATTERN = re.compile(r'\{([A-Z][A-Z0-9_]*)\}')
+
+
+def parse_template(text):
+    """
+    给定文本text，其中的章节用`[]`扩起来，返回章节对应的文本内容。
+    例如:
+    [SUBJECT]
+    Hello!
+
+    [CONTENT]
+    World!
+
+    [ATTACHMENT]
+    data/attachment_example.txt
+
+    返回
+    {
+        'SUBJECT': 'Hello!,
+        'CONTENT': 'World!'
+        'ATTACHMENT': ['data/attachment_example.txt']
+    }
+    注意：需要去掉内容中第一行和最后一行的空格和换行符。
+    """
+    matches = _SECTION_PATTERN.findall(text)
+    result = {}
+
+    for title, content in matches:
+        # 去掉内容的首尾空格和换行符
+        result[title.strip()] = content.strip()
+
+    if attachment := result.get('ATTACHMENT'):
+        result['ATTACHMENT'] = attachment.split('\n')
+    else:
+        result['ATTACHMENT'] = None
+
+    return result
+
+
+class CompiledText(object):
+
+    """
+    编译后的文本：把占位符（例如 `{NAME}`）切分出来，保存为文本片段和字段交替的列表，
+    渲染时只需要填入字段的值并拼接，不需要再做正则匹配。
+    """
+
+    __slots__ = ['segments', 'fields']
+
+    def __init__(self, text):
+        # segments = [文本, 字段, 文本, 字段, ..., 文本]
+        self.segments = _FIELD_PATTERN.split(text)
+        self.fields = self.segments[1::2]
+
+    def render(self, values):
+        """
+        :param values: dict {字段: 值}，缺少的字段替换为空字符串
+        """
+        if not self.fields:
+            return self.segments[0]
+        parts = list(self.segments)
+        parts[1::2] = [values.get(field) or '' for field in self.fields]
+        return ''.join(parts)
+
+
+def _render_chunk(args):
+    subject, content, rows = args
+    return [(subject.render(row), content.render(row)) for row in rows]
+
+
+class Template(object):
+
+    """
+    编译后的邮件模板：只解析一次，并预先构造好正文的 MIME 部分，附件由 attachment_cache 共享。
+    这些 MIME 部分是只读的，可以被同一批次中所有的 Message 共享。
+    """
+
+    def __init__(self, path, text):
+        self.path = Path(path)
+        res = parse_template(text)
+        self.subject = res.get('SUBJECT', '')
+        self.content = res.get('CONTENT', '')
+        self.attachment = res.get('ATTACHMENT')
+        self.content_part = MIMEText(self.content, 'plain', 'utf-8')
+        self.compiled_subject = CompiledText(self.subject)
+        self.compiled_content = CompiledText(self.content)
+
+    @property
+    def personalized(self):
+        """ 主题或正文中是否有占位符，例如 `{NAME}` """
+        return bool(self.compiled_subject.fields or self.compiled_content.fields)
+
+    def render(self, values):
+        """
+        :param values: dict {字段: 值}，例如 job 文件中的一行
+        :return: (主题, 正文)
+        """
+        return self.compiled_subject.render(values), self.compiled_content.render(values)
+
+    def render_bulk(self, rows, processes=None, chunksize=10000):
+        """
+        批量渲染，processes 大于 1 时使用进程池。
+        :param rows: list of dict
+        :return: [(主题, 正文), ...]，与 rows 的顺序相同
+        """
+        chunks = [(self.compiled_subject, self.compiled_content, rows[i:i + chunksize])
+                  for i in range(0, len(rows), chunksize)]
+        if not processes or processes <= 1 or len(chunks) <= 1:
+            results = map(_render_chunk, chunks)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(_render_chunk, chunks))
+        return [item for chunk in results for item in chunk]
+
+    @property
+    def attachment_parts(self):
+        """ 附件的 MIME 部分，由 attachment_cache 编码和缓存 """
+        if not self.attachment:
+            return []
+        return [attachment_cache.get(self.path.parent / filename, filename)
+                for filename in self.attachment]
+
+
+_cache = {}  # {path: (mtime_ns, Template)}
+_cache_lock = Lock()
+
+
+def load_template(path):
+    """
+    读取并编译模板，结果按路径缓存。模板文件被修改（mtime 变化）后重新编译。
+    :param path: 模板文件路径
+    :return: Template
+    """
+    path = Path(path)
+    mtime = path.stat().st_mtime_ns
+    key = str(path.absolute())
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, 'r', encoding='utf-8') as file:
+        template = Template(path, file.read())
+    with _cache_lock:
+        _cache[key] = (mtime, template)
+    return template
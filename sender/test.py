@@ -1,12 +1,53 @@
+import csv
+import io
+import json
+import os
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stderr
 from pathlib import Path
+from threading import Thread, Timer
+from time import time
+
+import socks
 
 from .message import Message
+from .template import load_template, Template
+from .attachment import AttachmentCache
+from .limiter import RateLimiter
+from .result import ResultWriter
+from .pool import AccountPool
+from .sink import SMTPSink, SocksSink
+from .session import SMTPDeliveryUnknown
+from .proxy import ProxyPool
+from .journal import SendJournal
+from .metrics import Metrics
+from .log import _Logger
+from .retry import classify_error, TRANSIENT, PERMANENT, AUTH, CONNECTION, UNKNOWN
 from .user import User
-from .sender import EmailSender, BatchSender
+from .sender import EmailSender, BatchSender, AsyncBatchSender
+from .worker import JobLease, JobWorker
+
+
+__all__ = ['TestUser', 'TestLogger', 'TestMessage', 'TestTemplate', 'TestAttachmentCache',
+           'TestRateLimiter', 'TestResultWriter', 'TestEmailSender',
+           'TestBatchSender', 'TestBatchSenderBySimulator',
+           'TestAsyncBatchSenderBySimulator', 'TestAccountPoolBySimulator',
+           'TestEnvelopeBySimulator', 'TestEmailSenderBySink',
+           'TestSendJournalBySimulator', 'TestRetryBySink',
+           'TestMetricsBySink', 'TestJobWorkerBySimulator', 'TestLazyImport',
+           'TestProxyPoolBySink']
 
 
-__all__ = ['TestUser', 'TestMessage', 'TestEmailSender',
-           'TestBatchSender', 'TestBatchSenderBySimulator']
+def _write_sink_user(path, sink, email='user@server.com'):
+    """ 写入连接 SMTPSink 的用户配置文件，返回它的路径 """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'email': email, 'name': 'Lucy', 'password': '123456',
+                   'server': '127.0.0.1', 'port': sink.port, 'ssl': False}, f)
+    return path
 
 
 class TestUser(object):
@@ -57,6 +98,32 @@ class TestUser(object):
         print(f">> [{self.__class__.__name__}] OK.")
 
 
+class TestLogger(object):
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log = _Logger()
+            log.configure(file_dir=tmp_dir, logger_name='test_sender', max_bytes=2000,
+                          backup_count=20, console_sample=0)
+            for i in range(100):
+                log.info(receiver=f"user{i}@example.com", status='OK', process=f"{i + 1}/100")
+            log.close()
+            files = sorted(Path(tmp_dir).iterdir())
+            entries = []
+            for path in files:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entries += [json.loads(line) for line in f]
+        # 按大小轮转，所有日志都应该写入文件
+        assert len(files) > 1, AssertionError(f"Rotation: got {len(files)} file(s)")
+        receivers = sorted(entry['receiver'] for entry in entries)
+        expected = sorted(f"user{i}@example.com" for i in range(100))
+        assert receivers == expected, AssertionError(f"Entries: got = {len(entries)}, expected = 100")
+        assert entries[0]['level'] == 'INFO' and entries[0]['status'] == 'OK', AssertionError(
+            f"Bad entry: {entries[0]}"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
 class TestMessage(object):
 
     """
@@ -108,6 +175,130 @@ class TestMessage(object):
         print(f">> [{self.__class__.__name__}] OK.")
 
 
+class TestTemplate(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self._template_path = data_dir / 'template_example.txt'
+
+    @staticmethod
+    def _test_render():
+        template = Template('', "[SUBJECT]\nHi {NAME}\n[CONTENT]\nDear {NAME} from {COMPANY},\n{x}")
+        got = template.render({'NAME': 'Bob', 'COMPANY': 'ACME'})
+        expected = ('Hi Bob', 'Dear Bob from ACME,\n{x}')
+        assert got == expected, AssertionError(f"Render: got = {got}, expected = {expected}")
+
+        rows = [{'NAME': f"user{i}"} for i in range(10)]
+        got = template.render_bulk(rows, processes=2, chunksize=3)
+        expected = [template.render(row) for row in rows]
+        assert got == expected, AssertionError(f"Bulk render: got = {got}, expected = {expected}")
+
+    def test(self):
+        self._test_render()
+        template = load_template(self._template_path)
+        assert template is load_template(self._template_path), AssertionError(
+            "Template is not cached!"
+        )
+        expected = ['attachment_example.txt']
+        assert template.attachment == expected, AssertionError(
+            f"Attachment: got = {template.attachment}, expected = {expected}"
+        )
+        payload = template.attachment_parts[0].get_payload(decode=True).decode()
+        expected = 'This is an attachment example.'
+        assert payload == expected, AssertionError(
+            f"Attachment payload: got = {payload}, expected = {expected}"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestAttachmentCache(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self._paths = [data_dir / 'attachment_example.txt',
+                       data_dir / 'proxy_example.json']
+
+    def test(self):
+        # mmap_size = 0: 所有文件都用 mmap 读取
+        cache = AttachmentCache(max_bytes=80, mmap_size=0)
+        part = cache.get(self._paths[0], 'a.txt')
+        assert part is cache.get(self._paths[0], 'a.txt'), AssertionError(
+            "Attachment is not cached!"
+        )
+        payload = part.get_payload(decode=True).decode()
+        expected = 'This is an attachment example.'
+        assert payload == expected, AssertionError(
+            f"Attachment payload: got = {payload}, expected = {expected}"
+        )
+        # 同一个文件使用不同的附件名称
+        named = AttachmentCache(mmap_size=0)
+        filenames = [named.get(self._paths[0], name).get_filename() for name in ('a.txt', 'c.txt')]
+        assert filenames == ['a.txt', 'c.txt'], AssertionError(
+            f"Attachment filename: got = {filenames}, expected = ['a.txt', 'c.txt']"
+        )
+        # 空文件不使用 mmap
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            empty_path = Path(tmp_dir) / 'empty.txt'
+            empty_path.touch()
+            payload = named.get(empty_path, 'empty.txt').get_payload(decode=True)
+        assert payload == b'', AssertionError(f"Empty attachment payload: got = {payload}")
+        # 超过 max_bytes，淘汰最久未使用的附件
+        cache.get(self._paths[1], 'b.txt')
+        assert part is not cache.get(self._paths[0], 'a.txt'), AssertionError(
+            "Attachment is not evicted!"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestRateLimiter(object):
+
+    def test(self):
+        limiter = RateLimiter(account={'per_minute': 60, 'burst': 2}, backoff=30)
+        waits = [round(limiter.reserve('a@server.com', 'example.com')) for _ in range(4)]
+        expected = [0, 0, 1, 2]
+        assert waits == expected, AssertionError(
+            f"Waits: got = {waits}, expected = {expected}"
+        )
+        # 450: 只暂停该收件域名，不影响其他域名
+        limiter.report('b@server.com', 'example.com', 450)
+        wait = round(limiter.reserve('b@server.com', 'example.com'))
+        assert wait == 30, AssertionError(f"Backoff: got = {wait}, expected = 30")
+        wait = round(limiter.reserve('b@server.com', 'example1.com'))
+        assert wait == 0, AssertionError(f"Other domain: got = {wait}, expected = 0")
+        # 合并发送时每个收件人消耗一个令牌：3 个 RCPT 超出 burst 2 个令牌，下一个收件人再多等 1 秒
+        limiter = RateLimiter(domain={'per_minute': 60, 'burst': 1})
+        waits = [round(limiter.reserve('a@server.com', 'example.com', n)) for n in (3, 1)]
+        assert waits == [2, 3], AssertionError(f"Envelope waits: got = {waits}, expected = [2, 3]")
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestResultWriter(object):
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'result_test.csv'
+            writers = [ResultWriter(path, flush_size=3) for _ in range(2)]
+            threads = [Thread(target=lambda w=w, i=i: [w.write(f"user{i}_{j}@example.com", 'OK')
+                                                       for j in range(10)])
+                       for i, w in enumerate(writers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for w in writers:
+                w.close()
+
+            with open(path, 'r', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+        assert rows[0] == ResultWriter.header, AssertionError(
+            f"Header: got = {rows[0]}, expected = {ResultWriter.header}"
+        )
+        assert len(rows) == 21, AssertionError(f"Rows: got = {len(rows)}, expected = 21")
+        for row in rows[1:]:
+            assert len(row) == len(ResultWriter.header) and row[2] == 'OK', AssertionError(f"Bad row: {row}")
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
 class TestEmailSender(object):
 
     def __init__(self, user_path, template_path, to):
@@ -124,24 +315,385 @@ class TestEmailSender(object):
             print(f">> [{self.__class__.__name__}] OK.")
 
 
+class TestEmailSenderBySink(object):
+
+    def __init__(self, data_dir):
+        self._template_path = Path(data_dir) / 'template_example.txt'
+
+    def test(self):
+        # 每个连接最多接收 2 封邮件，之后返回 421，EmailSender 需要自动重连
+        with SMTPSink(max_messages=2) as sink, tempfile.TemporaryDirectory() as tmp_dir:
+            user_path = _write_sink_user(Path(tmp_dir) / 'user.json', sink)
+            sender = EmailSender(user_path, self._template_path)
+            statuses = [sender.send(f"user{i}@example.com") for i in range(5)]
+            sender.close()
+            stats = sink.get_stats()
+        assert statuses == ['OK'] * 5, AssertionError(f"Status: got = {statuses}")
+        expected = {'connections': 3, 'data': 5, 'messages': 5, 'recipients': 5}
+        assert stats == expected, AssertionError(
+            f"Sink stats: got = {stats}, expected = {expected}"
+        )
+        self._test_disconnect_after_data()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+    def _test_disconnect_after_data(self):
+        # DATA 之后断开连接时服务器可能已经接受了邮件，不能自动重连重发
+        with SMTPSink(disconnect_rate=1.) as sink, tempfile.TemporaryDirectory() as tmp_dir:
+            user_path = _write_sink_user(Path(tmp_dir) / 'user.json', sink)
+            sender = EmailSender(user_path, self._template_path)
+            status = sender.send('user@example.com')
+            error = sender.get_last_error()
+            sender.close()
+            stats = sink.get_stats()
+        assert status == 'FAIL' and isinstance(error, SMTPDeliveryUnknown), AssertionError(
+            f"Disconnect after DATA: status = {status}, error = {error!r}"
+        )
+        assert stats.get('connections') == 1, AssertionError(f"Resent after DATA: {stats}")
+
+
 class TestBatchSenderBySimulator(object):
 
-    def __init__(self, data_dir, done_dir, batch_size=10):
-        data_dir, done_dir = Path(data_dir), Path(done_dir)
-        user_path = data_dir / 'user_example.json'
-        template_path = data_dir / 'template_example.txt'
-        done_path = done_dir / 'jobs_done.csv'
-        receivers = [f"user{i}@example.com" for i in range(batch_size)]
-        self._bs = BatchSender(user_path=user_path,
-                               template_path=template_path,
-                               receivers_path=None,
-                               done_path=done_path,
-                               simulate=True,
-                               receivers=receivers,
-                               gap_time=0)
+    def __init__(self, data_dir, batch_size=10):
+        data_dir = Path(data_dir)
+        self._user_path = data_dir / 'user_example.json'
+        self._template_path = data_dir / 'template_example.txt'
+        self._receivers = [f"user{i}@example.com" for i in range(batch_size)]
 
     def test(self):
-        self._bs.run()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            BatchSender(user_path=self._user_path,
+                        template_path=self._template_path,
+                        receivers_path=None,
+                        done_path=Path(tmp_dir) / 'jobs_done.csv',
+                        simulate=True,
+                        receivers=self._receivers,
+                        gap_time=0).run()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestAsyncBatchSenderBySimulator(object):
+
+    def __init__(self, data_dir, batch_size=10):
+        data_dir = Path(data_dir)
+        self._user_path = data_dir / 'user_example.json'
+        self._template_path = data_dir / 'template_example.txt'
+        self._receivers = [f"user{i}@example.com" for i in range(batch_size)]
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            done_path = Path(tmp_dir) / 'jobs_done.csv'
+            AsyncBatchSender(user_path=self._user_path,
+                             template_path=self._template_path,
+                             receivers_path=None,
+                             done_path=done_path,
+                             simulate=True,
+                             receivers=self._receivers,
+                             gap_time=0,
+                             concurrency=5).run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                got = sorted(row['EMAIL'] for row in csv.DictReader(f))
+        expected = sorted(self._receivers)
+        assert got == expected, AssertionError(
+            f"Rows saved: got = {got}, expected = {expected}"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestEnvelopeBySimulator(object):
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        self._user_path = data_dir / 'user_example.json'
+        self._template_path = data_dir / 'template_example.txt'
+        self._receivers = [f"user{i}@example1.com" for i in range(5)] + \
+                          [f"user{i}@example2.com" for i in range(2)]
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bs = BatchSender(user_path=self._user_path,
+                             template_path=self._template_path,
+                             receivers_path=None,
+                             done_path=Path(tmp_dir) / 'jobs_done.csv',
+                             simulate=True,
+                             receivers=self._receivers,
+                             gap_time=0,
+                             envelope_size=3)
+            self._test_envelope(bs)
+        print(f">> [{self.__class__.__name__}] OK.")
+
+    @staticmethod
+    def _test_envelope(bs):
+        bs._load_receivers()
+        sizes = [len(unit) for unit in bs._get_units()]
+        assert sizes == [3, 2, 2], AssertionError(
+            f"Envelope sizes: got = {sizes}, expected = [3, 2, 2]"
+        )
+        message = Message(sender='sender@example.com',
+                          receiver=['user0@example1.com', 'user1@example1.com'],
+                          template_path=bs._template_path).build()
+        assert message['To'] == 'undisclosed-recipients:;', AssertionError(
+            f"Receiver: got = {message['To']}, expected = undisclosed-recipients:;"
+        )
+        bs.run()
+
+
+class TestSendJournalBySimulator(object):
+
+    def __init__(self, data_dir):
+        self._data_dir = Path(data_dir)
+        self._receivers = [f"user{i}@example.com" for i in range(5)]
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            job_path = tmp_dir / 'jobs_batch_0.csv'
+            done_path = tmp_dir / 'jobs_done.csv'
+            with open(job_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+                f.writelines(f"{re}\n" for re in self._receivers)
+            # 模拟崩溃：user0 已完成，user1 正在发送，user2 等待重试
+            journal = SendJournal(job_path)
+            journal.begin(self._receivers[:1])
+            journal.end(self._receivers[0], 'OK')
+            journal.begin(self._receivers[1:3])
+            journal.retry(self._receivers[2])
+            journal.close()
+            loaded = SendJournal(job_path)
+            loaded.close()
+            assert loaded.in_flight == {self._receivers[1]} and list(loaded.done) == self._receivers[:1], \
+                AssertionError(f"Journal: done = {loaded.done}, in flight = {loaded.in_flight}")
+
+            BatchSender(user_path=self._data_dir / 'user_example.json',
+                        template_path=self._data_dir / 'template_example.txt',
+                        receivers_path=job_path,
+                        done_path=done_path,
+                        simulate=True,
+                        gap_time=0,
+                        journal=True).run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                got = sorted((row['EMAIL'], row['STATUS']) for row in csv.DictReader(f))
+            resumed = SendJournal(job_path)
+            resumed.close()
+
+        expected = [(self._receivers[1], 'RECONCILE')] + \
+                   [(re, 'OK') for re in self._receivers[2:]]
+        assert got == expected, AssertionError(f"Jobs done: got = {got}, expected = {expected}")
+        assert len(resumed.done) == 5 and not resumed.in_flight, AssertionError(
+            f"Journal: done = {resumed.done}, in flight = {resumed.in_flight}"
+        )
+        self._test_crash()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+    @staticmethod
+    def _read_done(done_path):
+        if not done_path.exists():
+            return {}
+        with open(done_path, 'r', encoding='utf-8') as f:
+            return {row['EMAIL']: row['STATUS'] for row in csv.DictReader(f)}
+
+    def _test_crash(self):
+        # 子进程发送到一半时直接退出（不 flush 缓冲），journal 中完成的收件人必须已经写入 jobs_done
+        root = Path(__file__).resolve().parents[1]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            job_path = tmp_dir / 'jobs_batch_0.csv'
+            done_path = tmp_dir / 'jobs_done.csv'
+            with open(job_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+                f.writelines(f"{re}\n" for re in self._receivers)
+            kwargs = dict(user_path=str(self._data_dir.resolve() / 'user_example.json'),
+                          template_path=str(self._data_dir.resolve() / 'template_example.txt'),
+                          receivers_path=str(job_path), done_path=str(done_path))
+            code = (f"import os, threading\n"
+                    f"from sender.log import logger\n"
+                    f"from sender import BatchSender\n"
+                    f"logger.configure(file_dir={str(tmp_dir)!r}, console_sample=0)\n"
+                    f"threading.Timer(1.5, os._exit, args=(1,)).start()\n"
+                    f"BatchSender(**{kwargs!r}, simulate=True, gap_time=0, journal=True,\n"
+                    f"            result={{'flush_size': 100, 'flush_time': 3600}}).run()\n")
+            subprocess.run([sys.executable, '-c', code], cwd=root, check=False)
+            crashed = SendJournal(job_path)
+            crashed.close()
+            done = self._read_done(done_path)
+            missing = [re for re in crashed.done if re not in done]
+            assert crashed.done and not missing, AssertionError(
+                f"Crash: journal done = {list(crashed.done)}, missing in jobs_done = {missing}"
+            )
+
+            BatchSender(**kwargs, simulate=True, gap_time=0, journal=True).run()
+            done = self._read_done(done_path)
+        assert sorted(done) == self._receivers, AssertionError(f"Resume: jobs done = {done}")
+
+
+class TestRetryBySink(object):
+
+    def __init__(self, data_dir):
+        self._template_path = Path(data_dir) / 'template_example.txt'
+
+    @staticmethod
+    def _test_classify():
+        cases = [
+            (smtplib.SMTPResponseException(421, b'busy'), TRANSIENT),
+            (smtplib.SMTPRecipientsRefused({'a@x.com': (450, b'later')}), TRANSIENT),
+            (smtplib.SMTPRecipientsRefused({'a@x.com': (550, b'no user')}), PERMANENT),
+            (smtplib.SMTPAuthenticationError(535, b'bad password'), AUTH),
+            (smtplib.SMTPServerDisconnected('closed'), CONNECTION),
+            (SMTPDeliveryUnknown('closed'), UNKNOWN),
+            (ConnectionRefusedError(), CONNECTION),
+            (ValueError('Invalid email'), PERMANENT),
+        ]
+        for error, expected in cases:
+            kind = classify_error(error, 'a@x.com')
+            assert kind == expected, AssertionError(
+                f"Classify {error!r}: got = {kind}, expected = {expected}"
+            )
+
+    def test(self):
+        self._test_classify()
+        receivers = [f"user{i}@example{i % 3}.com" for i in range(20)]
+        # 30% 的 RCPT 返回 450，所有收件人最终都应该发送成功，并且记录发送次数
+        for sender_cls in (BatchSender, AsyncBatchSender):
+            with SMTPSink(fail_rate=0.3, fail_codes=[450], seed=1) as sink, \
+                    tempfile.TemporaryDirectory() as tmp_dir:
+                user_path = _write_sink_user(Path(tmp_dir) / 'user.json', sink)
+                done_path = Path(tmp_dir) / 'jobs_done.csv'
+                sender_cls(user_path, self._template_path, None, done_path,
+                           receivers=receivers, gap_time=0,
+                           rate_limit={'backoff': 0.01, 'max_backoff': 0.01},
+                           retry={'max_attempts': 20, 'base_delay': 0.01, 'jitter': 0}).run()
+                with open(done_path, 'r', encoding='utf-8') as f:
+                    rows = list(csv.DictReader(f))
+            statuses = {row['EMAIL']: row['STATUS'] for row in rows}
+            attempts = [int(row['ATTEMPTS']) for row in rows]
+            assert len(rows) == len(receivers) and set(statuses.values()) == {'OK'}, AssertionError(
+                f"{sender_cls.__name__} statuses: got = {statuses}"
+            )
+            assert max(attempts) > 1, AssertionError(
+                f"{sender_cls.__name__} attempts: got = {attempts}"
+            )
+        self._test_pool(receivers)
+        self._test_unknown()
+        print(f">> [{self.__class__.__name__}] OK.")
+
+    def _test_unknown(self):
+        # DATA 之后断开连接：邮件可能已经被接受，每个收件人只能发送一次 DATA，结果记录为 RECONCILE
+        receivers = [f"user{i}@example.com" for i in range(3)]
+        with SMTPSink(disconnect_rate=1.) as sink, tempfile.TemporaryDirectory() as tmp_dir:
+            user_path = _write_sink_user(Path(tmp_dir) / 'user.json', sink)
+            done_path = Path(tmp_dir) / 'jobs_done.csv'
+            BatchSender(user_path, self._template_path, None, done_path,
+                        receivers=receivers, gap_time=0,
+                        retry={'max_attempts': 3, 'base_delay': 0.01, 'jitter': 0}).run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                rows = [(row['EMAIL'], row['STATUS'], row['ATTEMPTS']) for row in csv.DictReader(f)]
+            stats = sink.get_stats()
+        expected = [(re, 'RECONCILE', '1') for re in receivers]
+        assert rows == expected, AssertionError(f"Jobs done: got = {rows}, expected = {expected}")
+        assert stats['data'] == len(receivers), AssertionError(f"DATA sent: {stats}")
+
+    def _test_pool(self, receivers):
+        # AccountPool 的每个账号用 BatchSender 发送，同样会重试并记录发送次数
+        with SMTPSink(fail_rate=0.3, fail_codes=[450], seed=1) as sink, \
+                tempfile.TemporaryDirectory() as tmp_dir:
+            user_paths = []
+            for i in range(2):
+                user_paths.append(_write_sink_user(Path(tmp_dir) / f"user{i}.json", sink,
+                                                   email=f"user{i}@server.com"))
+            job_path = Path(tmp_dir) / 'jobs_batch_0.csv'
+            with open(job_path, 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+                f.writelines(f"{re}\n" for re in receivers)
+            done_path = Path(tmp_dir) / 'jobs_done.csv'
+            AccountPool(user_paths, self._template_path, [job_path], done_path, gap_time=0,
+                        rate_limit={'backoff': 0.01, 'max_backoff': 0.01},
+                        sender={'retry': {'max_attempts': 20, 'base_delay': 0.01, 'jitter': 0}}).run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+        statuses = {row['EMAIL']: row['STATUS'] for row in rows}
+        attempts = [int(row['ATTEMPTS']) for row in rows]
+        assert len(rows) == len(receivers) and set(statuses.values()) == {'OK'}, AssertionError(
+            f"AccountPool statuses: got = {statuses}"
+        )
+        assert max(attempts) > 1, AssertionError(f"AccountPool attempts: got = {attempts}")
+
+
+class TestMetricsBySink(object):
+
+    def __init__(self, data_dir):
+        self._template_path = Path(data_dir) / 'template_example.txt'
+
+    def test(self):
+        receivers = [f"user{i}@example{i % 2}.com" for i in range(6)]
+        with SMTPSink(max_messages=4) as sink, tempfile.TemporaryDirectory() as tmp_dir:
+            user_path = _write_sink_user(Path(tmp_dir) / 'user.json', sink)
+            metrics = Metrics()
+            BatchSender(user_path, self._template_path, None, Path(tmp_dir) / 'jobs_done.csv',
+                        receivers=receivers, gap_time=0, metrics=metrics,
+                        metrics_path=Path(tmp_dir) / 'metrics').run()
+            with open(Path(tmp_dir) / 'metrics.prom', 'r', encoding='utf-8') as f:
+                prom = f.read()
+            with open(Path(tmp_dir) / 'metrics.json', 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        for phase in ('connect', 'login', 'build', 'serialize', 'data'):
+            assert f'phase="{phase}"' in prom, AssertionError(f"Phase `{phase}` missing in prometheus file")
+        expected = 'email_sender_messages_total{account="user@server.com",domain="example0.com",status="OK"} 3'
+        assert expected in prom, AssertionError(f"Counter missing: {expected}")
+        # 第 5 封邮件时服务器返回 421，重连一次，加上第一次连接共 2 次
+        assert summary['phases']['login']['count'] == 2, AssertionError(
+            f"Login count: got = {summary['phases']['login']['count']}, expected = 2"
+        )
+        assert summary['phases']['data']['count'] == 6 and summary['messages'] == {'OK': 6}, \
+            AssertionError(f"Summary: got = {summary}")
+        assert set(summary['domains']) == {'example0.com', 'example1.com'}, AssertionError(
+            f"Domains: got = {list(summary['domains'])}"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestAccountPoolBySimulator(object):
+
+    def __init__(self, data_dir, batch_size=3):
+        self._data_dir = Path(data_dir)
+        self._batch_size = batch_size
+
+    def _write_files(self, tmp_dir):
+        with open(self._data_dir / 'user_example.json', 'r', encoding='utf-8') as f:
+            conf = json.load(f)
+        user_paths = []
+        for i, quota in enumerate([1, 0]):
+            conf.update({'email': f"user{i}@server.com", 'hourly_quota': quota})
+            user_paths.append(tmp_dir / f"user{i}.json")
+            with open(user_paths[-1], 'w', encoding='utf-8') as f:
+                json.dump(conf, f)
+        jobs_paths = []
+        for i in range(2):
+            jobs_paths.append(tmp_dir / f"jobs_batch_{i}.csv")
+            with open(jobs_paths[-1], 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+                f.writelines(f"user{i}_{j}@example.com\n" for j in range(self._batch_size))
+        return user_paths, jobs_paths
+
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            user_paths, jobs_paths = self._write_files(tmp_dir)
+            done_path = tmp_dir / 'jobs_done.csv'
+            # user0 每小时只能发送 1 封，其余的由 user1 发送
+            pool = AccountPool(user_paths=user_paths,
+                               template_path=self._data_dir / 'template_example.txt',
+                               jobs_paths=jobs_paths,
+                               done_path=done_path,
+                               simulate=True,
+                               gap_time=0,
+                               max_wait=10)
+            pool.run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                got = sorted(row['EMAIL'] for row in csv.DictReader(f))
+        expected = sorted(f"user{i}_{j}@example.com"
+                          for i in range(2) for j in range(self._batch_size))
+        assert got == expected, AssertionError(
+            f"Jobs done: got = {got}, expected = {expected}"
+        )
         print(f">> [{self.__class__.__name__}] OK.")
 
 
@@ -161,3 +713,225 @@ class TestBatchSender(object):
         self._bs.run()
         print(f">> [{self.__class__.__name__}] OK.")
 
+
+
+class TestJobWorkerBySimulator(object):
+
+    def __init__(self, data_dir, batch_number=3, batch_size=2):
+        self._data_dir = Path(data_dir)
+        self._batch_number, self._batch_size = batch_number, batch_size
+
+    def _write_jobs(self, jobs_dir):
+        jobs_paths = []
+        for i in range(self._batch_number):
+            jobs_paths.append(jobs_dir / f"jobs_batch_{i}.csv")
+            with open(jobs_paths[-1], 'w', encoding='utf-8') as f:
+                f.write('EMAIL\n')
+                f.writelines(f"user{i}_{j}@example.com\n" for j in range(self._batch_size))
+        return jobs_paths
+
+    def _test_lease(self, jobs_dir, jobs_paths):
+        first, second = JobLease(jobs_dir), JobLease(jobs_dir)
+        claimed = [first.claim(), second.claim()]
+        assert claimed == jobs_paths[:2], AssertionError(f"Claimed: got = {claimed}")
+        # 租约过期后可以被接管
+        expired = JobLease(jobs_dir, lease_time=0)
+        taken = expired.claim()
+        assert taken == jobs_paths[2] and expired.renew(taken), AssertionError(f"Claimed: got = {taken}")
+        assert JobLease(jobs_dir).claim() == jobs_paths[2], AssertionError("Expired lease not taken over")
+        assert not expired.renew(taken), AssertionError("Lost lease renewed")
+        # 失败后等待 retry_delay，超过 max_failures 后不再领取
+        failing = JobLease(jobs_dir, retry_delay=0, max_failures=2)
+        first.release(jobs_paths[0])
+        for failures in (1, 2):
+            job_path = failing.claim()
+            assert job_path == jobs_paths[0], AssertionError(f"Claimed: got = {job_path}")
+            assert failing.fail(job_path) == failures
+        assert failing.claim() is None, AssertionError("Failed job claimed")
+        # 清除状态，交给 JobWorker 发送
+        for path in jobs_dir.glob('jobs_batch_*.csv.*'):
+            path.unlink()
+
+    def _test_renew_race(self):
+        """ 续租读到自己的租约之后、写入之前，租约被其他进程接管：续租失败，不覆盖接管者的锁文件 """
+
+        class RacedLease(JobLease):
+
+            race = False
+
+            def _new_lease(self):
+                if not self.race:
+                    return super()._new_lease()
+                other = JobLease(self._jobs_dir, lease_time=60)
+                lock_path = job_path.with_name(job_path.name + self.lock_suffix)
+                assert other._break(lock_path, self._read_lease(lock_path))
+                other._write_lease(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                self.other = other.owner
+                return super()._new_lease()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_dir = Path(tmp_dir)
+            job_path = self._write_jobs(jobs_dir)[0]
+            lease = RacedLease(jobs_dir)
+            assert lease.claim() == job_path
+            lease.race = True
+            renewed = lease.renew(job_path)
+            owner = lease._read_lease(job_path.with_name(job_path.name + JobLease.lock_suffix))['owner']
+        assert not renewed and owner == lease.other, AssertionError(
+            f"Renew race: renewed = {renewed}, owner = {owner}"
+        )
+
+    def _test_lost_lease(self):
+        """ 发送期间租约被其他进程接管：停止发送，不标记完成 """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_dir = Path(tmp_dir)
+            done_path = jobs_dir / 'jobs_done.csv'
+            job_path = self._write_jobs(jobs_dir)[0]
+            lease = JobLease(jobs_dir, lease_time=0.3)
+            assert lease.claim() == job_path
+            worker = JobWorker(jobs_dir=jobs_dir,
+                               user_path=self._data_dir / 'user_example.json',
+                               template_path=self._data_dir / 'template_example.txt',
+                               done_path=done_path,
+                               sender={'simulate': True, 'gap_time': 0})
+            # 第一个收件人发送期间（约 0.6 秒），锁文件被其他进程替换（例如本进程曾长时间停顿，租约过期后被接管）
+            lock_path = job_path.with_name(job_path.name + JobLease.lock_suffix)
+            takeover = Timer(0.2, lambda: lock_path.write_text(
+                json.dumps({'owner': 'other', 'expires': time() + 60}), encoding='utf-8'))
+            takeover.start()
+            worker._process(lease, job_path, Metrics(), 0)
+            takeover.join()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                got = [row['EMAIL'] for row in csv.DictReader(f)]
+            finished = job_path.with_name(job_path.name + JobLease.done_suffix).exists()
+        assert len(got) < self._batch_size and not finished, AssertionError(
+            f"Lost lease: sent = {got}, finished = {finished}"
+        )
+
+    def test(self):
+        self._test_renew_race()
+        self._test_lost_lease()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs_dir = Path(tmp_dir)
+            done_path = jobs_dir / 'jobs_done.csv'
+            jobs_paths = self._write_jobs(jobs_dir)
+            self._test_lease(jobs_dir, jobs_paths)
+
+            JobWorker(jobs_dir=jobs_dir,
+                      user_path=self._data_dir / 'user_example.json',
+                      template_path=self._data_dir / 'template_example.txt',
+                      done_path=done_path,
+                      processes=2,
+                      exit_when_idle=True,
+                      sender={'simulate': True, 'gap_time': 0}).run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                got = sorted(row['EMAIL'] for row in csv.DictReader(f))
+            done = sorted(p.name for p in jobs_dir.glob('*.done'))
+            left = sorted(p.name for p in jobs_dir.glob('*.lock'))
+
+        expected = sorted(f"user{i}_{j}@example.com"
+                          for i in range(self._batch_number) for j in range(self._batch_size))
+        assert got == expected, AssertionError(f"Jobs done: got = {got}, expected = {expected}")
+        assert done == [f"{p.name}.done" for p in jobs_paths] and not left, AssertionError(
+            f"Job status: done = {done}, locked = {left}"
+        )
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestLazyImport(object):
+
+    # 导入这些模块后不应该导入的模块
+    _heavy = ('smtplib', 'socks', 'asyncio', 'sqlite3', 'concurrent.futures.process')
+
+    def __init__(self):
+        self._root = Path(__file__).resolve().parents[1]
+
+    def _imported(self, code):
+        check = f"import sys\n{code}\nprint('imported:', *(m for m in {self._heavy!r} if m in sys.modules))"
+        res = subprocess.run([sys.executable, '-c', check], cwd=self._root,
+                             capture_output=True, text=True, check=True)
+        return res.stdout.splitlines()[-1][len('imported:'):].strip()
+
+    @staticmethod
+    def _test_pool_args():
+        import cli
+        # 多个账号只能和 --job 一起使用，不能静默忽略其他的发送方式
+        for argv in (['--to', 'a@example.com'], ['--batch', '0'], ['--worker'], ['--concurrency', '2']):
+            argv = ['send', '--user', 'a.json', 'b.json', '--template', 't.txt', *argv]
+            try:
+                with redirect_stderr(io.StringIO()):
+                    cli.main(argv)
+            except SystemExit as e:
+                assert e.code == 2, AssertionError(f"{argv}: exit code = {e.code}")
+            else:
+                raise AssertionError(f"{argv}: not rejected")
+
+    def test(self):
+        self._test_pool_args()
+        for code in ("import sender, scheduler, runner",
+                     "import cli; cli.main(['stats', '--jobs-dir', 'data/examples'])"):
+            got = self._imported(code)
+            assert got == '', AssertionError(f"`{code}` imported: {got}")
+        got = self._imported("from sender import BatchSender")
+        assert 'smtplib' in got, AssertionError(f"BatchSender not loaded: {got}")
+        print(f">> [{self.__class__.__name__}] OK.")
+
+
+class TestProxyPoolBySink(object):
+
+    def __init__(self, data_dir):
+        self._template_path = Path(data_dir) / 'template_example.txt'
+
+    @staticmethod
+    def _test_load(tmp_dir):
+        path = Path(tmp_dir) / 'proxy.json'
+        cases = [
+            ({'host': '127.0.0.1', 'port': 1234}, 1),  # 原来的格式
+            ({'host': '', 'port': 1234}, None),
+            ([{'host': '127.0.0.1', 'port': 1}, {'host': '127.0.0.2', 'port': 2, 'type': 'http'}], 2),
+            ({'proxies': [{'host': '127.0.0.1', 'port': 1}, {'host': '', 'port': 2}]}, 1),
+        ]
+        for data, expected in cases:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            pool = ProxyPool.load(path)
+            got = None if pool is None else len(pool)
+            assert got == expected, AssertionError(f"Load {data}: got = {got}, expected = {expected}")
+
+    @staticmethod
+    def _get_closed_port():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    def test(self):
+        receivers = [f"user{i}@example{i % 3}.com" for i in range(12)]
+        with SMTPSink() as sink, SocksSink() as fast, SocksSink(latency=0.05) as slow, \
+                SocksSink(reject=True) as broken, tempfile.TemporaryDirectory() as tmp_dir:
+            self._test_load(tmp_dir)
+            tmp_dir = Path(tmp_dir)
+            user_path = _write_sink_user(tmp_dir / 'user.json', sink)
+            proxies = [{'host': '127.0.0.1', 'port': p.port} for p in (fast, slow, broken)]
+            proxies.append({'host': '127.0.0.1', 'port': self._get_closed_port()})
+            with open(tmp_dir / 'proxy.json', 'w', encoding='utf-8') as f:
+                json.dump({'proxies': proxies}, f)
+            done_path = tmp_dir / 'jobs_done.csv'
+            # 每个连接只发送 1 封邮件，每个收件人都需要通过代理池建立一个新的连接
+            AsyncBatchSender(user_path, self._template_path, None, done_path,
+                             receivers=receivers, gap_time=0, concurrency=4,
+                             session={'max_messages': 1}).run()
+            with open(done_path, 'r', encoding='utf-8') as f:
+                statuses = {row['EMAIL']: row['STATUS'] for row in csv.DictReader(f)}
+            relayed = {'fast': fast.get_stats()['connections'], 'slow': slow.get_stats()['connections']}
+            connections = sink.get_stats()['connections']
+
+        assert len(statuses) == len(receivers) and set(statuses.values()) == {'OK'}, AssertionError(
+            f"Statuses: got = {statuses}"
+        )
+        # 健康检查的连接也经过代理，同样被 SMTPSink 计数
+        assert relayed['fast'] + relayed['slow'] == connections, AssertionError(
+            f"Relayed: got = {relayed}, SMTP connections = {connections}"
+        )
+        assert relayed['fast'] > relayed['slow'] >= 1, AssertionError(f"Relayed: got = {relayed}")
+        assert socket.socket is not socks.socksocket, AssertionError("socket module patched")
+        print(f">> [{self.__class__.__name__}] OK.")
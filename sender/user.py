@@ -12,6 +12,8 @@ class User(object):
         self.server = conf['server']
         self.port = int(conf['port'])
         self.ssl = conf['ssl']
+        self.daily_quota = int(conf.get('daily_quota', 0))  # 每天（24小时）的发送上限，0: 不限制
+        self.hourly_quota = int(conf.get('hourly_quota', 0))  # 每小时的发送上限，0: 不限制
 
     def _load_conf(self):
         try:
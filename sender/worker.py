@@ -0,0 +1,328 @@
+import json
+import multiprocessing
+import os
+import socket
+import uuid
+from pathlib import Path
+from threading import Event, Thread
+from time import sleep, time
+
+from .sender import BatchSender, AsyncBatchSender
+from .metrics import Metrics
+from .log import logger
+
+
+class JobLease(object):
+
+    """
+    用锁文件领取 job 文件，同一台机器上的多个进程（或多个 JobWorker）不会同时发送同一个批次。
+    1、领取：用 O_CREAT | O_EXCL 创建 `<job 文件名>.lock`，创建成功的进程得到批次，文件中记录持有者和租约的到期时间；
+    2、续租：发送期间定期延长到期时间；持有者崩溃后租约过期，其他进程可以接管；
+    3、完成：创建 `<job 文件名>.done`，删除锁文件，批次不会再被领取；
+    4、失败：`<job 文件名>.failed` 中的失败次数加 1，删除锁文件，retry_delay 秒后可以重新领取，
+       失败 max_failures 次后不再领取，需要人工处理。
+    """
+
+    _config = {
+        'pattern': 'jobs_batch_*.csv',  # job 文件名的格式
+        'lease_time': 600,  # 租约的时长（秒），超过该时长没有续租视为持有者已经崩溃
+        'max_failures': 3,  # 同一个批次的失败次数上限
+        'retry_delay': 300,  # 失败后重新领取的等待时长（秒）
+    }
+
+    lock_suffix = '.lock'
+    done_suffix = '.done'
+    failed_suffix = '.failed'
+
+    def __init__(self, jobs_dir, **kwargs):
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._jobs_dir = Path(jobs_dir)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def lease_time(self):
+        return self._config['lease_time']
+
+    @staticmethod
+    def _with_suffix(job_path, suffix):
+        return job_path.with_name(job_path.name + suffix)
+
+    def _read_lease(self, lock_path):
+        """ :return: dict {'owner': 持有者, 'expires': 到期时间}，锁文件不存在时返回 None """
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # 持有者刚创建文件还没有写入，或者写入时崩溃：按文件的修改时间计算租约
+            try:
+                mtime = lock_path.stat().st_mtime
+            except FileNotFoundError:
+                return None
+            return {'owner': None, 'expires': mtime + self._config['lease_time']}
+
+    def _get_failures(self, job_path):
+        try:
+            with open(self._with_suffix(job_path, self.failed_suffix), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _is_pending(self, job_path):
+        """ 没有完成、没有超过失败次数，并且不在失败后的等待期内 """
+        if self._with_suffix(job_path, self.done_suffix).exists():
+            return False
+        failed_path = self._with_suffix(job_path, self.failed_suffix)
+        if not failed_path.exists():
+            return True
+        if self._get_failures(job_path) >= self._config['max_failures']:
+            return False
+        return failed_path.stat().st_mtime + self._config['retry_delay'] <= time()
+
+    def _new_lease(self):
+        return {'owner': self.owner, 'expires': time() + self._config['lease_time']}
+
+    def _write_lease(self, path, flags):
+        fd = os.open(path, flags, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._new_lease(), f)
+
+    def _break(self, lock_path, lease):
+        """
+        接管过期的租约：先把锁文件改名（只有一个进程能改名成功），再检查改名的是不是刚才读到的过期租约，
+        如果其他进程已经在这期间领取了批次，把它的锁文件还原。
+        """
+        stale_path = self._with_suffix(lock_path, f".{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            return False
+        try:
+            if self._read_lease(stale_path) != lease:
+                try:
+                    os.link(stale_path, lock_path)
+                except FileExistsError:
+                    pass
+                return False
+            return True
+        finally:
+            os.remove(stale_path)
+
+    def _acquire(self, job_path):
+        lock_path = self._with_suffix(job_path, self.lock_suffix)
+        lease = self._read_lease(lock_path)
+        if lease is not None:
+            if lease['expires'] > time():
+                return False
+            if not self._break(lock_path, lease):
+                return False
+            logger.warning(job=job_path.name, action="lease expired", owner=lease['owner'])
+        try:
+            self._write_lease(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        return True
+
+    def claim(self):
+        """
+        领取一个批次。
+        :return: job 文件路径，没有可领取的批次时返回 None
+        """
+        for job_path in sorted(self._jobs_dir.glob(self._config['pattern'])):
+            if self._is_pending(job_path) and self._acquire(job_path):
+                return job_path
+        return None
+
+    def holds(self, job_path):
+        lease = self._read_lease(self._with_suffix(Path(job_path), self.lock_suffix))
+        return lease is not None and lease['owner'] == self.owner
+
+    def renew(self, job_path):
+        """
+        延长租约：通过打开的锁文件原地改写，不替换文件，
+        其他进程在检查和写入之间接管租约（_break 改名后重新创建锁文件）时不会覆盖它的锁文件。
+        :return: False 表示租约已经被其他进程接管
+        """
+        lock_path = self._with_suffix(Path(job_path), self.lock_suffix)
+        try:
+            fd = os.open(lock_path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        with os.fdopen(fd, 'r+', encoding='utf-8') as f:
+            try:
+                lease = json.load(f)
+            except ValueError:
+                return False
+            if lease.get('owner') != self.owner:
+                return False
+            lease = self._new_lease()
+            f.seek(0)
+            f.truncate()
+            json.dump(lease, f)
+            f.flush()
+            # 写入期间锁文件被改名接管时，写入的是改名后的旧文件，路径指向的已经不是这个文件
+            try:
+                return os.path.samestat(os.fstat(fd), os.stat(lock_path))
+            except FileNotFoundError:
+                return False
+
+    def release(self, job_path):
+        """ 释放租约，批次放回队列（不计入失败次数），例如进程被中断时 """
+        job_path = Path(job_path)
+        if self.holds(job_path):
+            os.remove(self._with_suffix(job_path, self.lock_suffix))
+
+    def finish(self, job_path):
+        """ 标记批次已完成并释放租约 """
+        job_path = Path(job_path)
+        self._with_suffix(job_path, self.done_suffix).touch()
+        failed_path = self._with_suffix(job_path, self.failed_suffix)
+        if failed_path.exists():
+            failed_path.unlink()
+        self.release(job_path)
+
+    def fail(self, job_path):
+        """
+        记录一次失败并释放租约。
+        :return: 批次累计的失败次数
+        """
+        job_path = Path(job_path)
+        failures = self._get_failures(job_path) + 1
+        with open(self._with_suffix(job_path, self.failed_suffix), 'w') as f:
+            f.write(str(failures))
+        self.release(job_path)
+        return failures
+
+
+class JobWorker(object):
+
+    """
+    常驻的发送进程：监视 jobs_dir，用 JobLease 领取 jobs_batch_*.csv，在 processes 个子进程中并行发送。
+    1、每个子进程循环：领取批次 -> 发送（BatchSender，开启 journal） -> 标记完成；
+       没有可领取的批次时等待 poll_time 秒后重新检查，scheduler 新生成的批次会被自动领取；
+    2、发送期间由后台线程续租；发送抛出异常时记录失败，批次在 retry_delay 秒后重新领取；
+    3、进程崩溃时租约过期后由其他进程接管，journal 保证已发送的收件人不会重发；
+    4、所有子进程的结果写入同一个 jobs_done 文件（ResultWriter 用文件锁保证多个进程写入不交错）。
+    同一台机器上可以同时运行多个 JobWorker，同一个批次只会被一个进程发送。
+    """
+
+    _config = {
+        'processes': 2,  # 发送的子进程数量
+        'poll_time': 10,  # 没有可领取的批次时，重新检查的间隔时长（秒）
+        'exit_when_idle': False,  # True: 没有可领取的批次时子进程退出，用于一次性发送和测试
+        'concurrency': 1,  # 每个子进程中同一个账号的并发会话数量，大于 1 时使用 AsyncBatchSender
+        'lease': {},  # JobLease 的参数，例如 {'lease_time': 300, 'max_failures': 5}
+        'sender': {},  # BatchSender 的参数，例如 {'gap_time': 10, 'retry': {'max_attempts': 5}}
+        'metrics_path': None,  # 不为空时，每个子进程把耗时统计导出到 `<metrics_path>_<子进程序号>`
+    }
+
+    def __init__(self, jobs_dir, user_path, template_path, done_path, **kwargs):
+        """
+        :param jobs_dir: job 文件所在的文件夹
+        :param user_path: 用户配置文件的路径
+        :param template_path: 模板文件路径
+        :param done_path: jobs_done 文件的路径
+        """
+        self._config = dict(self._config)
+        for k, v in kwargs.items():
+            if k in self._config.keys():
+                self._config[k] = v
+            else:
+                raise ValueError(f"Wrong input parameter `{k}`!")
+
+        self._jobs_dir = Path(jobs_dir)
+        self._user_path = Path(user_path)
+        self._template_path = Path(template_path)
+        self._done_path = Path(done_path)
+
+    def _keep_lease(self, lease, job_path, stopped, lost):
+        """ 定期续租，租约被其他进程接管时设置 lost，发送者在下一个发送单元之前停止 """
+        interval = lease.lease_time / 3
+        while not stopped.wait(interval):
+            if not lease.renew(job_path):
+                logger.warning(job=job_path.name, action="lease lost")
+                lost.set()
+                return
+
+    def _send(self, job_path, metrics, index, lost):
+        sender_cls = BatchSender
+        kwargs = {**self._config['sender'], 'journal': True, 'metrics': metrics, 'stop': lost}
+        if self._config['concurrency'] > 1:
+            sender_cls = AsyncBatchSender
+            kwargs['concurrency'] = self._config['concurrency']
+        if self._config['metrics_path']:
+            kwargs['metrics_path'] = f"{self._config['metrics_path']}_{index}"
+        sender_cls(user_path=self._user_path,
+                   template_path=self._template_path,
+                   receivers_path=job_path,
+                   done_path=self._done_path,
+                   **kwargs).run()
+
+    def _process(self, lease, job_path, metrics, index):
+        logger.info(worker=index, job=job_path.name, action="job claimed")
+        stopped, lost = Event(), Event()
+        keeper = Thread(target=self._keep_lease, args=(lease, job_path, stopped, lost), daemon=True)
+        keeper.start()
+        try:
+            try:
+                self._send(job_path, metrics, index, lost)
+            finally:
+                stopped.set()
+                keeper.join()
+        except Exception as e:
+            failures = lease.fail(job_path)
+            logger.warning(worker=index, job=job_path.name, action="job failed",
+                           failures=failures, error=repr(e))
+        except BaseException:
+            # 被中断（KeyboardInterrupt 等）：放回队列，journal 中已完成的收件人不会重发
+            lease.release(job_path)
+            raise
+        else:
+            if lost.is_set():
+                # 批次已经由其他进程接管，不标记完成，剩余的收件人由接管的进程从 journal 继续发送
+                logger.warning(worker=index, job=job_path.name, action="job aborted")
+                return
+            lease.finish(job_path)
+            logger.info(worker=index, job=job_path.name, action="job finished")
+
+    def _work(self, index):
+        lease = JobLease(self._jobs_dir, **self._config['lease'])
+        metrics = Metrics()
+        try:
+            while True:
+                job_path = lease.claim()
+                if job_path is None:
+                    if self._config['exit_when_idle']:
+                        return
+                    sleep(self._config['poll_time'])
+                    continue
+                self._process(lease, job_path, metrics, index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.close()
+
+    def run(self):
+        logger.info(action="worker started", jobs_dir=self._jobs_dir,
+                    processes=self._config['processes'])
+        processes = [multiprocessing.Process(target=self._work, args=(i,), name=f"sender-worker-{i}")
+                     for i in range(self._config['processes'])]
+        for p in processes:
+            p.start()
+        try:
+            for p in processes:
+                p.join()
+        except KeyboardInterrupt:
+            # 子进程也会收到中断，等待它们释放租约后退出
+            for p in processes:
+                p.join(10)
+                if p.is_alive():
+                    p.terminate()
+        logger.info(action="worker stopped", jobs_dir=self._jobs_dir)
@@ -1,28 +1,52 @@
+import tempfile
+
 from sender.test import *
 from scheduler.test import *
+from sender.log import logger
 
 
 class RunTest:
 
     data_dir = "data/examples"
-    done_dir = "data/logs"
 
     @classmethod
     def test_scheduler(cls):
         TestEmailClassifier(cls.data_dir).test()
+        TestDoneIndex(cls.data_dir).test()
+        TestDomainMatcher().test()
         TestJobScheduler(cls.data_dir).test()
+        TestStreamJobScheduler(cls.data_dir).test()
+        TestMXGrouper(cls.data_dir).test()
+        TestAddressCleaner().test()
+        TestIngest().test()
+        TestJobStore(cls.data_dir).test()
 
     @classmethod
     def test_sender(cls):
         TestUser(cls.data_dir).test()
+        TestLogger().test()
         TestMessage(cls.data_dir).test()
-        TestBatchSenderBySimulator(cls.data_dir, cls.done_dir).test()
+        TestTemplate(cls.data_dir).test()
+        TestAttachmentCache(cls.data_dir).test()
+        TestRateLimiter().test()
+        TestResultWriter().test()
+        TestEmailSenderBySink(cls.data_dir).test()
+        TestBatchSenderBySimulator(cls.data_dir).test()
+        TestAsyncBatchSenderBySimulator(cls.data_dir).test()
+        TestAccountPoolBySimulator(cls.data_dir).test()
+        TestEnvelopeBySimulator(cls.data_dir).test()
+        TestSendJournalBySimulator(cls.data_dir).test()
+        TestRetryBySink(cls.data_dir).test()
+        TestMetricsBySink(cls.data_dir).test()
+        TestJobWorkerBySimulator(cls.data_dir).test()
+        TestLazyImport().test()
+        TestProxyPoolBySink(cls.data_dir).test()
 
 
 if __name__ == '__main__':
-    RunTest.test_scheduler()
-    RunTest.test_sender()
-
-
-
-
+    # 日志写入临时文件夹，测试不修改 data/logs
+    with tempfile.TemporaryDirectory() as logs_dir:
+        logger.configure(file_dir=logs_dir)
+        RunTest.test_scheduler()
+        RunTest.test_sender()
+        logger.close()